@@ -0,0 +1,76 @@
+"""Workers and stores indexes
+
+Revision ID: 4b7e2f9a1c3d
+Revises: fb1ce716e13c
+Create Date: 2026-10-18 17:40:12.512904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "4b7e2f9a1c3d"
+down_revision = "fb1ce716e13c"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY can't run inside a transaction block
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_workers_store_id_user_id",
+            "workers",
+            ["store_id", "user_id"],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_workers_store_id_rol_id_active",
+            "workers",
+            ["store_id", "rol_id"],
+            postgresql_where=sa.text("active IS true"),
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_workers_rol_id",
+            "workers",
+            ["rol_id"],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_stores_country_id",
+            "stores",
+            ["country_id"],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_stores_id_active",
+            "stores",
+            ["id"],
+            postgresql_where=sa.text("active IS true"),
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_stores_id_active", table_name="stores", postgresql_concurrently=True
+        )
+        op.drop_index(
+            "ix_stores_country_id", table_name="stores", postgresql_concurrently=True
+        )
+        op.drop_index(
+            "ix_workers_rol_id", table_name="workers", postgresql_concurrently=True
+        )
+        op.drop_index(
+            "ix_workers_store_id_rol_id_active",
+            table_name="workers",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_workers_store_id_user_id",
+            table_name="workers",
+            postgresql_concurrently=True,
+        )
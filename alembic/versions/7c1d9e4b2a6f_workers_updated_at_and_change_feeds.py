@@ -0,0 +1,53 @@
+"""Workers updated_at and change feed indexes
+
+Revision ID: 7c1d9e4b2a6f
+Revises: 4b7e2f9a1c3d
+Create Date: 2026-10-18 19:05:33.184210
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "7c1d9e4b2a6f"
+down_revision = "4b7e2f9a1c3d"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # now() is stable, so existing rows take the migration time without a rewrite
+    op.add_column(
+        "workers",
+        sa.Column(
+            "updated_at", sa.DateTime(), server_default=sa.text("now()"), nullable=True
+        ),
+    )
+    # CONCURRENTLY can't run inside a transaction block
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_stores_updated_at_id",
+            "stores",
+            ["updated_at", "id"],
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_workers_updated_at_store_id_user_id",
+            "workers",
+            ["updated_at", "store_id", "user_id"],
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_workers_updated_at_store_id_user_id",
+            table_name="workers",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_stores_updated_at_id", table_name="stores", postgresql_concurrently=True
+        )
+    op.drop_column("workers", "updated_at")
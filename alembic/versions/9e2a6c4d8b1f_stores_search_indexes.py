@@ -0,0 +1,51 @@
+"""Stores search indexes
+
+Revision ID: 9e2a6c4d8b1f
+Revises: 7c1d9e4b2a6f
+Create Date: 2026-10-18 21:12:47.530218
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "9e2a6c4d8b1f"
+down_revision = "7c1d9e4b2a6f"
+branch_labels = None
+depends_on = None
+
+# Must stay the same expression as store_search_text in the models, or the search
+# queries won't use the indexes
+SEARCH_TEXT = (
+    "lower(name || ' ' || legal_name || ' ' || coalesce(tax_id, '') || ' ' "
+    "|| zip_code || ' ' || email)"
+)
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # CONCURRENTLY can't run inside a transaction block. Both are built on
+    # expressions, so the table isn't rewritten nor locked against writes
+    with op.get_context().autocommit_block():
+        # Word and word prefix matches
+        op.execute(
+            "CREATE INDEX CONCURRENTLY ix_stores_search_document ON stores "
+            f"USING gin (to_tsvector('simple'::regconfig, {SEARCH_TEXT}))"
+        )
+        # Matches anywhere in the text, like part of a tax id or an email domain
+        op.execute(
+            "CREATE INDEX CONCURRENTLY ix_stores_search_text ON stores "
+            f"USING gin ({SEARCH_TEXT} gin_trgm_ops)"
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_stores_search_text", table_name="stores", postgresql_concurrently=True
+        )
+        op.drop_index(
+            "ix_stores_search_document",
+            table_name="stores",
+            postgresql_concurrently=True,
+        )
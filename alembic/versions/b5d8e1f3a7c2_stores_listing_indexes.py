@@ -0,0 +1,47 @@
+"""Stores listing indexes
+
+Revision ID: b5d8e1f3a7c2
+Revises: 9e2a6c4d8b1f
+Create Date: 2026-10-18 22:31:05.418377
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "b5d8e1f3a7c2"
+down_revision = "9e2a6c4d8b1f"
+branch_labels = None
+depends_on = None
+
+# One per sort key of GET /stores, alone and after country_id, so every filter and
+# sort combination walks an index in order instead of sorting
+INDEXES = {
+    "ix_stores_created_at_id": ["created_at", "id"],
+    "ix_stores_country_id_id": ["country_id", "id"],
+    "ix_stores_country_id_created_at_id": ["country_id", "created_at", "id"],
+    "ix_stores_country_id_updated_at_id": ["country_id", "updated_at", "id"],
+}
+
+
+def upgrade() -> None:
+    # CONCURRENTLY can't run inside a transaction block
+    with op.get_context().autocommit_block():
+        for name, columns in INDEXES.items():
+            op.create_index(name, "stores", columns, postgresql_concurrently=True)
+        # A prefix of ix_stores_country_id_id, it would only add to the writes
+        op.drop_index(
+            "ix_stores_country_id", table_name="stores", postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_stores_country_id",
+            "stores",
+            ["country_id"],
+            postgresql_concurrently=True,
+        )
+        for name in reversed(list(INDEXES)):
+            op.drop_index(name, table_name="stores", postgresql_concurrently=True)
@@ -0,0 +1,138 @@
+"""Workers and stores counters
+
+Revision ID: d3f7a2c9e5b1
+Revises: b5d8e1f3a7c2
+Create Date: 2026-10-18 23:48:19.207543
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "d3f7a2c9e5b1"
+down_revision = "b5d8e1f3a7c2"
+branch_labels = None
+depends_on = None
+
+# Counter table: (counted table, key columns, {count column: condition}). Must
+# stay the same as COUNTERS in the models
+COUNTERS = {
+    "store_worker_counts": (
+        "workers",
+        ("store_id", "rol_id"),
+        {"workers": None, "active_workers": "active"},
+    ),
+    "rol_worker_counts": (
+        "workers",
+        ("rol_id",),
+        {"workers": None, "active_workers": "active"},
+    ),
+    "country_store_counts": (
+        "stores",
+        ("country_id",),
+        {"stores": None, "active_stores": "active"},
+    ),
+}
+# Counters written by appending a row per change, folded by the app. Must stay the
+# same as FOLDED_COUNTERS in the models
+FOLDED_COUNTERS = ("rol_worker_counts", "country_store_counts")
+
+
+def count_rows(counter: str, sources: list) -> str:
+    table, keys, counts = COUNTERS[counter]
+    key_list = ", ".join(keys)
+    selects = []
+    for sign, source in sources:
+        columns = list(keys) + [
+            (
+                f"CASE WHEN {condition} THEN {sign} ELSE 0 END AS {count}"
+                if condition
+                else f"{sign} AS {count}"
+            )
+            for count, condition in counts.items()
+        ]
+        selects.append(f"SELECT {', '.join(columns)} FROM {source}")
+    statement = (
+        f"INSERT INTO {counter} ({key_list}, {', '.join(counts)}) "
+        f"SELECT {key_list}, {', '.join(f'sum({count})' for count in counts)} "
+        f"FROM ({' UNION ALL '.join(selects)}) AS changes "
+        f"GROUP BY {key_list} "
+        f"HAVING {' OR '.join(f'sum({count}) <> 0' for count in counts)}"
+    )
+    if counter in FOLDED_COUNTERS:
+        return statement
+    return (
+        f"{statement} ORDER BY {key_list} "
+        f"ON CONFLICT ({key_list}) DO UPDATE SET "
+        + ", ".join(
+            f"{count} = {counter}.{count} + excluded.{count}" for count in counts
+        )
+    )
+
+
+def upgrade() -> None:
+    op.create_table(
+        "store_worker_counts",
+        sa.Column("store_id", sa.Integer(), nullable=False),
+        sa.Column("rol_id", sa.Integer(), nullable=False),
+        sa.Column("workers", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("active_workers", sa.Integer(), server_default="0", nullable=False),
+        sa.ForeignKeyConstraint(["rol_id"], ["roles.id"]),
+        sa.ForeignKeyConstraint(["store_id"], ["stores.id"]),
+        sa.PrimaryKeyConstraint("store_id", "rol_id"),
+    )
+    op.create_table(
+        "rol_worker_counts",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("rol_id", sa.Integer(), nullable=False),
+        sa.Column("workers", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("active_workers", sa.Integer(), server_default="0", nullable=False),
+        sa.ForeignKeyConstraint(["rol_id"], ["roles.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_table(
+        "country_store_counts",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("country_id", sa.Integer(), nullable=False),
+        sa.Column("stores", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("active_stores", sa.Integer(), server_default="0", nullable=False),
+        sa.ForeignKeyConstraint(["country_id"], ["countries.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+    for counter, (table, _, _) in COUNTERS.items():
+        op.execute(
+            f"CREATE FUNCTION count_{counter}() RETURNS trigger "
+            "LANGUAGE plpgsql AS $$ BEGIN "
+            f"IF TG_OP = 'INSERT' THEN {count_rows(counter, [(1, 'new_rows')])}; "
+            "ELSIF TG_OP = 'UPDATE' THEN "
+            f"{count_rows(counter, [(1, 'new_rows'), (-1, 'old_rows')])}; "
+            f"ELSE {count_rows(counter, [(-1, 'old_rows')])}; "
+            "END IF; RETURN NULL; END $$"
+        )
+        for event, referencing in (
+            ("INSERT", "NEW TABLE AS new_rows"),
+            ("UPDATE", "OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+            ("DELETE", "OLD TABLE AS old_rows"),
+        ):
+            op.execute(
+                f"CREATE TRIGGER {counter}_{event.lower()} AFTER {event} ON {table} "
+                f"REFERENCING {referencing} FOR EACH STATEMENT "
+                f"EXECUTE FUNCTION count_{counter}()"
+            )
+
+    # The triggers keep writes to the counted tables waiting until this commits, so
+    # none is missed nor counted twice by the backfill
+    for counter, (table, _, _) in COUNTERS.items():
+        op.execute(count_rows(counter, [(1, table)]))
+
+
+def downgrade() -> None:
+    for counter, (table, _, _) in COUNTERS.items():
+        for event in ("insert", "update", "delete"):
+            op.execute(f"DROP TRIGGER {counter}_{event} ON {table}")
+        op.execute(f"DROP FUNCTION count_{counter}()")
+    op.drop_table("country_store_counts")
+    op.drop_table("rol_worker_counts")
+    op.drop_table("store_worker_counts")
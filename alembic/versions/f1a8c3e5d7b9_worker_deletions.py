@@ -0,0 +1,69 @@
+"""Worker deletions for the change feed
+
+Revision ID: f1a8c3e5d7b9
+Revises: d3f7a2c9e5b1
+Create Date: 2026-10-18 18:42:07.316254
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "f1a8c3e5d7b9"
+down_revision = "d3f7a2c9e5b1"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "worker_deletions",
+        sa.Column("store_id", sa.Integer(), nullable=False),
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column(
+            "deleted_at", sa.DateTime(), server_default=sa.text("now()"), nullable=False
+        ),
+        sa.ForeignKeyConstraint(["store_id"], ["stores.id"]),
+        sa.PrimaryKeyConstraint("store_id", "user_id"),
+    )
+    op.create_index(
+        "ix_worker_deletions_deleted_at_store_id_user_id",
+        "worker_deletions",
+        ["deleted_at", "store_id", "user_id"],
+    )
+    # Must stay the same as WORKER_DELETIONS_DDL in the models. A deleted worker
+    # gets a row, and loses it when it's created again
+    op.execute(
+        "CREATE FUNCTION record_worker_deletions() RETURNS trigger "
+        "LANGUAGE plpgsql AS $$ BEGIN "
+        "IF TG_OP = 'DELETE' THEN "
+        "INSERT INTO worker_deletions (store_id, user_id) "
+        "SELECT store_id, user_id FROM old_rows ORDER BY store_id, user_id "
+        "ON CONFLICT (store_id, user_id) DO UPDATE SET deleted_at = now(); "
+        "ELSE DELETE FROM worker_deletions USING new_rows "
+        "WHERE worker_deletions.store_id = new_rows.store_id "
+        "AND worker_deletions.user_id = new_rows.user_id; "
+        "END IF; RETURN NULL; END $$"
+    )
+    op.execute(
+        "CREATE TRIGGER worker_deletions_delete AFTER DELETE ON workers "
+        "REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT "
+        "EXECUTE FUNCTION record_worker_deletions()"
+    )
+    op.execute(
+        "CREATE TRIGGER worker_deletions_insert AFTER INSERT ON workers "
+        "REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT "
+        "EXECUTE FUNCTION record_worker_deletions()"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER worker_deletions_insert ON workers")
+    op.execute("DROP TRIGGER worker_deletions_delete ON workers")
+    op.execute("DROP FUNCTION record_worker_deletions()")
+    op.drop_index(
+        "ix_worker_deletions_deleted_at_store_id_user_id",
+        table_name="worker_deletions",
+    )
+    op.drop_table("worker_deletions")
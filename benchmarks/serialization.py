@@ -0,0 +1,123 @@
+# GET /stores serialization: pydantic models and response_model validation
+# against the orjson path, for pages of 10, 100 and 1000 stores
+#
+#   python -m benchmarks.serialization
+import argparse
+import asyncio
+import json
+import time
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from sqlalchemy import create_engine, insert, select
+
+from src.adapters.orm import Base
+from src.domain import schemas
+from src.domain.models import Store
+from src.entrypoints.main import app
+from src.handlers.stores import StoresHandler
+from src.utils.responses import stores_response
+
+get_stores_route = next(
+    route for route in app.routes if route.path == "/stores" and "GET" in route.methods
+)
+
+
+def load_rows(page_size: int) -> list:
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine, tables=[Store.__table__])
+    with engine.begin() as connection:
+        connection.execute(
+            insert(Store.__table__),
+            [
+                {
+                    "country_id": 1,
+                    "tax_id": f"76.{number:06d}-1",
+                    "name": f"Store {number}",
+                    "legal_name": f"Store {number} SpA",
+                    "address": "Av. Siempre Viva 742",
+                    "zip_code": "8320000",
+                    "email": f"store{number}@store.cl",
+                    "phone": "+56 2 2222 2222",
+                }
+                for number in range(page_size)
+            ],
+        )
+        return connection.execute(select(*StoresHandler.data_columns)).all()
+
+
+# What the route did before: a StoreData per row, then response_model validation
+async def pydantic_path(rows) -> bytes:
+    stores_list = [
+        schemas.StoreData(
+            id=store.id,
+            country_id=store.country_id,
+            tax_id=store.tax_id,
+            name=store.name,
+            legal_name=store.legal_name,
+            address=store.address,
+            zip_code=store.zip_code,
+            email=store.email,
+            phone=store.phone,
+            active=store.active,
+        )
+        for store in rows
+    ]
+    response = schemas.StoresList(stores=stores_list)
+    content = await serialize_response(
+        field=get_stores_route.secure_cloned_response_field,
+        response_content=response,
+    )
+    return JSONResponse(content).body
+
+
+async def orjson_path(rows) -> bytes:
+    return stores_response(rows, None).body
+
+
+async def per_call(path, rows, min_time: float) -> float:
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < min_time:
+        await path(rows)
+        calls += 1
+    return (time.perf_counter() - start) / calls
+
+
+async def run(page_sizes, min_time: float) -> dict:
+    results = {}
+    for page_size in page_sizes:
+        rows = load_rows(page_size)
+        assert json.loads(await pydantic_path(rows)) == json.loads(
+            await orjson_path(rows)
+        )
+        results[page_size] = {
+            "pydantic_ms": 1000 * await per_call(pydantic_path, rows, min_time),
+            "orjson_ms": 1000 * await per_call(orjson_path, rows, min_time),
+        }
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--page-sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--min-time", type=float, default=0.5)
+    parser.add_argument("--json", action="store_true", help="print raw results")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.page_sizes, args.min_time))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'page size':>10}{'pydantic ms':>14}{'orjson ms':>12}{'speedup':>10}")
+    for page_size, result in results.items():
+        pydantic_ms, orjson_ms = result["pydantic_ms"], result["orjson_ms"]
+        print(
+            f"{page_size:>10}{pydantic_ms:>14.3f}{orjson_ms:>12.3f}"
+            f"{pydantic_ms / orjson_ms:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import os
 from functools import lru_cache
+from typing import List
 from pydantic import BaseSettings
 
 
@@ -9,11 +10,54 @@ from pydantic import BaseSettings
 class Settings(BaseSettings):
     secret: str = os.getenv("SECRET")
     db_dialect: str = os.getenv("DB_DIALECT")
+    db_async_driver: str = os.getenv("DB_ASYNC_DRIVER", "asyncpg")
     db_host: str = os.getenv("DB_HOST")
     db_port: str = os.getenv("DB_PORT")
     db_name: str = os.getenv("DB_NAME")
     db_user: str = os.getenv("DB_USER")
     db_password: str = os.getenv("DB_PASSWORD")
+    db_pool_size: int = os.getenv("DB_POOL_SIZE", 5)
+    db_max_overflow: int = os.getenv("DB_MAX_OVERFLOW", 10)
+    db_pool_timeout: float = os.getenv("DB_POOL_TIMEOUT", 30)
+    db_pool_recycle: int = os.getenv("DB_POOL_RECYCLE", -1)
+    db_pool_pre_ping: bool = os.getenv("DB_POOL_PRE_PING", False)
+    # Use it when an external pooler like PgBouncer already pools the connections
+    db_null_pool: bool = os.getenv("DB_NULL_POOL", False)
+    # Milliseconds, 0 disables the timeout
+    db_statement_timeout: int = os.getenv("DB_STATEMENT_TIMEOUT", 0)
+    # Query counts and timings per request, in Server-Timing headers and /metrics
+    db_profiling: bool = os.getenv("DB_PROFILING", False)
+    # Milliseconds, statements slower than this are logged, 0 disables the log
+    db_slow_query_ms: float = os.getenv("DB_SLOW_QUERY_MS", 0)
+    # Comma separated async urls of read replicas, GET routes are balanced over them
+    db_replica_urls: str = os.getenv("DB_REPLICA_URLS", "")
+    # Seconds, replicas further behind don't serve reads. It's also how long clients
+    # keep reading from the primary after a write, so they always see their writes
+    db_replica_max_lag: float = os.getenv("DB_REPLICA_MAX_LAG", 5)
+    # Seconds between replica health and lag checks
+    db_replica_check_interval: float = os.getenv("DB_REPLICA_CHECK_INTERVAL", 5)
+    max_per_page: int = os.getenv("MAX_PER_PAGE", 100)
+    max_bulk_size: int = os.getenv("MAX_BULK_SIZE", 10000)
+    # Bytes of a line of a bulk NDJSON upload, longer lines are reported as errors
+    max_bulk_line_size: int = os.getenv("MAX_BULK_LINE_SIZE", 65536)
+    # Most ids the batch reads resolve in one request
+    max_lookup_size: int = os.getenv("MAX_LOOKUP_SIZE", 500)
+    # Seconds a worker rol is trusted for authorization, 0 disables the cache
+    rol_cache_ttl: float = os.getenv("ROL_CACHE_TTL", 30)
+    rol_cache_maxsize: int = os.getenv("ROL_CACHE_MAXSIZE", 10000)
+    # Seconds a cached store or worker is fresh in the shared tier, 0 disables it
+    cache_ttl: float = os.getenv("CACHE_TTL", 60)
+    # redis://host:port/db for the tier shared by all processes, none if empty
+    cache_url: str = os.getenv("CACHE_URL", "")
+    # Seconds each process keeps its own copy, how stale other processes can be
+    cache_local_ttl: float = os.getenv("CACHE_LOCAL_TTL", 1)
+    cache_local_maxsize: int = os.getenv("CACHE_LOCAL_MAXSIZE", 10000)
+    # Seconds between reloads of the countries and roles snapshots
+    reference_data_refresh_interval: int = os.getenv(
+        "REFERENCE_DATA_REFRESH_INTERVAL", 300
+    )
+    # Seconds between folds of the stats counters into a row per key
+    counters_fold_interval: float = os.getenv("COUNTERS_FOLD_INTERVAL", 10)
 
     class Config:
         env_file = ".env"
@@ -31,3 +75,17 @@ def get_settings() -> Settings:
 def get_db_url() -> str:
     settings = get_settings()
     return f"{settings.db_dialect}://{settings.db_user}:{settings.db_password}@{settings.db_host}:{settings.db_port}/{settings.db_name}"
+
+
+# Used by the application; Alembic keeps using the sync url above
+@lru_cache()
+def get_async_db_url() -> str:
+    settings = get_settings()
+    dialect = settings.db_dialect.split("+")[0]
+    return f"{dialect}+{settings.db_async_driver}://{settings.db_user}:{settings.db_password}@{settings.db_host}:{settings.db_port}/{settings.db_name}"
+
+
+@lru_cache()
+def get_replica_urls() -> List[str]:
+    urls = get_settings().db_replica_urls.split(",")
+    return [url.strip() for url in urls if url.strip()]
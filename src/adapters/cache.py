@@ -0,0 +1,309 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+import orjson
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import get_settings
+from src.adapters.unit_of_work import get_unit_of_work
+from src.utils.cache import TTLCache
+from src.utils.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+####### Shared tier #######
+
+
+# Stands in for Redis in tests and single process deployments
+class InMemorySharedCache:
+    def __init__(self, timer: Callable[[], float] = time.monotonic) -> None:
+        self.timer = timer
+        self._data: Dict[str, tuple] = {}
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= self.timer():
+            del self._data[key]
+            return None
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._data[key] = (self.timer() + ttl, value)
+
+    async def add(self, key: str, value: bytes, ttl: float) -> bool:
+        if await self.get(key) is not None:
+            return False
+        await self.set(key, value, ttl)
+        return True
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+class RedisSharedCache:
+    def __init__(self, url: str) -> None:
+        # Only needed when a shared cache is configured
+        from redis import asyncio as redis
+
+        self.client = redis.from_url(url)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await self.client.set(key, value, px=int(ttl * 1000))
+
+    async def add(self, key: str, value: bytes, ttl: float) -> bool:
+        return bool(await self.client.set(key, value, px=int(ttl * 1000), nx=True))
+
+    async def delete(self, *keys: str) -> None:
+        if keys:
+            await self.client.delete(*keys)
+
+    def clear(self) -> None:
+        pass
+
+
+def get_shared_cache():
+    url = get_settings().cache_url
+    if not url:
+        return None
+    if url == "memory://":
+        return InMemorySharedCache()
+    return RedisSharedCache(url)
+
+
+####### Entity cache #######
+
+
+# Read-through cache for single rows, like a store or a worker, as plain dicts.
+# The local tier saves the round trip to the shared one but other processes can't
+# invalidate it, so its ttl bounds how stale they can read after a write
+class EntityCache:
+    retry = object()
+
+    def __init__(
+        self,
+        name: str,
+        local: TTLCache,
+        shared=None,
+        ttl: float = 60,
+        lock_ttl: float = 5,
+        invalidation_delay: float = 0,
+        timer: Callable[[], float] = time.time,
+        flights: SingleFlight = None,
+    ) -> None:
+        self.name = name
+        # Wall clock, the freshness of shared entries is compared across hosts
+        self.timer = timer
+        self.local = local
+        self.shared = shared
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self.invalidation_delay = invalidation_delay
+        self.flights = flights or SingleFlight()
+        self.stale_hits = 0
+        self.shared_hits = 0
+        self.shared_errors = 0
+        self._pending = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def shared_key(self, key: Hashable) -> str:
+        parts = key if isinstance(key, tuple) else (key,)
+        return ":".join((self.name, *map(str, parts)))
+
+    # Rows loaded from a replica may be older than the last invalidation, so they
+    # are served but never cached, or a client reading its writes from the primary
+    # could get them from the cache
+    async def get(
+        self, key: Hashable, load: Callable[[], Awaitable[Any]], replica: bool = False
+    ) -> Any:
+        # Concurrent misses in this process wait for the first one to load the row,
+        # those on the primary don't join those on replicas, like in coalesce
+        flight = (self.name, key, replica)
+        if not self.enabled:
+            return await self.flights.do(flight, load)
+
+        value = self.local.get(key)
+        if value is not TTLCache.missing:
+            return value
+        fetch = self._fetch_fresh if replica else self._fetch_local
+        return await self.flights.do(flight, lambda: fetch(key, load))
+
+    # Only a fresh shared entry is taken, a replica never reloads it for the rest
+    async def _fetch_fresh(
+        self, key: Hashable, load: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        if self.shared is not None:
+            try:
+                entry = await self._get_shared(self.shared_key(key))
+            except Exception:
+                self._shared_failed()
+            else:
+                if entry is not None and entry["fresh_until"] > self.timer():
+                    self.shared_hits += 1
+                    return entry["value"]
+        return await load()
+
+    async def _fetch_local(
+        self, key: Hashable, load: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        value = await self._fetch(key, load)
+        self.local.set(key, value)
+        return value
+
+    async def _fetch(self, key: Hashable, load: Callable[[], Awaitable[Any]]) -> Any:
+        if self.shared is None:
+            return await load()
+
+        shared_key = self.shared_key(key)
+        try:
+            entry = await self._get_shared(shared_key)
+            if entry is not None and entry["fresh_until"] > self.timer():
+                self.shared_hits += 1
+                return entry["value"]
+            # Only the process holding the lock reloads an expired row, the rest
+            # keep serving the stale one meanwhile instead of all going to the db
+            locked = await self.shared.add(f"{shared_key}:lock", b"1", self.lock_ttl)
+        except Exception:
+            return await self._load_without_shared(load)
+
+        if not locked:
+            if entry is not None:
+                self.stale_hits += 1
+                return entry["value"]
+            entry = await self._wait_for_shared(shared_key)
+            if entry is not None:
+                self.shared_hits += 1
+                return entry["value"]
+
+        try:
+            value = await load()
+            await self._set_shared(shared_key, value)
+        finally:
+            if locked:
+                await self._unlock(shared_key)
+        return value
+
+    async def _get_shared(self, shared_key: str) -> Optional[dict]:
+        data = await self.shared.get(shared_key)
+        return orjson.loads(data) if data is not None else None
+
+    async def _set_shared(self, shared_key: str, value: Any) -> None:
+        entry = {"value": value, "fresh_until": self.timer() + self.ttl}
+        try:
+            # Kept past its ttl so it can be served while it is being reloaded
+            await self.shared.set(shared_key, orjson.dumps(entry), self.ttl * 2)
+        except Exception:
+            self._shared_failed()
+
+    async def _unlock(self, shared_key: str) -> None:
+        try:
+            await self.shared.delete(f"{shared_key}:lock")
+        except Exception:
+            self._shared_failed()
+
+    async def _wait_for_shared(self, shared_key: str) -> Optional[dict]:
+        for _ in range(10):
+            await asyncio.sleep(self.lock_ttl / 50)
+            try:
+                entry = await self._get_shared(shared_key)
+            except Exception:
+                self._shared_failed()
+                return None
+            if entry is not None:
+                return entry
+        return None
+
+    async def _load_without_shared(self, load: Callable[[], Awaitable[Any]]) -> Any:
+        self._shared_failed()
+        return await load()
+
+    def _shared_failed(self) -> None:
+        self.shared_errors += 1
+        logger.warning("The %s shared cache is not available", self.name, exc_info=True)
+
+    async def invalidate(self, *keys: Hashable) -> None:
+        for key in keys:
+            self.flights.forget(self.name, key)
+        if not self.enabled or not keys:
+            return
+        await self._delete(keys)
+        # Reads on the primary that started before the commit may cache the old
+        # row again, so it is deleted once more when they are over
+        if self.invalidation_delay:
+            loop = asyncio.get_running_loop()
+            loop.call_later(self.invalidation_delay, self._delete_later, keys)
+
+    def _delete_later(self, keys: tuple) -> None:
+        task = asyncio.ensure_future(self._delete(keys))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _delete(self, keys: tuple) -> None:
+        for key in keys:
+            self.local.invalidate(key)
+        if self.shared is None:
+            return
+        try:
+            await self.shared.delete(*(self.shared_key(key) for key in keys))
+        except Exception:
+            self._shared_failed()
+
+    def clear(self) -> None:
+        self.local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def stats(self) -> dict:
+        return {
+            **self.local.stats(),
+            "shared_hits": self.shared_hits,
+            "stale_hits": self.stale_hits,
+            "shared_errors": self.shared_errors,
+        }
+
+
+shared_cache = get_shared_cache()
+
+# Reads in flight in this process, shared by the entity caches and coalesce
+single_flight = SingleFlight()
+
+
+# Identical reads running at the same time share one query. The ones on the primary
+# don't join those on replicas, which may be behind, and reads inside a write
+# transaction run on their own, they may see its uncommitted rows
+async def coalesce(
+    db: AsyncSession, key: tuple, load: Callable[[], Awaitable[Any]]
+) -> Any:
+    if get_unit_of_work(db).active:
+        return await load()
+    return await single_flight.do((*key, db.info.get("replica", False)), load)
+
+
+def entity_cache(name: str) -> EntityCache:
+    settings = get_settings()
+    return EntityCache(
+        name,
+        TTLCache(
+            maxsize=settings.cache_local_maxsize,
+            ttl=settings.cache_local_ttl,
+        ),
+        shared_cache,
+        ttl=settings.cache_ttl,
+        invalidation_delay=settings.db_replica_max_lag,
+        flights=single_flight,
+    )
@@ -1,21 +1,379 @@
-from sqlalchemy import create_engine
+import asyncio
+import hashlib
+import logging
+import re
+from contextvars import ContextVar
+from time import perf_counter, time
+from typing import List, Optional
+
+from fastapi import Request
+from sqlalchemy import any_, create_engine, event, literal, literal_column, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
+
+from config import (
+    Settings,
+    get_async_db_url,
+    get_db_url,
+    get_replica_urls,
+    get_settings,
+)
 
-from config import get_db_url
+logger = logging.getLogger(__name__)
 
 SQLALCHEMY_DATABASE_URL = get_db_url()
+SQLALCHEMY_ASYNC_DATABASE_URL = get_async_db_url()
+
+
+####### Query profiling #######
+
+
+class RequestProfile:
+    def __init__(self) -> None:
+        self.queries = 0
+        self.db_time = 0.0
+        self.pool_wait = 0.0
+
+
+# Set by the profiling middleware, the listeners below add to the current request
+current_profile: ContextVar[Optional[RequestProfile]] = ContextVar(
+    "current_profile", default=None
+)
+
+
+# Checkouts can't be timed with pool events, they fire once the connection is out
+def timed_pool(poolclass):
+    class TimedPool(poolclass):
+        def connect(self):
+            started = perf_counter()
+            try:
+                return super().connect()
+            finally:
+                profile = current_profile.get()
+                if profile is not None:
+                    profile.pool_wait += perf_counter() - started
+
+    TimedPool.__name__ = f"Timed{poolclass.__name__}"
+    return TimedPool
+
+
+placeholders = re.compile(r"\$\d+|%\(\w+\)s|%s|\?")
+repeated_rows = re.compile(r"(\((?:\?, )*\?\))(?:, \((?:\?, )*\?\))+")
+in_lists = re.compile(r"IN \((?:\?, )*\?\)")
+
+
+# The same statement with any number of rows or IN values is normalized the same way
+def normalize_statement(statement: str) -> str:
+    normalized = placeholders.sub("?", " ".join(statement.split()))
+    normalized = in_lists.sub("IN (...)", normalized)
+    return repeated_rows.sub(r"\1", normalized)
+
+
+def fingerprint(statement: str) -> str:
+    return hashlib.sha1(normalize_statement(statement).encode()).hexdigest()[:12]
+
+
+class QueryProfiler:
+    def __init__(self, slow_query_ms: float = 0) -> None:
+        self.slow_query_ms = slow_query_ms
+        self.slow_queries = 0
+
+    def listen(self, target) -> None:
+        event.listen(target, "before_cursor_execute", self._before_execute)
+        event.listen(target, "after_cursor_execute", self._after_execute)
+
+    def remove(self, target) -> None:
+        event.remove(target, "before_cursor_execute", self._before_execute)
+        event.remove(target, "after_cursor_execute", self._after_execute)
 
+    def _before_execute(self, conn, *args) -> None:
+        conn.info.setdefault("query_started", []).append(perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, *args) -> None:
+        elapsed = perf_counter() - conn.info["query_started"].pop()
+        profile = current_profile.get()
+        if profile is not None:
+            profile.queries += 1
+            profile.db_time += elapsed
+
+        if self.slow_query_ms and elapsed * 1000 >= self.slow_query_ms:
+            self.slow_queries += 1
+            # Only the statement shape is logged, the bound values may hold user data
+            logger.warning(
+                "Slow query %s took %.1f ms: %s",
+                fingerprint(statement),
+                elapsed * 1000,
+                normalize_statement(statement),
+            )
+
+
+####### Engines #######
+
+
+def get_engine_options(settings: Settings) -> dict:
+    options = {"pool_pre_ping": settings.db_pool_pre_ping}
+    connect_args = {}
+
+    if settings.db_null_pool:
+        options["poolclass"] = NullPool
+        # Prepared statements don't survive an external pooler in transaction mode
+        connect_args["statement_cache_size"] = 0
+        connect_args["prepared_statement_cache_size"] = 0
+    else:
+        options["pool_size"] = settings.db_pool_size
+        options["max_overflow"] = settings.db_max_overflow
+        options["pool_timeout"] = settings.db_pool_timeout
+        options["pool_recycle"] = settings.db_pool_recycle
+
+    if settings.db_profiling:
+        options["poolclass"] = timed_pool(
+            options.get("poolclass", AsyncAdaptedQueuePool)
+        )
+
+    if settings.db_statement_timeout:
+        connect_args["server_settings"] = {
+            "statement_timeout": str(settings.db_statement_timeout)
+        }
+
+    if connect_args:
+        options["connect_args"] = connect_args
+    return options
+
+
+# Sync engine, kept for Alembic and scripts that can't run an event loop
 engine = create_engine(SQLALCHEMY_DATABASE_URL)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(
+    SQLALCHEMY_ASYNC_DATABASE_URL, **get_engine_options(get_settings())
+)
+
+AsyncSessionLocal = sessionmaker(
+    async_engine,
+    class_=AsyncSession,
+    autocommit=False,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
 Base = declarative_base()
 
 
-def get_db():
-    database = SessionLocal()
+async def get_db():
+    async with AsyncSessionLocal() as database:
+        yield database
+
+
+####### Read replicas #######
+
+# Replicas streaming from the primary that replayed all they received aren't
+# behind, even if the primary has been idle. One whose WAL receiver isn't streaming
+# can't tell how far behind it is, so it counts as infinitely behind until it
+# reconnects. The primary itself is never behind
+REPLICA_LAG_QUERY = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0 "
+    "WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') "
+    "THEN CAST('Infinity' AS float8) "
+    "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE coalesce(CAST(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) "
+    "AS float8), CAST('Infinity' AS float8)) END"
+)
+
+# Holds the time until which the client reads from the primary, set after writes
+READ_PRIMARY_COOKIE = "read_primary_until"
+
+
+class Replica:
+    def __init__(self, engine) -> None:
+        self.engine = engine
+        self.session_factory = sessionmaker(
+            engine,
+            class_=AsyncSession,
+            autocommit=False,
+            autoflush=False,
+            expire_on_commit=False,
+        )
+        # Replicas serve reads once a check finds them healthy
+        self.healthy = False
+        self.lag = 0.0
+
+    async def _get_lag(self) -> float:
+        async with self.engine.connect() as connection:
+            if connection.dialect.name != "postgresql":
+                return 0.0
+            return float(await connection.scalar(REPLICA_LAG_QUERY))
+
+    async def check(self, timeout: float) -> None:
+        try:
+            self.lag = await asyncio.wait_for(self._get_lag(), timeout)
+        except Exception:
+            if self.healthy:
+                logger.warning("Replica %r is not available", self.engine.url)
+            self.healthy = False
+        else:
+            self.healthy = True
+
+
+class ReplicaSet:
+    def __init__(self, replicas: List[Replica], max_lag: float) -> None:
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.turn = 0
+
+    def available(self) -> List[Replica]:
+        return [
+            replica
+            for replica in self.replicas
+            if replica.healthy and replica.lag <= self.max_lag
+        ]
+
+    # Round robin over the replicas in sync, None sends the read to the primary
+    def pick(self) -> Optional[Replica]:
+        available = self.available()
+        if not available:
+            return None
+        self.turn += 1
+        return available[self.turn % len(available)]
+
+    async def check(self, timeout: float) -> None:
+        await asyncio.gather(*(replica.check(timeout) for replica in self.replicas))
+
+
+replica_set = ReplicaSet(
+    [
+        Replica(create_async_engine(url, **get_engine_options(get_settings())))
+        for url in get_replica_urls()
+    ],
+    get_settings().db_replica_max_lag,
+)
+
+
+def reads_from_primary(request: Request) -> bool:
     try:
+        return float(request.cookies.get(READ_PRIMARY_COOKIE, 0)) > time()
+    except ValueError:
+        return False
+
+
+# For GET routes, they read from a replica unless the client wrote recently
+async def get_read_db(request: Request):
+    replica = None if reads_from_primary(request) else replica_set.pick()
+    session_factory = replica.session_factory if replica else AsyncSessionLocal
+    async with session_factory() as database:
+        database.info["replica"] = replica is not None
         yield database
-    finally:
-        database.close()
+
+
+# ON CONFLICT lives in the dialect specific insert constructs
+def get_insert(db: AsyncSession):
+    if db.bind.dialect.name == "sqlite":
+        return sqlite.insert
+    return postgresql.insert
+
+
+def supports_returning(db: AsyncSession) -> bool:
+    return db.bind.dialect.full_returning
+
+
+# Writes stamp their rows with now(), the start of their transaction, and the rows
+# only show when it commits, so a feed walking them by stamp could be past some of
+# them by then. Everything stamped before the oldest transaction still open has
+# committed or never will. SQLite has no such view, its writes run one at a time
+def settled_before(db: AsyncSession):
+    if db.bind.dialect.name != "postgresql":
+        return None
+    return literal_column(
+        "(SELECT CAST(min(xact_start) AS timestamp) FROM pg_stat_activity "
+        "WHERE datname = current_database())"
+    )
+
+
+# On PostgreSQL the ids go as one array parameter, so the statement is the same for
+# any number of them and its prepared plan is reused. Elsewhere it's an IN list
+def in_ids(db: AsyncSession, column, ids: list):
+    if db.bind.dialect.name == "postgresql":
+        return column == any_(literal(ids, postgresql.ARRAY(column.type)))
+    return column.in_(ids)
+
+
+# pysqlite only opens a transaction before DML and a released SAVEPOINT outside
+# one commits, so SQLite engines open their transactions themselves. IMMEDIATE
+# takes the write lock upfront, two readers can't deadlock upgrading to writers
+def use_sqlite_transactions(engine) -> None:
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "connect")
+    def disable_implicit_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(sync_engine, "begin")
+    def begin_immediate(connection):
+        # Straight on the driver, like the BEGIN other drivers send on their own
+        cursor = connection.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.close()
+
+
+####### Pool stats #######
+
+
+class PoolStats:
+    def __init__(self) -> None:
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+
+    @property
+    def checked_out(self) -> int:
+        return self.checkouts - self.checkins
+
+    def as_dict(self) -> dict:
+        return {
+            "connects": self.connects,
+            "checkouts": self.checkouts,
+            "checkins": self.checkins,
+            "checked_out": self.checked_out,
+            "invalidations": self.invalidations,
+        }
+
+    def listen(self, target) -> None:
+        event.listen(target, "connect", self._on_connect)
+        event.listen(target, "checkout", self._on_checkout)
+        event.listen(target, "checkin", self._on_checkin)
+        event.listen(target, "invalidate", self._on_invalidate)
+
+    def _on_connect(self, *args) -> None:
+        self.connects += 1
+
+    def _on_checkout(self, *args) -> None:
+        self.checkouts += 1
+
+    def _on_checkin(self, *args) -> None:
+        self.checkins += 1
+
+    def _on_invalidate(self, *args) -> None:
+        self.invalidations += 1
+
+
+pool_stats = PoolStats()
+pool_stats.listen(async_engine.sync_engine)
+for replica in replica_set.replicas:
+    pool_stats.listen(replica.engine.sync_engine)
+
+
+def get_pool_stats() -> dict:
+    stats = pool_stats.as_dict()
+    stats["pool"] = async_engine.pool.status()
+    return stats
+
+
+query_profiler = QueryProfiler(get_settings().db_slow_query_ms)
+if get_settings().db_profiling or get_settings().db_slow_query_ms:
+    query_profiler.listen(async_engine.sync_engine)
+    for replica in replica_set.replicas:
+        query_profiler.listen(replica.engine.sync_engine)
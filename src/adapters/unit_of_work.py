@@ -0,0 +1,75 @@
+import inspect
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Callable, List
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+
+# Handlers open a transaction for each write. Nested ones join the outermost, which
+# is the only one that commits, so a route can group several writes in one commit.
+class UnitOfWork:
+    def __init__(self, db: AsyncSession) -> None:
+        self.db = db
+        self.depth = 0
+        self.callbacks: List[Callable[[], Any]] = []
+
+    @property
+    def active(self) -> bool:
+        return self.depth > 0
+
+    @asynccontextmanager
+    async def transaction(self):
+        self.depth += 1
+        try:
+            yield self
+            if self.depth > 1:
+                # Pending ORM changes are written for the steps that follow
+                await self.db.flush()
+                return
+            await self.db.commit()
+        except BaseException:
+            if self.depth == 1:
+                self.callbacks = []
+                await self.db.rollback()
+            raise
+        finally:
+            self.depth -= 1
+
+        # The writes are committed by now, a failing callback can't undo them
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            await run_callback(callback)
+
+    # An error inside only rolls back to the savepoint, the transaction goes on
+    @asynccontextmanager
+    async def savepoint(self):
+        async with self.db.begin_nested():
+            yield self
+
+    # For work that must only see committed data, like cache invalidation
+    async def after_commit(self, callback: Callable[[], Any]) -> None:
+        if self.active:
+            self.callbacks.append(callback)
+        else:
+            await run_callback(callback)
+
+
+# Failures are logged and the rest of the callbacks still run, so the caller isn't
+# told that a committed write failed
+async def run_callback(callback: Callable[[], Any]) -> None:
+    try:
+        result = callback()
+        if inspect.isawaitable(result):
+            await result
+    except Exception:
+        logger.exception("An after commit callback failed")
+
+
+def get_unit_of_work(db: AsyncSession) -> UnitOfWork:
+    unit_of_work = db.info.get("unit_of_work")
+    if unit_of_work is None:
+        unit_of_work = db.info["unit_of_work"] = UnitOfWork(db)
+    return unit_of_work
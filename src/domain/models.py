@@ -1,16 +1,27 @@
 from sqlalchemy import (
+    DDL,
     Boolean,
     Column,
     DateTime,
+    Index,
     Integer,
     String,
     ForeignKey,
+    event,
     func,
+    literal_column,
 )
+from sqlalchemy.dialects import sqlite
 from sqlalchemy.orm import relationship
 
 from src.adapters.orm import Base
 
+# SQLite's CURRENT_TIMESTAMP has no microseconds, bound values are stored the same
+# way so that they compare correctly against it in the change feeds
+Timestamp = DateTime().with_variant(
+    sqlite.DATETIME(truncate_microseconds=True), "sqlite"
+)
+
 
 class Country(Base):
     __tablename__ = "countries"
@@ -24,6 +35,7 @@ class Store(Base):
     __tablename__ = "stores"
 
     id = Column(Integer, primary_key=True)
+    # Its lookups use ix_stores_country_id_id, which leads with it
     country_id = Column(Integer, ForeignKey("countries.id"), nullable=False)
     tax_id = Column(String, nullable=True, unique=True)
     name = Column(String, nullable=False)
@@ -33,10 +45,67 @@ class Store(Base):
     email = Column(String, nullable=False)
     phone = Column(String, nullable=True)
     active = Column(Boolean, default=False, server_default="false")
-    created_at = Column(DateTime, default=func.now(), server_default=func.now())
-    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+    created_at = Column(Timestamp, default=func.now(), server_default=func.now())
+    updated_at = Column(Timestamp, server_default=func.now(), onupdate=func.now())
     country = relationship("Country", backref="stores")
 
+    __table_args__ = (
+        Index(
+            "ix_stores_id_active",
+            id,
+            postgresql_where=active.is_(True),
+            sqlite_where=active.is_(True),
+        ),
+        # Serves the change feed, which walks the stores in (updated_at, id) order
+        Index("ix_stores_updated_at_id", updated_at, id),
+        # The stores listing, by each of its sort keys alone or within a country.
+        # The other filters are checked while walking them, in order
+        Index("ix_stores_created_at_id", created_at, id),
+        Index("ix_stores_country_id_id", country_id, id),
+        Index("ix_stores_country_id_created_at_id", country_id, created_at, id),
+        Index("ix_stores_country_id_updated_at_id", country_id, updated_at, id),
+    )
+
+
+# What the store search matches, lowercased. The trigram index is built on this
+# same expression, PostgreSQL only uses it for queries that repeat it, and it has
+# no bound values so prepared statements can use it too
+store_search_text = func.lower(
+    Store.name
+    + literal_column("' '")
+    + Store.legal_name
+    + literal_column("' '")
+    + func.coalesce(Store.tax_id, literal_column("''"))
+    + literal_column("' '")
+    + Store.zip_code
+    + literal_column("' '")
+    + Store.email
+)
+
+STORE_SEARCH_TEXT_SQL = (
+    "lower(name || ' ' || legal_name || ' ' || coalesce(tax_id, '') || ' ' "
+    "|| zip_code || ' ' || email)"
+)
+
+# The words of the text above. Its GIN index is built on this same expression,
+# so adding it doesn't rewrite the table as a stored column would. Ranking parses
+# the text of the matches again
+store_search_document = func.to_tsvector(
+    literal_column("'simple'::regconfig"), store_search_text
+)
+
+# SQLite has no tsvector nor GIN indexes, there the search scans the table
+for statement in (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX ix_stores_search_document ON stores USING gin "
+    f"(to_tsvector('simple'::regconfig, {STORE_SEARCH_TEXT_SQL}))",
+    "CREATE INDEX ix_stores_search_text ON stores USING gin "
+    f"({STORE_SEARCH_TEXT_SQL} gin_trgm_ops)",
+):
+    event.listen(
+        Store.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql")
+    )
+
 
 class Rol(Base):
     __tablename__ = "roles"
@@ -51,7 +120,229 @@ class Worker(Base):
 
     user_id = Column(Integer, primary_key=True)
     store_id = Column(Integer, ForeignKey("stores.id"), primary_key=True)
-    rol_id = Column(Integer, ForeignKey("roles.id"), nullable=False)
+    rol_id = Column(Integer, ForeignKey("roles.id"), nullable=False, index=True)
     active = Column(Boolean, default=True, server_default="true")
+    updated_at = Column(Timestamp, server_default=func.now(), onupdate=func.now())
     store = relationship("Store", backref="workers")
     rol = relationship("Rol", backref="workers")
+
+    __table_args__ = (
+        # The primary key leads with user_id, so it can't serve lookups by store
+        Index("ix_workers_store_id_user_id", store_id, user_id),
+        Index(
+            "ix_workers_store_id_rol_id_active",
+            store_id,
+            rol_id,
+            postgresql_where=active.is_(True),
+            sqlite_where=active.is_(True),
+        ),
+        Index("ix_workers_updated_at_store_id_user_id", updated_at, store_id, user_id),
+    )
+
+
+# A row per worker deleted and not created again, so the change feed can tell its
+# consumers to drop it. Triggers on workers keep it
+class WorkerDeletion(Base):
+    __tablename__ = "worker_deletions"
+
+    store_id = Column(Integer, ForeignKey("stores.id"), primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+    deleted_at = Column(Timestamp, nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index(
+            "ix_worker_deletions_deleted_at_store_id_user_id",
+            deleted_at,
+            store_id,
+            user_id,
+        ),
+    )
+
+
+WORKER_DELETIONS_DDL = {
+    "postgresql": [
+        "CREATE OR REPLACE FUNCTION record_worker_deletions() RETURNS trigger "
+        "LANGUAGE plpgsql AS $$ BEGIN "
+        "IF TG_OP = 'DELETE' THEN "
+        "INSERT INTO worker_deletions (store_id, user_id) "
+        "SELECT store_id, user_id FROM old_rows ORDER BY store_id, user_id "
+        "ON CONFLICT (store_id, user_id) DO UPDATE SET deleted_at = now(); "
+        "ELSE DELETE FROM worker_deletions USING new_rows "
+        "WHERE worker_deletions.store_id = new_rows.store_id "
+        "AND worker_deletions.user_id = new_rows.user_id; "
+        "END IF; RETURN NULL; END $$",
+        "CREATE TRIGGER worker_deletions_delete AFTER DELETE ON workers "
+        "REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT "
+        "EXECUTE FUNCTION record_worker_deletions()",
+        "CREATE TRIGGER worker_deletions_insert AFTER INSERT ON workers "
+        "REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT "
+        "EXECUTE FUNCTION record_worker_deletions()",
+    ],
+    "sqlite": [
+        "CREATE TRIGGER worker_deletions_delete AFTER DELETE ON workers "
+        "FOR EACH ROW BEGIN "
+        "INSERT INTO worker_deletions (store_id, user_id) "
+        "VALUES (OLD.store_id, OLD.user_id) "
+        "ON CONFLICT (store_id, user_id) DO UPDATE SET deleted_at = CURRENT_TIMESTAMP; "
+        "END",
+        "CREATE TRIGGER worker_deletions_insert AFTER INSERT ON workers "
+        "FOR EACH ROW BEGIN "
+        "DELETE FROM worker_deletions "
+        "WHERE store_id = NEW.store_id AND user_id = NEW.user_id; END",
+    ],
+}
+
+for dialect, statements in WORKER_DELETIONS_DDL.items():
+    for statement in statements:
+        event.listen(
+            Base.metadata, "after_create", DDL(statement).execute_if(dialect=dialect)
+        )
+
+
+# Counters kept by triggers on the tables they count, so the stats are read by
+# key instead of scanning workers and stores. A row is created on the first write
+# to its key and stays, at zero, when everything it counted is gone
+class StoreWorkerCount(Base):
+    __tablename__ = "store_worker_counts"
+
+    store_id = Column(Integer, ForeignKey("stores.id"), primary_key=True)
+    rol_id = Column(Integer, ForeignKey("roles.id"), primary_key=True)
+    workers = Column(Integer, nullable=False, server_default="0")
+    active_workers = Column(Integer, nullable=False, server_default="0")
+
+
+# Every store and worker write changes one of a few global keys, and a row updated
+# in place would keep the other writes waiting until the writer commits, a whole
+# bulk import. So each write appends its own row, a key counts the sum of its rows,
+# and fold_counters sums them up in the background
+class RolWorkerCount(Base):
+    __tablename__ = "rol_worker_counts"
+
+    id = Column(Integer, primary_key=True)
+    rol_id = Column(Integer, ForeignKey("roles.id"), nullable=False)
+    workers = Column(Integer, nullable=False, server_default="0")
+    active_workers = Column(Integer, nullable=False, server_default="0")
+
+
+class CountryStoreCount(Base):
+    __tablename__ = "country_store_counts"
+
+    id = Column(Integer, primary_key=True)
+    country_id = Column(Integer, ForeignKey("countries.id"), nullable=False)
+    stores = Column(Integer, nullable=False, server_default="0")
+    active_stores = Column(Integer, nullable=False, server_default="0")
+
+
+# Counter table: (counted table, key columns, {count column: condition}), a None
+# condition counts every row
+COUNTERS = {
+    "store_worker_counts": (
+        "workers",
+        ("store_id", "rol_id"),
+        {"workers": None, "active_workers": "active"},
+    ),
+    "rol_worker_counts": (
+        "workers",
+        ("rol_id",),
+        {"workers": None, "active_workers": "active"},
+    ),
+    "country_store_counts": (
+        "stores",
+        ("country_id",),
+        {"stores": None, "active_stores": "active"},
+    ),
+}
+# Counters written by appending a row per change instead of updating their key
+FOLDED_COUNTERS = ("rol_worker_counts", "country_store_counts")
+
+
+# Adds to a counter the rows of each source, with the sign they count with. The
+# keys are locked in order so that concurrent writes can't deadlock on them, and
+# the ones left as they were, like a store rename, aren't written at all
+def count_rows(counter: str, sources: list) -> str:
+    _, keys, counts = COUNTERS[counter]
+    key_list = ", ".join(keys)
+    selects = []
+    for sign, row, source in sources:
+        columns = [f"{row}{key} AS {key}" for key in keys] + [
+            (
+                f"CASE WHEN {row}{condition} THEN {sign} ELSE 0 END AS {count}"
+                if condition
+                else f"{sign} AS {count}"
+            )
+            for count, condition in counts.items()
+        ]
+        selects.append(f"SELECT {', '.join(columns)}{source}")
+    statement = (
+        f"INSERT INTO {counter} ({key_list}, {', '.join(counts)}) "
+        f"SELECT {key_list}, {', '.join(f'sum({count})' for count in counts)} "
+        f"FROM ({' UNION ALL '.join(selects)}) AS changes WHERE true "
+        f"GROUP BY {key_list} "
+        f"HAVING {' OR '.join(f'sum({count}) <> 0' for count in counts)}"
+    )
+    if counter in FOLDED_COUNTERS:
+        return statement
+    return (
+        f"{statement} ORDER BY {key_list} "
+        f"ON CONFLICT ({key_list}) DO UPDATE SET "
+        + ", ".join(
+            f"{count} = {counter}.{count} + excluded.{count}" for count in counts
+        )
+    )
+
+
+# PostgreSQL counts once per statement, from its transition tables, so a bulk
+# insert writes each counter once. SQLite only has row triggers
+def counter_ddl(counter: str, dialect: str) -> list:
+    table = COUNTERS[counter][0]
+    events = {
+        "INSERT": [(1, "NEW.", "")],
+        "UPDATE": [(1, "NEW.", ""), (-1, "OLD.", "")],
+        "DELETE": [(-1, "OLD.", "")],
+    }
+    if dialect == "sqlite":
+        return [
+            f"CREATE TRIGGER {counter}_{event.lower()} AFTER {event} ON {table} "
+            f"FOR EACH ROW BEGIN {count_rows(counter, sources)}; END"
+            for event, sources in events.items()
+        ]
+
+    transition_tables = {"NEW.": "new_rows", "OLD.": "old_rows"}
+    statements = {
+        event: count_rows(
+            counter,
+            [(sign, "", f" FROM {transition_tables[row]}") for sign, row, _ in sources],
+        )
+        for event, sources in events.items()
+    }
+    function = (
+        f"CREATE OR REPLACE FUNCTION count_{counter}() RETURNS trigger "
+        "LANGUAGE plpgsql AS $$ BEGIN "
+        f"IF TG_OP = 'INSERT' THEN {statements['INSERT']}; "
+        f"ELSIF TG_OP = 'UPDATE' THEN {statements['UPDATE']}; "
+        f"ELSE {statements['DELETE']}; "
+        "END IF; RETURN NULL; END $$"
+    )
+    referencing = {
+        "INSERT": "NEW TABLE AS new_rows",
+        "UPDATE": "OLD TABLE AS old_rows NEW TABLE AS new_rows",
+        "DELETE": "OLD TABLE AS old_rows",
+    }
+    return [function] + [
+        f"CREATE TRIGGER {counter}_{event.lower()} AFTER {event} ON {table} "
+        f"REFERENCING {referencing[event]} FOR EACH STATEMENT "
+        f"EXECUTE FUNCTION count_{counter}()"
+        for event in events
+    ]
+
+
+# After every table, the triggers write to the counters and fire on the tables
+# they count
+for counter in COUNTERS:
+    for dialect in ("postgresql", "sqlite"):
+        for statement in counter_ddl(counter, dialect):
+            event.listen(
+                Base.metadata,
+                "after_create",
+                DDL(statement).execute_if(dialect=dialect),
+            )
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from pydantic import BaseModel, EmailStr
 from typing import List, Optional
 
@@ -46,6 +48,53 @@ class StoreData(BaseModel):
 
 class StoresList(BaseModel):
     stores: List[StoreData]
+    next_cursor: Optional[str] = None
+
+
+class StoreLookup(BaseModel):
+    id: int
+    store: Optional[StoreData] = None
+    # Why the store isn't there, set instead of the store
+    detail: Optional[str] = None
+
+
+class StoresLookup(BaseModel):
+    stores: List[StoreLookup]
+
+
+class StoreChange(StoreData):
+    updated_at: datetime
+
+
+class StoresChanges(BaseModel):
+    stores: List[StoreChange]
+    # Passed back as since to resume the feed, the same one when nothing changed
+    next_token: Optional[str] = None
+    has_more: bool
+
+
+class RolWorkersCount(BaseModel):
+    rol_id: int
+    workers: int
+    active_workers: int
+
+
+class StoreStats(BaseModel):
+    store_id: int
+    workers: int
+    active_workers: int
+    roles: List[RolWorkersCount]
+
+
+class CountryStoresCount(BaseModel):
+    country_id: int
+    stores: int
+    active_stores: int
+
+
+class StoresStats(BaseModel):
+    countries: List[CountryStoresCount]
+    roles: List[RolWorkersCount]
 
 
 class StoreUpdate(BaseModel):
@@ -57,6 +106,18 @@ class StoreUpdate(BaseModel):
     phone: Optional[str] = None
 
 
+class StoreBulkError(BaseModel):
+    line: int
+    tax_id: Optional[str] = None
+    detail: str
+
+
+class StoresBulkResults(BaseModel):
+    created: int
+    updated: int
+    errors: List[StoreBulkError]
+
+
 class WorkerCreate(BaseModel):
     user_id: int
     store_id: int
@@ -75,12 +136,71 @@ class WorkerData(WorkerBasicData):
     store_name: str
 
 
+class WorkerKey(BaseModel):
+    store_id: int
+    user_id: int
+
+
+class WorkersLookupRequest(BaseModel):
+    workers: List[WorkerKey]
+
+
+class WorkerLookup(WorkerKey):
+    worker: Optional[WorkerData] = None
+    # Why the worker isn't there, set instead of the worker
+    detail: Optional[str] = None
+
+
+class WorkersLookup(BaseModel):
+    workers: List[WorkerLookup]
+
+
 class WorkersList(BaseModel):
     store_id: int
     store_name: str
     store_active: bool
     workers: List[WorkerBasicData]
+    next_cursor: Optional[str] = None
+
+
+# A deleted worker comes with only its keys and when it was deleted
+class WorkerChange(BaseModel):
+    user_id: int
+    store_id: int
+    rol_id: Optional[int] = None
+    active: Optional[bool] = None
+    updated_at: datetime
+    deleted: bool = False
+
+
+class WorkersChanges(BaseModel):
+    workers: List[WorkerChange]
+    next_token: Optional[str] = None
+    has_more: bool
 
 
 class WorkerUpdate(BaseModel):
     rol_id: int
+
+
+class WorkerBulkItem(BaseModel):
+    user_id: int
+    rol_id: int
+
+
+class WorkersBulkCreate(BaseModel):
+    store_id: int
+    workers: List[WorkerBulkItem]
+
+
+class WorkerBulkResult(BaseModel):
+    user_id: int
+    rol_id: int
+    # created, exists, duplicated or invalid_rol
+    status: str
+
+
+class WorkersBulkResults(BaseModel):
+    store_id: int
+    created: int
+    results: List[WorkerBulkResult]
@@ -1,7 +1,19 @@
-from fastapi import FastAPI
+import asyncio
+import logging
 
+from fastapi import FastAPI
 
+from config import get_settings
+from src.adapters.orm import get_db, query_profiler, replica_set
+from src.adapters.unit_of_work import get_unit_of_work
+from src.entrypoints.profiling import install_metrics, install_profiling
+from src.entrypoints.replicas import install_read_your_writes
 from src.entrypoints.routes import countries, roles, stores, workers
+from src.handlers.countries import CountriesHandler
+from src.handlers.roles import RolesHandler
+from src.handlers.stores import StoresHandler
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
@@ -10,3 +22,92 @@ app.include_router(countries.router)
 app.include_router(roles.router)
 app.include_router(stores.router)
 app.include_router(workers.router)
+
+metrics = install_metrics(app, query_profiler)
+if get_settings().db_profiling:
+    install_profiling(app, metrics)
+
+if replica_set.replicas:
+    install_read_your_writes(app, get_settings().db_replica_max_lag)
+
+
+async def refresh_reference_data():
+    try:
+        get_session = app.dependency_overrides.get(get_db, get_db)
+        async for db in get_session():
+            await CountriesHandler(db).refresh_snapshot()
+            await RolesHandler(db).refresh_snapshot()
+    except Exception:
+        logger.exception("The reference data snapshots could not be refreshed")
+
+
+async def refresh_reference_data_periodically(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        await refresh_reference_data()
+
+
+@app.on_event("startup")
+async def start_reference_data_refresh():
+    await refresh_reference_data()
+    app.state.reference_data_task = asyncio.create_task(
+        refresh_reference_data_periodically(
+            get_settings().reference_data_refresh_interval
+        )
+    )
+
+
+@app.on_event("shutdown")
+async def stop_reference_data_refresh():
+    app.state.reference_data_task.cancel()
+
+
+async def check_replicas_periodically(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        await replica_set.check(timeout=interval)
+
+
+@app.on_event("startup")
+async def start_replica_checks():
+    if not replica_set.replicas:
+        return
+    interval = get_settings().db_replica_check_interval
+    await replica_set.check(timeout=interval)
+    app.state.replica_check_task = asyncio.create_task(
+        check_replicas_periodically(interval)
+    )
+
+
+@app.on_event("shutdown")
+async def stop_replica_checks():
+    if replica_set.replicas:
+        app.state.replica_check_task.cancel()
+
+
+async def fold_counters():
+    try:
+        get_session = app.dependency_overrides.get(get_db, get_db)
+        async for db in get_session():
+            async with get_unit_of_work(db).transaction():
+                await StoresHandler(db).fold_counters()
+    except Exception:
+        logger.exception("The stats counters could not be folded")
+
+
+async def fold_counters_periodically(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        await fold_counters()
+
+
+@app.on_event("startup")
+async def start_counters_fold():
+    app.state.counters_fold_task = asyncio.create_task(
+        fold_counters_periodically(get_settings().counters_fold_interval)
+    )
+
+
+@app.on_event("shutdown")
+async def stop_counters_fold():
+    app.state.counters_fold_task.cancel()
@@ -0,0 +1,225 @@
+from collections import defaultdict
+from time import perf_counter
+
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
+
+from src.adapters.cache import single_flight
+from src.adapters.orm import (
+    QueryProfiler,
+    RequestProfile,
+    current_profile,
+    get_pool_stats,
+)
+from src.handlers.stores import StoresHandler
+from src.handlers.workers import WorkersHandler
+
+# What each cache counter of /metrics counts, the shared ones only apply to the
+# entity caches
+cache_counters = {
+    "hits": "Reads served by the local tier, by cache.",
+    "misses": "Reads the local tier didn't have, by cache.",
+    "evictions": "Entries dropped from the local tier to stay under its size.",
+    "expirations": "Entries found expired in the local tier, by cache.",
+    "shared_hits": "Reads served fresh by the shared tier, by cache.",
+    "stale_hits": "Stale shared entries served while another process reloads them.",
+    "shared_errors": "Calls to the shared tier that failed, by cache.",
+}
+
+
+def cache_stats() -> dict:
+    return {
+        "rol": WorkersHandler.rol_cache.stats(),
+        "store": StoresHandler.cache.stats(),
+        "worker": WorkersHandler.cache.stats(),
+    }
+
+
+class RouteStats:
+    def __init__(self) -> None:
+        self.requests = 0
+        self.queries = 0
+        self.db_time = 0.0
+        self.pool_wait = 0.0
+        self.duration = 0.0
+
+
+class Metrics:
+    def __init__(self) -> None:
+        # Keyed by (method, route), routes are the templates to keep the labels bounded
+        self.routes = defaultdict(RouteStats)
+        self.statuses = defaultdict(int)
+
+    def observe(
+        self,
+        method: str,
+        route: str,
+        status_code: int,
+        profile: RequestProfile,
+        duration: float,
+    ) -> None:
+        stats = self.routes[(method, route)]
+        stats.requests += 1
+        stats.queries += profile.queries
+        stats.db_time += profile.db_time
+        stats.pool_wait += profile.pool_wait
+        stats.duration += duration
+        self.statuses[(method, route, status_code)] += 1
+
+    def render(self, pool: dict, slow_queries: int, flights: dict, caches: dict) -> str:
+        lines = []
+
+        def metric(name, kind, help, samples):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                labels = ",".join(f'{key}="{label}"' for key, label in labels.items())
+                lines.append(
+                    f"{name}{{{labels}}} {value}" if labels else f"{name} {value}"
+                )
+
+        routes = [
+            ({"method": method, "route": route}, stats)
+            for (method, route), stats in sorted(self.routes.items())
+        ]
+        metric(
+            "http_requests_total",
+            "counter",
+            "Requests by route and status code.",
+            [
+                ({"method": method, "route": route, "status": status_code}, count)
+                for (method, route, status_code), count in sorted(self.statuses.items())
+            ],
+        )
+        metric(
+            "http_request_duration_seconds_total",
+            "counter",
+            "Time to build the responses by route, body streaming excluded.",
+            [(labels, stats.duration) for labels, stats in routes],
+        )
+        metric(
+            "db_queries_total",
+            "counter",
+            "Statements executed by route.",
+            [(labels, stats.queries) for labels, stats in routes],
+        )
+        metric(
+            "db_query_duration_seconds_total",
+            "counter",
+            "Time spent executing statements by route.",
+            [(labels, stats.db_time) for labels, stats in routes],
+        )
+        metric(
+            "db_pool_wait_seconds_total",
+            "counter",
+            "Time spent waiting for a pooled connection by route.",
+            [(labels, stats.pool_wait) for labels, stats in routes],
+        )
+        metric(
+            "db_slow_queries_total",
+            "counter",
+            "Statements slower than DB_SLOW_QUERY_MS.",
+            [({}, slow_queries)],
+        )
+        metric(
+            "single_flight_calls_total",
+            "counter",
+            "Reads that ran their queries, by read.",
+            [({"read": name}, stats["calls"]) for name, stats in flights.items()],
+        )
+        metric(
+            "single_flight_coalesced_total",
+            "counter",
+            "Reads that shared the queries of an identical one in flight, by read.",
+            [({"read": name}, stats["coalesced"]) for name, stats in flights.items()],
+        )
+        for counter, help in cache_counters.items():
+            metric(
+                f"cache_{counter}_total",
+                "counter",
+                help,
+                [
+                    ({"cache": name}, stats[counter])
+                    for name, stats in caches.items()
+                    if counter in stats
+                ],
+            )
+        metric(
+            "cache_size",
+            "gauge",
+            "Entries in the local tier, by cache.",
+            [({"cache": name}, stats["size"]) for name, stats in caches.items()],
+        )
+        for event in ("connects", "checkouts", "checkins", "invalidations"):
+            metric(
+                f"db_pool_{event}_total",
+                "counter",
+                f"Pool {event} since the process started.",
+                [({}, pool[event])],
+            )
+        metric(
+            "db_pool_checked_out",
+            "gauge",
+            "Connections currently checked out of the pool.",
+            [({}, pool["checked_out"])],
+        )
+        return "\n".join(lines) + "\n"
+
+
+def server_timing(profile: RequestProfile, duration: float) -> str:
+    return (
+        f'db;dur={profile.db_time * 1000:.1f};desc="{profile.queries} queries", '
+        f"pool;dur={profile.pool_wait * 1000:.1f}, "
+        f"app;dur={duration * 1000:.1f}"
+    )
+
+
+# Always served: the pool, cache and single flight counters cost nothing to keep.
+# The by route ones stay empty unless install_profiling feeds them
+def install_metrics(app: FastAPI, profiler: QueryProfiler) -> Metrics:
+    metrics = Metrics()
+
+    @app.get("/metrics", include_in_schema=False)
+    async def get_metrics():
+        return PlainTextResponse(
+            metrics.render(
+                get_pool_stats(),
+                profiler.slow_queries,
+                single_flight.stats(),
+                cache_stats(),
+            ),
+            media_type="text/plain; version=0.0.4",
+        )
+
+    return metrics
+
+
+def install_profiling(app: FastAPI, metrics: Metrics) -> None:
+    route_paths = {}
+
+    def route_path(request: Request) -> str:
+        # The router leaves the matched endpoint in the scope, not its template
+        if not route_paths:
+            route_paths.update(
+                (route.endpoint, route.path)
+                for route in app.routes
+                if hasattr(route, "endpoint")
+            )
+        return route_paths.get(request.scope.get("endpoint"), "unmatched")
+
+    @app.middleware("http")
+    async def profile_request(request: Request, call_next):
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        started = perf_counter()
+        try:
+            response = await call_next(request)
+        finally:
+            current_profile.reset(token)
+        duration = perf_counter() - started
+
+        response.headers["Server-Timing"] = server_timing(profile, duration)
+        metrics.observe(
+            request.method, route_path(request), response.status_code, profile, duration
+        )
+        return response
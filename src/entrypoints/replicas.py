@@ -0,0 +1,36 @@
+from math import ceil
+from time import time
+
+from fastapi import FastAPI, Request
+
+from src.adapters.orm import READ_PRIMARY_COOKIE
+
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+# For POST routes that only read, like the batch lookups, so they don't send the
+# client to the primary
+def read_only(endpoint):
+    endpoint.read_only = True
+    return endpoint
+
+
+# After a write the client reads from the primary until replicas in sync have it
+def install_read_your_writes(app: FastAPI, window: float) -> None:
+    @app.middleware("http")
+    async def read_your_writes(request: Request, call_next):
+        response = await call_next(request)
+        endpoint = request.scope.get("endpoint")
+        if (
+            request.method not in SAFE_METHODS
+            and response.status_code < 400
+            and not getattr(endpoint, "read_only", False)
+        ):
+            response.set_cookie(
+                READ_PRIMARY_COOKIE,
+                f"{time() + window:.3f}",
+                max_age=ceil(window),
+                httponly=True,
+                samesite="lax",
+            )
+        return response
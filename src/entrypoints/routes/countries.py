@@ -1,9 +1,13 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
+from typing import Optional
 
-from src.adapters.orm import get_db
+from fastapi import APIRouter, Depends, Header
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import get_settings
+from src.adapters.orm import get_read_db
 from src.handlers.countries import CountriesHandler
 from src.domain import schemas
+from src.utils.snapshot import snapshot_response
 
 router = APIRouter(
     prefix="/countries",
@@ -13,8 +17,12 @@ router = APIRouter(
 
 
 @router.get("", status_code=200, response_model=schemas.CountriesList)
-async def get_countries(db: Session = Depends(get_db)):
+async def get_countries(
+    if_none_match: Optional[str] = Header(default=None),
+    db: AsyncSession = Depends(get_read_db),
+):
     country_handler = CountriesHandler(db)
-    countries = await country_handler.get_countries()
-    response = schemas.CountriesList(countries=countries)
-    return response
+    snapshot = await country_handler.get_countries_snapshot()
+    return snapshot_response(
+        snapshot, if_none_match, get_settings().reference_data_refresh_interval
+    )
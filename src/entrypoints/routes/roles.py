@@ -1,9 +1,13 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
+from typing import Optional
 
-from src.adapters.orm import get_db
+from fastapi import APIRouter, Depends, Header
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import get_settings
+from src.adapters.orm import get_read_db
 from src.handlers.roles import RolesHandler
 from src.domain import schemas
+from src.utils.snapshot import snapshot_response
 
 router = APIRouter(
     prefix="/roles",
@@ -13,8 +17,12 @@ router = APIRouter(
 
 
 @router.get("", status_code=200, response_model=schemas.RolesList)
-async def get_roles(db: Session = Depends(get_db)):
+async def get_roles(
+    if_none_match: Optional[str] = Header(default=None),
+    db: AsyncSession = Depends(get_read_db),
+):
     roles_handler = RolesHandler(db)
-    roles = await roles_handler.get_roles()
-    response = schemas.RolesList(roles=roles)
-    return response
+    snapshot = await roles_handler.get_roles_snapshot()
+    return snapshot_response(
+        snapshot, if_none_match, get_settings().reference_data_refresh_interval
+    )
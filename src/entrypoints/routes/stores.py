@@ -1,11 +1,34 @@
-from fastapi import APIRouter, Depends, Header, HTTPException, status
-from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import Optional, Union
 
-from src.adapters.orm import get_db
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, status
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import get_settings
+from src.adapters.orm import get_db, get_read_db
+from src.adapters.unit_of_work import get_unit_of_work
 from src.handlers.stores import StoresHandler
 from src.handlers.workers import WorkersHandler
 from src.domain import schemas
-from src.utils.validation import validate_rol
+from src.utils.export import export_response
+from src.utils.ndjson import iter_ndjson
+from src.utils.pagination import (
+    clamp_per_page,
+    decode_change_token,
+    decode_cursor,
+    encode_change_token,
+    encode_cursor,
+)
+from src.utils.responses import (
+    store_changes_response,
+    store_response,
+    store_stats_response,
+    stores_lookup_response,
+    stores_response,
+    stores_stats_response,
+)
+from src.utils.validation import naive_utc, parse_ids, rol_error, validate_rol
 
 router = APIRouter(
     prefix="/stores",
@@ -18,7 +41,7 @@ router = APIRouter(
 async def create_store(
     new_store: schemas.StoreCreate,
     current_user_id: int = Header(default=None, convert_underscores=True),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     if not isinstance(current_user_id, int):
         raise HTTPException(
@@ -26,60 +49,249 @@ async def create_store(
             detail="The user id is not valid",
         )
     store_handler = StoresHandler(db)
-    store = await store_handler.create_store(new_store)
     worker_handler = WorkersHandler(db)
-    new_worker = schemas.WorkerCreate(
-        user_id=current_user_id,
-        store_id=store.id,
-        rol_id=1,
-    )
-    await worker_handler.create_worker(new_worker)
-    response = schemas.StoreData(
-        id=store.id,
-        country_id=store.country_id,
-        tax_id=store.tax_id,
-        name=store.name,
-        legal_name=store.legal_name,
-        address=store.address,
-        zip_code=store.zip_code,
-        email=store.email,
-        phone=store.phone,
-        active=store.active,
+    # The store and its admin are committed together or not at all
+    async with get_unit_of_work(db).transaction():
+        store = await store_handler.create_store(new_store)
+        new_worker = schemas.WorkerCreate(
+            user_id=current_user_id,
+            store_id=store.id,
+            rol_id=1,
+        )
+        await worker_handler.create_worker(new_worker)
+    return store_response(store)
+
+
+@router.post("/bulk", status_code=200, response_model=schemas.StoresBulkResults)
+async def upsert_stores(
+    request: Request,
+    current_user_id: int = Header(default=None, convert_underscores=True),
+    superuser: bool = Header(default=False),
+    db: AsyncSession = Depends(get_db),
+):
+    if not superuser:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="The user is not authorized",
+        )
+    if not isinstance(current_user_id, int):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="The user id is not valid",
+        )
+
+    errors = []
+    max_line_size = get_settings().max_bulk_line_size
+
+    # The body is NDJSON, one StoreCreate per line, read as it arrives
+    async def parse_stores():
+        async for line, raw_store in iter_ndjson(request.stream(), max_line_size):
+            if raw_store is None:
+                errors.append(
+                    {
+                        "line": line,
+                        "detail": f"The line is longer than {max_line_size} bytes",
+                    }
+                )
+                continue
+            try:
+                yield line, schemas.StoreCreate.parse_raw(raw_store)
+            except ValidationError as error:
+                errors.append({"line": line, "detail": str(error)})
+
+    store_handler = StoresHandler(db)
+    summary = await store_handler.upsert_stores(parse_stores(), current_user_id)
+    errors = sorted(errors + summary["errors"], key=lambda error: error["line"])
+    response = schemas.StoresBulkResults(
+        created=summary["created"],
+        updated=summary["updated"],
+        errors=errors,
     )
     return response
 
 
-@router.get("", status_code=200, response_model=schemas.StoresList)
+@router.get(
+    "",
+    status_code=200,
+    response_model=Union[schemas.StoresList, schemas.StoresLookup],
+)
 async def get_stores(
     page: int = 1,
     per_page: int = 10,
+    cursor: Optional[str] = None,
+    ids: Optional[str] = None,
+    country_id: Optional[int] = None,
+    active: Optional[bool] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    updated_from: Optional[datetime] = None,
+    updated_to: Optional[datetime] = None,
+    sort: str = Query(default="id", regex="^-?(id|created_at|updated_at)$"),
+    current_user_id: int = Header(default=None, convert_underscores=True),
     superuser: bool = Header(default=False),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
+    if ids is not None:
+        return await lookup_stores(parse_ids(ids), current_user_id, superuser, db)
     if not superuser:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="The user is not authorized",
         )
+    per_page = clamp_per_page(per_page)
+    # Cursors hold the sort key of the last store sent and its id
+    sort_key = sort.lstrip("-")
+    after = None
+    if cursor:
+        after = (
+            decode_cursor(cursor, int)
+            if sort_key == "id"
+            else decode_change_token(cursor, int)
+        )
     store_handler = StoresHandler(db)
-    stores = await store_handler.get_stores(page, per_page)
-    stores_list = [
-        schemas.StoreData(
-            id=store.id,
-            country_id=store.country_id,
-            tax_id=store.tax_id,
-            name=store.name,
-            legal_name=store.legal_name,
-            address=store.address,
-            zip_code=store.zip_code,
-            email=store.email,
-            phone=store.phone,
-            active=store.active,
-        )
-        for store in stores
-    ]
-    response = schemas.StoresList(stores=stores_list)
-    return response
+    stores = await store_handler.get_stores(
+        page,
+        per_page,
+        after,
+        sort,
+        country_id,
+        active,
+        naive_utc(created_from),
+        naive_utc(created_to),
+        naive_utc(updated_from),
+        naive_utc(updated_to),
+    )
+    last = stores[per_page - 1] if len(stores) > per_page else None
+    if last is None:
+        next_cursor = None
+    elif sort_key == "id":
+        next_cursor = encode_cursor(last.id)
+    else:
+        next_cursor = encode_change_token(getattr(last, sort_key), last.id)
+    stores = stores[:per_page]
+    return stores_response(stores, next_cursor)
+
+
+# Every id is resolved and authorized in a single query, those the caller can't
+# read come back with the error the single store route would give
+async def lookup_stores(
+    store_ids: list, current_user_id: int, superuser: bool, db: AsyncSession
+):
+    if not superuser and not isinstance(current_user_id, int):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="The user is not valid",
+        )
+    store_handler = StoresHandler(db)
+    stores = await store_handler.lookup_stores(
+        sorted(set(store_ids)), None if superuser else current_user_id
+    )
+    details = {}
+    for store_id in store_ids:
+        store = stores.get(store_id)
+        if superuser:
+            detail = None if store else StoresHandler.not_found_exception.detail
+        elif store is None or store.caller_rol_id is None:
+            # Like validate_rol, a store the caller doesn't work in can't be told
+            # apart from one that doesn't exist
+            detail = rol_error(None, [1, 2])
+        else:
+            detail = rol_error((store.caller_rol_id, store.caller_active), [1, 2])
+        if detail:
+            details[store_id] = detail
+    return stores_lookup_response(store_ids, stores, details)
+
+
+# Read from the primary, only its open transactions tell how far the feed can go
+@router.get("/changes", status_code=200, response_model=schemas.StoresChanges)
+async def get_store_changes(
+    since: Optional[str] = None,
+    limit: int = 100,
+    superuser: bool = Header(default=False),
+    db: AsyncSession = Depends(get_db),
+):
+    if not superuser:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="The user is not authorized",
+        )
+    limit = clamp_per_page(limit)
+    after = decode_change_token(since, int) if since else None
+    store_handler = StoresHandler(db)
+    stores = await store_handler.get_store_changes(limit, after)
+    has_more = len(stores) > limit
+    stores = stores[:limit]
+    next_token = (
+        encode_change_token(stores[-1].updated_at, stores[-1].id) if stores else since
+    )
+    return store_changes_response(stores, next_token, has_more)
+
+
+@router.get("/export", status_code=200)
+async def export_stores(
+    export_format: str = Query(
+        default="ndjson", alias="format", regex="^(ndjson|csv)$"
+    ),
+    gzip: bool = False,
+    country_id: Optional[int] = None,
+    active: Optional[bool] = None,
+    since: Optional[datetime] = None,
+    superuser: bool = Header(default=False),
+    db: AsyncSession = Depends(get_read_db),
+):
+    if not superuser:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="The user is not authorized",
+        )
+    store_handler = StoresHandler(db)
+    partitions = await store_handler.stream_stores(country_id, active, naive_utc(since))
+    fields = [column.key for column in store_handler.export_columns]
+    return export_response(partitions, fields, export_format, gzip, "stores")
+
+
+@router.get("/search", status_code=200, response_model=schemas.StoresList)
+async def search_stores(
+    q: str = Query(..., max_length=100),
+    per_page: int = 10,
+    cursor: Optional[str] = None,
+    superuser: bool = Header(default=False),
+    db: AsyncSession = Depends(get_read_db),
+):
+    if not superuser:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="The user is not authorized",
+        )
+    terms = q.strip()
+    if len(terms) < 2:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="The search needs at least two characters",
+        )
+    per_page = clamp_per_page(per_page)
+    after = decode_cursor(cursor, float, int) if cursor else None
+    store_handler = StoresHandler(db)
+    stores = await store_handler.search_stores(terms, per_page, after)
+    last = stores[per_page - 1] if len(stores) > per_page else None
+    next_cursor = encode_cursor(last.rank, last.id) if last else None
+    stores = stores[:per_page]
+    return stores_response(stores, next_cursor)
+
+
+@router.get("/stats", status_code=200, response_model=schemas.StoresStats)
+async def get_stores_stats(
+    superuser: bool = Header(default=False),
+    db: AsyncSession = Depends(get_read_db),
+):
+    if not superuser:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="The user is not authorized",
+        )
+    store_handler = StoresHandler(db)
+    countries, roles = await store_handler.get_stats()
+    return stores_stats_response(countries, roles)
 
 
 @router.get("/{store_id}", status_code=200, response_model=schemas.StoreData)
@@ -87,7 +299,7 @@ async def get_store(
     store_id: int,
     current_user_id: int = Header(default=None, convert_underscores=True),
     superuser: bool = Header(default=False),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
     worker_handler = WorkersHandler(db)
     rol_condition = (
@@ -104,19 +316,37 @@ async def get_store(
     if rol_condition:
         store_handler = StoresHandler(db)
         store = await store_handler.get_store(store_id)
-        response = schemas.StoreData(
-            id=store.id,
-            country_id=store.country_id,
-            tax_id=store.tax_id,
-            name=store.name,
-            legal_name=store.legal_name,
-            address=store.address,
-            zip_code=store.zip_code,
-            email=store.email,
-            phone=store.phone,
-            active=store.active,
-        )
-        return response
+        return store_response(store)
+
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="The user is not authorized",
+    )
+
+
+@router.get("/{store_id}/stats", status_code=200, response_model=schemas.StoreStats)
+async def get_store_stats(
+    store_id: int,
+    current_user_id: int = Header(default=None, convert_underscores=True),
+    superuser: bool = Header(default=False),
+    db: AsyncSession = Depends(get_read_db),
+):
+    worker_handler = WorkersHandler(db)
+    rol_condition = (
+        await validate_rol(
+            worker_handler=worker_handler,
+            store_id=store_id,
+            user_id=current_user_id,
+            accepted_roles_list=[1, 2],
+        )
+        if not superuser
+        else superuser
+    )
+
+    if rol_condition:
+        store_handler = StoresHandler(db)
+        counts = await store_handler.get_store_stats(store_id)
+        return store_stats_response(store_id, counts)
 
     raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -130,7 +360,7 @@ async def update_store(
     data: schemas.StoreUpdate,
     current_user_id: int = Header(default=None, convert_underscores=True),
     superuser: bool = Header(default=False),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     worker_handler = WorkersHandler(db)
     rol_condition = (
@@ -147,19 +377,7 @@ async def update_store(
     if rol_condition:
         store_handler = StoresHandler(db)
         store = await store_handler.update_store(store_id, data)
-        response = schemas.StoreData(
-            id=store.id,
-            country_id=store.country_id,
-            tax_id=store.tax_id,
-            name=store.name,
-            legal_name=store.legal_name,
-            address=store.address,
-            zip_code=store.zip_code,
-            email=store.email,
-            phone=store.phone,
-            active=store.active,
-        )
-        return response
+        return store_response(store)
 
     raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -172,7 +390,7 @@ async def deactivate_store(
     store_id: int,
     current_user_id: int = Header(default=None, convert_underscores=True),
     superuser: bool = Header(default=False),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     worker_handler = WorkersHandler(db)
     rol_condition = (
@@ -189,19 +407,7 @@ async def deactivate_store(
     if rol_condition:
         store_handler = StoresHandler(db)
         store = await store_handler.deactivate_store(store_id)
-        response = schemas.StoreData(
-            id=store.id,
-            country_id=store.country_id,
-            tax_id=store.tax_id,
-            name=store.name,
-            legal_name=store.legal_name,
-            address=store.address,
-            zip_code=store.zip_code,
-            email=store.email,
-            phone=store.phone,
-            active=store.active,
-        )
-        return response
+        return store_response(store)
 
     raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -213,7 +419,7 @@ async def deactivate_store(
 async def activate_store(
     store_id: int,
     superuser: bool = Header(default=False),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     if not superuser:
         raise HTTPException(
@@ -223,16 +429,4 @@ async def activate_store(
 
     store_handler = StoresHandler(db)
     store = await store_handler.activate_store(store_id)
-    response = schemas.StoreData(
-        id=store.id,
-        country_id=store.country_id,
-        tax_id=store.tax_id,
-        name=store.name,
-        legal_name=store.legal_name,
-        address=store.address,
-        zip_code=store.zip_code,
-        email=store.email,
-        phone=store.phone,
-        active=store.active,
-    )
-    return response
+    return store_response(store)
@@ -1,11 +1,29 @@
-from fastapi import APIRouter, Depends, Header, HTTPException, status
-from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import Optional
 
-from src.adapters.orm import get_db
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import get_settings
+from src.adapters.orm import get_db, get_read_db
+from src.entrypoints.replicas import read_only
 from src.handlers.workers import WorkersHandler
-from src.handlers.stores import StoresHandler
 from src.domain import schemas
-from src.utils.validation import validate_rol
+from src.utils.export import export_response
+from src.utils.pagination import (
+    clamp_per_page,
+    decode_change_token,
+    decode_cursor,
+    encode_change_token,
+    encode_cursor,
+)
+from src.utils.responses import worker_changes_response, workers_lookup_response
+from src.utils.validation import (
+    naive_utc,
+    rol_error,
+    validate_rol,
+    validate_worker_access,
+)
 
 
 router = APIRouter(
@@ -20,26 +38,15 @@ async def create_worker(
     new_worker: schemas.WorkerCreate,
     current_user_id: int = Header(default=None, convert_underscores=True),
     superuser: bool = Header(default=False),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    store_handler = StoresHandler(db)
-    store = await store_handler.get_store(new_worker.store_id)
-    if not store.active:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="The store is not active",
-        )
     worker_handler = WorkersHandler(db)
-
-    rol_condition = (
-        await validate_rol(
-            worker_handler=worker_handler,
-            store_id=new_worker.store_id,
-            user_id=current_user_id,
-            accepted_roles_list=[1],
-        )
-        if not superuser
-        else superuser
+    rol_condition = await validate_worker_access(
+        worker_handler=worker_handler,
+        store_id=new_worker.store_id,
+        current_user_id=current_user_id,
+        superuser=superuser,
+        accepted_roles_list=[1],
     )
 
     if rol_condition:
@@ -47,9 +54,9 @@ async def create_worker(
         response = schemas.WorkerData(
             user_id=worker.user_id,
             store_id=worker.store_id,
-            store_name=worker.store.name,
+            store_name=worker.store_name,
             rol_id=worker.rol_id,
-            rol_name=worker.rol.name,
+            rol_name=worker.rol_name,
             active=worker.active,
         )
         return response
@@ -60,15 +67,114 @@ async def create_worker(
     )
 
 
+@router.post("/bulk", status_code=200, response_model=schemas.WorkersBulkResults)
+async def create_workers(
+    bulk: schemas.WorkersBulkCreate,
+    current_user_id: int = Header(default=None, convert_underscores=True),
+    superuser: bool = Header(default=False),
+    db: AsyncSession = Depends(get_db),
+):
+    if len(bulk.workers) > get_settings().max_bulk_size:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Too many workers in one request",
+        )
+
+    worker_handler = WorkersHandler(db)
+    rol_condition = await validate_worker_access(
+        worker_handler=worker_handler,
+        store_id=bulk.store_id,
+        current_user_id=current_user_id,
+        superuser=superuser,
+        accepted_roles_list=[1],
+    )
+
+    if rol_condition:
+        statuses = await worker_handler.create_workers(bulk.store_id, bulk.workers)
+        results = [
+            schemas.WorkerBulkResult(
+                user_id=worker.user_id,
+                rol_id=worker.rol_id,
+                status=worker_status,
+            )
+            for worker, worker_status in zip(bulk.workers, statuses)
+        ]
+        response = schemas.WorkersBulkResults(
+            store_id=bulk.store_id,
+            created=statuses.count("created"),
+            results=results,
+        )
+        return response
+
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="The user is not authorized",
+    )
+
+
+# Authorizes the caller against all the stores in one query and reads every worker
+# in another, those it can't read come back with the error get_worker would give
+@router.post("/lookup", status_code=200, response_model=schemas.WorkersLookup)
+@read_only
+async def lookup_workers(
+    lookup: schemas.WorkersLookupRequest,
+    current_user_id: int = Header(default=None, convert_underscores=True),
+    superuser: bool = Header(default=False),
+    db: AsyncSession = Depends(get_read_db),
+):
+    if len(lookup.workers) > get_settings().max_lookup_size:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Too many workers in one request",
+        )
+    if not superuser and not isinstance(current_user_id, int):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="The user is not valid",
+        )
+
+    worker_handler = WorkersHandler(db)
+    keys = [(worker.store_id, worker.user_id) for worker in lookup.workers]
+    store_errors = {}
+    if not superuser and keys:
+        store_ids = sorted({store_id for store_id, _ in keys})
+        roles = await worker_handler.get_worker_roles(store_ids, current_user_id)
+        for store_id in store_ids:
+            error = rol_error(roles.get(store_id), [1, 2])
+            if error:
+                store_errors[store_id] = error
+
+    workers = await worker_handler.lookup_workers(
+        sorted({key for key in keys if key[0] not in store_errors})
+    )
+    details = {}
+    for key in keys:
+        if key[0] in store_errors:
+            details[key] = store_errors[key[0]]
+        elif key not in workers:
+            details[key] = WorkersHandler.not_found_exception.detail
+    return workers_lookup_response(keys, workers, details)
+
+
 @router.get("", status_code=200, response_model=schemas.WorkersList)
 async def get_workers(
     page: int = 1,
     per_page: int = 10,
     store_id: int = 1,
+    cursor: Optional[str] = None,
     current_user_id: int = Header(default=None, convert_underscores=True),
     superuser: bool = Header(default=False),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
+    per_page = clamp_per_page(per_page)
+    after_user_id = None
+    if cursor:
+        cursor_store_id, after_user_id = decode_cursor(cursor, int, int)
+        if cursor_store_id != store_id:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="The cursor is not valid",
+            )
     worker_handler = WorkersHandler(db)
     rol_condition = (
         await validate_rol(
@@ -82,8 +188,21 @@ async def get_workers(
     )
 
     if rol_condition:
-        workers = await worker_handler.get_workers(page, per_page, store_id)
-        if not superuser and not workers[0].store.active:
+        workers = await worker_handler.get_workers(
+            page, per_page, store_id, after_user_id
+        )
+        if not workers:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="The store does not have workers",
+            )
+        next_cursor = (
+            encode_cursor(store_id, workers[per_page - 1].user_id)
+            if len(workers) > per_page
+            else None
+        )
+        workers = workers[:per_page]
+        if not superuser and not workers[0].store_active:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="The store is not active",
@@ -92,23 +211,18 @@ async def get_workers(
             schemas.WorkerBasicData(
                 user_id=worker.user_id,
                 rol_id=worker.rol_id,
-                rol_name=worker.rol.name,
+                rol_name=worker.rol_name,
                 active=worker.active,
             )
             for worker in workers
         ]
-        try:
-            response = schemas.WorkersList(
-                store_id=store_id,
-                store_name=workers[0].store.name,
-                store_active=workers[0].store.active,
-                workers=workers_list,
-            )
-        except IndexError:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="The store does not have workers",
-            )
+        response = schemas.WorkersList(
+            store_id=store_id,
+            store_name=workers[0].store_name,
+            store_active=workers[0].store_active,
+            workers=workers_list,
+            next_cursor=next_cursor,
+        )
         return response
 
     raise HTTPException(
@@ -117,13 +231,68 @@ async def get_workers(
     )
 
 
+# Read from the primary, only its open transactions tell how far the feed can go
+@router.get("/changes", status_code=200, response_model=schemas.WorkersChanges)
+async def get_worker_changes(
+    since: Optional[str] = None,
+    limit: int = 100,
+    superuser: bool = Header(default=False),
+    db: AsyncSession = Depends(get_db),
+):
+    if not superuser:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="The user is not authorized",
+        )
+    limit = clamp_per_page(limit)
+    after = decode_change_token(since, int, int) if since else None
+    worker_handler = WorkersHandler(db)
+    workers = await worker_handler.get_worker_changes(limit, after)
+    has_more = len(workers) > limit
+    workers = workers[:limit]
+    next_token = (
+        encode_change_token(
+            workers[-1].updated_at, workers[-1].store_id, workers[-1].user_id
+        )
+        if workers
+        else since
+    )
+    return worker_changes_response(workers, next_token, has_more)
+
+
+@router.get("/export", status_code=200)
+async def export_workers(
+    export_format: str = Query(
+        default="ndjson", alias="format", regex="^(ndjson|csv)$"
+    ),
+    gzip: bool = False,
+    store_id: Optional[int] = None,
+    country_id: Optional[int] = None,
+    active: Optional[bool] = None,
+    since: Optional[datetime] = None,
+    superuser: bool = Header(default=False),
+    db: AsyncSession = Depends(get_read_db),
+):
+    if not superuser:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="The user is not authorized",
+        )
+    worker_handler = WorkersHandler(db)
+    partitions = await worker_handler.stream_workers(
+        store_id, country_id, active, naive_utc(since)
+    )
+    fields = [column.key for column in worker_handler.export_columns]
+    return export_response(partitions, fields, export_format, gzip, "workers")
+
+
 @router.get("/{store_id}/{user_id}", status_code=200, response_model=schemas.WorkerData)
 async def get_worker(
     store_id: int,
     user_id: int,
     current_user_id: int = Header(default=None, convert_underscores=True),
     superuser: bool = Header(default=False),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
     worker_handler = WorkersHandler(db)
     rol_condition = (
@@ -139,15 +308,7 @@ async def get_worker(
 
     if rol_condition:
         worker = await worker_handler.get_worker(store_id, user_id)
-        response = schemas.WorkerData(
-            user_id=worker.user_id,
-            store_id=worker.store_id,
-            store_name=worker.store.name,
-            rol_id=worker.rol_id,
-            rol_name=worker.rol.name,
-            active=worker.active,
-        )
-        return response
+        return schemas.WorkerData(**worker)
 
     raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -162,26 +323,16 @@ async def update_worker(
     worker: schemas.WorkerUpdate,
     current_user_id: int = Header(default=None, convert_underscores=True),
     superuser: bool = Header(default=False),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    store_handler = StoresHandler(db)
-    store = await store_handler.get_store(store_id)
-    if not store.active:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="The store is not active",
-        )
-
     worker_handler = WorkersHandler(db)
-    rol_condition = (
-        await validate_rol(
-            worker_handler=worker_handler,
-            store_id=store_id,
-            user_id=current_user_id,
-            accepted_roles_list=[1],
-        )
-        if not superuser
-        else superuser
+    rol_condition = await validate_worker_access(
+        worker_handler=worker_handler,
+        store_id=store_id,
+        current_user_id=current_user_id,
+        superuser=superuser,
+        accepted_roles_list=[1],
+        user_id=user_id,
     )
 
     if rol_condition:
@@ -189,9 +340,9 @@ async def update_worker(
         response = schemas.WorkerData(
             user_id=worker.user_id,
             store_id=worker.store_id,
-            store_name=worker.store.name,
+            store_name=worker.store_name,
             rol_id=worker.rol_id,
-            rol_name=worker.rol.name,
+            rol_name=worker.rol_name,
             active=worker.active,
         )
         return response
@@ -210,27 +361,16 @@ async def deactivate_worker(
     user_id: int,
     current_user_id: int = Header(default=None, convert_underscores=True),
     superuser: bool = Header(default=False),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    store_handler = StoresHandler(db)
-    store = await store_handler.get_store(store_id)
-    if not store.active:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="The store is not active",
-        )
-
     worker_handler = WorkersHandler(db)
-
-    rol_condition = (
-        await validate_rol(
-            worker_handler=worker_handler,
-            store_id=store_id,
-            user_id=current_user_id,
-            accepted_roles_list=[1],
-        )
-        if not superuser
-        else superuser
+    rol_condition = await validate_worker_access(
+        worker_handler=worker_handler,
+        store_id=store_id,
+        current_user_id=current_user_id,
+        superuser=superuser,
+        accepted_roles_list=[1],
+        user_id=user_id,
     )
 
     if rol_condition:
@@ -238,9 +378,9 @@ async def deactivate_worker(
         response = schemas.WorkerData(
             user_id=worker.user_id,
             store_id=worker.store_id,
-            store_name=worker.store.name,
+            store_name=worker.store_name,
             rol_id=worker.rol_id,
-            rol_name=worker.rol.name,
+            rol_name=worker.rol_name,
             active=worker.active,
         )
         return response
@@ -259,27 +399,16 @@ async def activate_worker(
     user_id: int,
     current_user_id: int = Header(default=None, convert_underscores=True),
     superuser: bool = Header(default=False),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    store_handler = StoresHandler(db)
-    store = await store_handler.get_store(store_id)
-    if not store.active:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="The store is not active",
-        )
-
     worker_handler = WorkersHandler(db)
-
-    rol_condition = (
-        await validate_rol(
-            worker_handler=worker_handler,
-            store_id=store_id,
-            user_id=current_user_id,
-            accepted_roles_list=[1],
-        )
-        if not superuser
-        else superuser
+    rol_condition = await validate_worker_access(
+        worker_handler=worker_handler,
+        store_id=store_id,
+        current_user_id=current_user_id,
+        superuser=superuser,
+        accepted_roles_list=[1],
+        user_id=user_id,
     )
 
     if rol_condition:
@@ -287,9 +416,9 @@ async def activate_worker(
         response = schemas.WorkerData(
             user_id=worker.user_id,
             store_id=worker.store_id,
-            store_name=worker.store.name,
+            store_name=worker.store_name,
             rol_id=worker.rol_id,
-            rol_name=worker.rol.name,
+            rol_name=worker.rol_name,
             active=worker.active,
         )
         return response
@@ -306,27 +435,16 @@ async def delete_worker(
     user_id: int,
     current_user_id: int = Header(default=None, convert_underscores=True),
     superuser: bool = Header(default=False),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
-    store_handler = StoresHandler(db)
-    store = await store_handler.get_store(store_id)
-    if not store.active:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="The store is not active",
-        )
-
     worker_handler = WorkersHandler(db)
-
-    rol_condition = (
-        await validate_rol(
-            worker_handler=worker_handler,
-            store_id=store_id,
-            user_id=current_user_id,
-            accepted_roles_list=[1],
-        )
-        if not superuser
-        else superuser
+    rol_condition = await validate_worker_access(
+        worker_handler=worker_handler,
+        store_id=store_id,
+        current_user_id=current_user_id,
+        superuser=superuser,
+        accepted_roles_list=[1],
+        user_id=user_id,
     )
 
     if rol_condition:
@@ -1,11 +1,32 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from config import get_settings
+from src.domain import schemas
 from src.domain.models import Country
+from src.utils.snapshot import Snapshot
 
 
 class CountriesHandler:
-    def __init__(self, db: Session) -> None:
+    # Reloaded in the background every refresh interval, requests only reload
+    # it themselves when that refresh fell behind or never ran
+    snapshot = Snapshot(max_age=2 * get_settings().reference_data_refresh_interval)
+
+    def __init__(self, db: AsyncSession) -> None:
         self.db = db
 
     async def get_countries(self):
-        return self.db.query(Country.id, Country.name).filter_by(active=True).all()
+        result = await self.db.execute(
+            select(Country.id, Country.name).filter_by(active=True)
+        )
+        return result.all()
+
+    async def get_countries_snapshot(self) -> Snapshot:
+        if self.snapshot.is_stale():
+            await self.refresh_snapshot()
+        return self.snapshot
+
+    async def refresh_snapshot(self) -> None:
+        countries = await self.get_countries()
+        response = schemas.CountriesList(countries=countries)
+        self.snapshot.update(response.json(separators=(",", ":")).encode())
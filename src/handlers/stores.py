@@ -1,10 +1,48 @@
+from datetime import datetime
+from typing import AsyncIterable, List, Optional, Tuple
+
 from fastapi import HTTPException, status
-from psycopg2.errors import UniqueViolation
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
+from sqlalchemy import (
+    Float,
+    and_,
+    case,
+    cast,
+    delete,
+    func,
+    insert,
+    literal_column,
+    or_,
+    select,
+    tuple_,
+    update,
+)
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.adapters.cache import entity_cache, single_flight
+from src.adapters.orm import (
+    get_insert,
+    in_ids,
+    settled_before,
+    supports_returning,
+)
+from src.adapters.unit_of_work import get_unit_of_work
 from src.domain import schemas
-from src.domain.models import Store
+from src.domain.models import (
+    COUNTERS,
+    Country,
+    CountryStoreCount,
+    RolWorkerCount,
+    Store,
+    StoreWorkerCount,
+    Worker,
+    store_search_document,
+    store_search_text,
+)
+
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
 
 
 class StoresHandler:
@@ -13,12 +51,77 @@ class StoresHandler:
         detail="Store not found",
     )
 
-    def __init__(self, db: Session) -> None:
+    # Rows per multi-row INSERT, keeps the bound parameters under the drivers' limits
+    bulk_chunk_size = 1000
+    upsert_columns = (
+        "country_id",
+        "name",
+        "legal_name",
+        "address",
+        "zip_code",
+        "email",
+        "phone",
+    )
+
+    # Plain rows with the StoreData columns, no ORM objects to build per store
+    data_columns = tuple(
+        Store.__table__.columns[field] for field in schemas.StoreData.__fields__
+    )
+
+    export_columns = data_columns + (Store.created_at, Store.updated_at)
+    # Rows per fetch from the server side cursor used by the exports
+    export_batch_size = 1000
+
+    # updated_at is also the position of each store in the change feed
+    change_columns = data_columns + (Store.updated_at,)
+
+    # Position of each store by the sort keys of the listing. Every key has an
+    # index in this order, alone and after country_id, so the listing never sorts
+    sort_positions = {
+        "id": (Store.id,),
+        "created_at": (Store.created_at, Store.id),
+        "updated_at": (Store.updated_at, Store.id),
+    }
+
+    # StoreData dicts by store id
+    cache = entity_cache("store")
+
+    def __init__(self, db: AsyncSession) -> None:
         self.db = db
 
+    async def _write_store(self, query, store_id: int = None):
+        unit_of_work = get_unit_of_work(self.db)
+        async with unit_of_work.transaction():
+            if supports_returning(self.db):
+                result = await self.db.execute(
+                    query.returning(*Store.__table__.columns)
+                )
+                store = result.first()
+            else:
+                result = await self.db.execute(query)
+                store = None
+                if result.rowcount:
+                    store_id = store_id or result.inserted_primary_key[0]
+                    result = await self.db.execute(
+                        select(Store.__table__).filter(Store.id == store_id)
+                    )
+                    store = result.first()
+
+            if store is None:
+                raise self.not_found_exception
+            if store_id:
+                await unit_of_work.after_commit(lambda: self._invalidate(store_id))
+        return store
+
+    async def _invalidate(self, *store_ids: int) -> None:
+        # The workers lists in flight carry the store name and status too
+        for store_id in store_ids:
+            single_flight.forget("workers", store_id)
+        await self.cache.invalidate(*store_ids)
+
     async def create_store(self, store: schemas.StoreCreate):
         try:
-            new_store = Store(
+            query = insert(Store.__table__).values(
                 country_id=store.country_id,
                 tax_id=store.tax_id,
                 name=store.name,
@@ -28,59 +131,385 @@ class StoresHandler:
                 email=store.email,
                 phone=store.phone,
             )
-            self.db.add(new_store)
-            self.db.commit()
-            self.db.refresh(new_store)
-            return new_store
-        except (IntegrityError, UniqueViolation):
+            return await self._write_store(query)
+        except IntegrityError:
             raise HTTPException(
                 status_code=400,
                 detail="An error occurred: the store already exists or the country is not valid",
             )
 
-    async def get_stores(self, page: int, per_page: int):
-        stores = (
-            self.db.query(Store).offset(per_page * (page - 1)).limit(per_page).all()
+    async def upsert_stores(
+        self,
+        stores: AsyncIterable[Tuple[int, schemas.StoreCreate]],
+        owner_id: int,
+    ) -> dict:
+        result = await self.db.execute(select(Country.id))
+        country_ids = set(result.scalars().all())
+        summary = {"created": 0, "updated": 0, "errors": []}
+
+        try:
+            unit_of_work = get_unit_of_work(self.db)
+            async with unit_of_work.transaction():
+                updated_ids = []
+                chunk = {}
+                async for line, store in stores:
+                    if store.country_id not in country_ids:
+                        summary["errors"].append(
+                            {
+                                "line": line,
+                                "tax_id": store.tax_id,
+                                "detail": "The country is not valid",
+                            }
+                        )
+                        continue
+                    # A statement can't upsert the same tax_id twice
+                    if store.tax_id in chunk or len(chunk) >= self.bulk_chunk_size:
+                        updated_ids += await self._save_chunk(chunk, owner_id, summary)
+                        chunk = {}
+                    chunk[store.tax_id] = (line, store.dict())
+                if chunk:
+                    updated_ids += await self._save_chunk(chunk, owner_id, summary)
+                await unit_of_work.after_commit(lambda: self._invalidate(*updated_ids))
+        except IntegrityError:
+            raise HTTPException(
+                status_code=400,
+                detail="An error occurred: the stores could not be saved",
+            )
+        return summary
+
+    # A chunk that fails is retried store by store, each in its own savepoint, so
+    # only the stores that fail are left out of the batch. Returns the updated ids
+    async def _save_chunk(self, chunk: dict, owner_id: int, summary: dict) -> list:
+        upserted = await self._try_upsert([row for _, row in chunk.values()], owner_id)
+        if upserted is None:
+            upserted = []
+            for line, row in chunk.values():
+                saved = await self._try_upsert([row], owner_id)
+                if saved is None:
+                    summary["errors"].append(
+                        {
+                            "line": line,
+                            "tax_id": row["tax_id"],
+                            "detail": "The store could not be saved",
+                        }
+                    )
+                else:
+                    upserted += saved
+        updated_ids = [store_id for store_id, inserted in upserted if not inserted]
+        summary["created"] += len(upserted) - len(updated_ids)
+        summary["updated"] += len(updated_ids)
+        return updated_ids
+
+    async def _try_upsert(self, rows: List[dict], owner_id: int) -> Optional[list]:
+        try:
+            async with get_unit_of_work(self.db).savepoint():
+                return await self._upsert_chunk(rows, owner_id)
+        # Constraints and values a column rejects fail only their rows. asyncpg
+        # raises most of them as a bare DBAPIError. A lost connection fails every
+        # row, so it isn't retried
+        except DBAPIError as error:
+            if error.connection_invalidated:
+                raise
+            return None
+
+    # (id, inserted) for each store in the chunk
+    async def _upsert_chunk(self, rows: List[dict], owner_id: int) -> list:
+        insert = get_insert(self.db)
+        query = insert(Store).values(rows)
+        query = query.on_conflict_do_update(
+            index_elements=["tax_id"],
+            set_={
+                **{column: query.excluded[column] for column in self.upsert_columns},
+                "updated_at": func.now(),
+            },
+        )
+
+        if supports_returning(self.db):
+            # xmax is only zero for the rows this statement inserted
+            result = await self.db.execute(
+                query.returning(Store.id, literal_column("xmax = 0").label("inserted"))
+            )
+            upserted = result.all()
+        else:
+            tax_ids = [row["tax_id"] for row in rows]
+            result = await self.db.execute(
+                select(Store.tax_id).filter(Store.tax_id.in_(tax_ids))
+            )
+            existing = set(result.scalars().all())
+            await self.db.execute(query)
+            result = await self.db.execute(
+                select(Store.id, Store.tax_id).filter(Store.tax_id.in_(tax_ids))
+            )
+            upserted = [(id, tax_id not in existing) for id, tax_id in result.all()]
+
+        # Only the stores this upload created get the uploader as their admin, the
+        # ones it updated keep their workers
+        admins = [
+            {"user_id": owner_id, "store_id": store_id, "rol_id": 1}
+            for store_id, inserted in upserted
+            if inserted
+        ]
+        if admins:
+            await self.db.execute(
+                insert(Worker)
+                .values(admins)
+                .on_conflict_do_nothing(index_elements=["user_id", "store_id"])
+            )
+        return [tuple(row) for row in upserted]
+
+    async def get_stores(
+        self,
+        page: int,
+        per_page: int,
+        after: tuple = None,
+        sort: str = "id",
+        country_id: int = None,
+        active: bool = None,
+        created_from: datetime = None,
+        created_to: datetime = None,
+        updated_from: datetime = None,
+        updated_to: datetime = None,
+    ):
+        position = self.sort_positions[sort.lstrip("-")]
+        descending = sort.startswith("-")
+        # One extra row tells the caller if there is a next page
+        query = (
+            select(*self.data_columns, Store.created_at, Store.updated_at)
+            .order_by(*(column.desc() if descending else column for column in position))
+            .limit(per_page + 1)
+        )
+        if country_id is not None:
+            query = query.filter(Store.country_id == country_id)
+        if active is not None:
+            query = query.filter(Store.active.is_(active))
+        if created_from is not None:
+            query = query.filter(Store.created_at >= created_from)
+        if created_to is not None:
+            query = query.filter(Store.created_at < created_to)
+        if updated_from is not None:
+            query = query.filter(Store.updated_at >= updated_from)
+        if updated_to is not None:
+            query = query.filter(Store.updated_at < updated_to)
+
+        if after is not None:
+            current = tuple_(*position)
+            after = tuple_(*after, types=[column.type for column in position])
+            query = query.filter(current < after if descending else current > after)
+        else:
+            query = query.offset(per_page * (page - 1))
+        result = await self.db.execute(query)
+        return result.all()
+
+    # Stores by id, with the rol of user_id in each of them when it's given so the
+    # caller is authorized against all of them in the same query
+    async def lookup_stores(self, store_ids: List[int], user_id: int = None) -> dict:
+        query = select(*self.data_columns).filter(in_ids(self.db, Store.id, store_ids))
+        if user_id is not None:
+            query = query.add_columns(
+                Worker.rol_id.label("caller_rol_id"),
+                Worker.active.label("caller_active"),
+            ).outerjoin(
+                Worker, and_(Worker.store_id == Store.id, Worker.user_id == user_id)
+            )
+        result = await self.db.execute(query)
+        return {store.id: store for store in result.all()}
+
+    # Best matches first, ties by id. after is the (rank, id) of the last store sent
+    async def search_stores(self, terms: str, limit: int, after: tuple = None):
+        rank, match = self._search(terms)
+        # One extra row tells the caller if there is a next page
+        query = (
+            select(*self.data_columns, rank.label("rank"))
+            .filter(match)
+            .order_by(rank.desc(), Store.id)
+            .limit(limit + 1)
+        )
+        if after is not None:
+            after_rank, after_id = after
+            query = query.filter(
+                or_(rank < after_rank, and_(rank == after_rank, Store.id > after_id))
+            )
+        result = await self.db.execute(query)
+        return result.all()
+
+    def _search(self, terms: str) -> tuple:
+        terms = terms.lower()
+        words = terms.split()
+        if self.db.bind.dialect.name == "postgresql":
+            # Every word as a word prefix, on the tsvector index, or the whole text
+            # anywhere, on the trigram one. Quotes keep the words from being read
+            # as tsquery operators
+            quoted = [word.replace("'", "").replace("\\", "") for word in words]
+            prefixes = " & ".join(f"'{word}':*" for word in quoted if word)
+            query = func.to_tsquery(literal_column("'simple'::regconfig"), prefixes)
+            # Text matches that aren't word prefixes rank 0, after the rest
+            rank = cast(func.ts_rank(store_search_document, query), Float)
+            match = or_(
+                store_search_document.op("@@")(query),
+                store_search_text.like(f"%{escape_like(terms)}%", escape="\\"),
+            )
+            return rank, match
+
+        # Without those indexes every word must be somewhere in the text, and the
+        # stores whose name starts with the search go first
+        match = and_(
+            *(
+                store_search_text.like(f"%{escape_like(word)}%", escape="\\")
+                for word in words
+            )
+        )
+        name_prefix = func.lower(Store.name).like(f"{escape_like(terms)}%", escape="\\")
+        return cast(case((name_prefix, 1), else_=0), Float), match
+
+    async def get_store_changes(self, limit: int, after: tuple = None):
+        # One extra row tells the caller if there are more changes
+        query = (
+            select(*self.change_columns)
+            .order_by(Store.updated_at, Store.id)
+            .limit(limit + 1)
+        )
+        if after is not None:
+            position = (Store.updated_at, Store.id)
+            query = query.filter(
+                tuple_(*position)
+                > tuple_(*after, types=[column.type for column in position])
+            )
+        settled = settled_before(self.db)
+        if settled is not None:
+            query = query.filter(Store.updated_at < settled)
+        result = await self.db.execute(query)
+        return result.all()
+
+    async def stream_stores(
+        self, country_id: int = None, active: bool = None, since: datetime = None
+    ):
+        query = select(*self.export_columns).order_by(Store.id)
+        if country_id is not None:
+            query = query.filter(Store.country_id == country_id)
+        if active is not None:
+            query = query.filter(Store.active.is_(active))
+        if since is not None:
+            query = query.filter(Store.updated_at >= since)
+        result = await self.db.stream(
+            query.execution_options(yield_per=self.export_batch_size)
         )
-        return stores
+        return result.partitions()
 
-    async def get_store(self, store_id: int):
-        store = self.db.query(Store).get(store_id)
+    async def get_store(self, store_id: int) -> dict:
+        return await self.cache.get(
+            store_id,
+            lambda: self._load_store(store_id),
+            replica=self.db.info.get("replica", False),
+        )
+
+    async def _load_store(self, store_id: int) -> dict:
+        result = await self.db.execute(
+            select(*self.data_columns).filter(Store.id == store_id)
+        )
+        store = result.first()
         if store is None:
             raise self.not_found_exception
-        return store
+        return dict(store._mapping)
 
-    async def update_store(self, store_id: int, data: schemas.StoreUpdate):
-        store = self.db.query(Store).get(store_id)
-        if store is None:
+    # Read from the counters, so it takes a row per rol of the store whatever its
+    # number of workers
+    async def get_store_stats(self, store_id: int) -> list:
+        result = await self.db.execute(
+            select(
+                StoreWorkerCount.rol_id,
+                StoreWorkerCount.workers,
+                StoreWorkerCount.active_workers,
+            )
+            .select_from(Store)
+            .outerjoin(
+                StoreWorkerCount,
+                and_(
+                    StoreWorkerCount.store_id == Store.id, StoreWorkerCount.workers > 0
+                ),
+            )
+            .filter(Store.id == store_id)
+            .order_by(StoreWorkerCount.rol_id)
+        )
+        counts = result.all()
+        if not counts:
             raise self.not_found_exception
-        store.name = data.name
-        store.legal_name = data.legal_name
-        store.address = data.address
-        store.zip_code = data.zip_code
-        store.email = data.email
-        store.phone = data.phone
-        self.db.add(store)
-        self.db.commit()
-        self.db.refresh(store)
-        return store
+        # A store without workers still comes, with no counts
+        return [count for count in counts if count.rol_id is not None]
+
+    # The global counters keep a row per key from the last fold plus one per write
+    # since, so these sum a few rows whatever the number of stores and workers
+    async def get_stats(self) -> tuple:
+        countries = await self.db.execute(
+            select(
+                CountryStoreCount.country_id,
+                func.sum(CountryStoreCount.stores).label("stores"),
+                func.sum(CountryStoreCount.active_stores).label("active_stores"),
+            )
+            .group_by(CountryStoreCount.country_id)
+            .having(func.sum(CountryStoreCount.stores) > 0)
+            .order_by(CountryStoreCount.country_id)
+        )
+        roles = await self.db.execute(
+            select(
+                RolWorkerCount.rol_id,
+                func.sum(RolWorkerCount.workers).label("workers"),
+                func.sum(RolWorkerCount.active_workers).label("active_workers"),
+            )
+            .group_by(RolWorkerCount.rol_id)
+            .having(func.sum(RolWorkerCount.workers) > 0)
+            .order_by(RolWorkerCount.rol_id)
+        )
+        return countries.all(), roles.all()
+
+    # Replaces the rows of each global counter with one per key, and none for the
+    # keys back at zero
+    async def fold_counters(self):
+        for table in (CountryStoreCount.__table__, RolWorkerCount.__table__):
+            if supports_returning(self.db):
+                # Sums exactly the rows it deletes, so the ones of writes still
+                # open are left for the next fold and no write waits for it
+                rows = delete(table).returning(*table.c).cte("folded")
+                await self.db.execute(self._sum_rows(table, rows).add_cte(rows))
+                continue
+            # SQLite runs one write at a time, nothing commits in between
+            last_id = await self.db.scalar(select(func.max(table.c.id)))
+            if last_id is None:
+                continue
+            rows = select(table).filter(table.c.id <= last_id).subquery()
+            await self.db.execute(self._sum_rows(table, rows))
+            await self.db.execute(delete(table).where(table.c.id <= last_id))
+
+    @staticmethod
+    def _sum_rows(table, rows):
+        _, keys, counts = COUNTERS[table.name]
+        key_columns = [rows.c[key] for key in keys]
+        sums = [func.sum(rows.c[count]) for count in counts]
+        return insert(table).from_select(
+            keys + tuple(counts),
+            select(*key_columns, *sums)
+            .group_by(*key_columns)
+            .having(or_(*(total != 0 for total in sums))),
+        )
+
+    async def update_store(self, store_id: int, data: schemas.StoreUpdate):
+        query = (
+            update(Store.__table__)
+            .where(Store.id == store_id)
+            .values(
+                name=data.name,
+                legal_name=data.legal_name,
+                address=data.address,
+                zip_code=data.zip_code,
+                email=data.email,
+                phone=data.phone,
+            )
+        )
+        return await self._write_store(query, store_id)
 
     async def deactivate_store(self, store_id: int):
-        store = self.db.query(Store).get(store_id)
-        if store is None:
-            raise self.not_found_exception
-        store.active = False
-        self.db.add(store)
-        self.db.commit()
-        self.db.refresh(store)
-        return store
+        query = update(Store.__table__).where(Store.id == store_id).values(active=False)
+        return await self._write_store(query, store_id)
 
     async def activate_store(self, store_id: int):
-        store = self.db.query(Store).get(store_id)
-        if store is None:
-            raise self.not_found_exception
-        store.active = True
-        self.db.add(store)
-        self.db.commit()
-        self.db.refresh(store)
-        return store
+        query = update(Store.__table__).where(Store.id == store_id).values(active=True)
+        return await self._write_store(query, store_id)
@@ -1,10 +1,36 @@
+from datetime import datetime
+from typing import List, Tuple
+
 from fastapi import HTTPException, status
-from psycopg2.errors import UniqueViolation
+from sqlalchemy import (
+    and_,
+    cast,
+    delete,
+    false,
+    insert,
+    null,
+    select,
+    true,
+    tuple_,
+    union_all,
+    update,
+)
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from config import get_settings
+from src.adapters.cache import coalesce, entity_cache, single_flight
+from src.adapters.orm import (
+    get_insert,
+    in_ids,
+    settled_before,
+    supports_returning,
+)
+from src.adapters.unit_of_work import get_unit_of_work
 from src.domain import schemas
-from src.domain.models import Worker
+from src.domain.models import Rol, Store, Worker, WorkerDeletion
+from src.handlers.stores import StoresHandler
+from src.utils.cache import TTLCache
 
 
 class WorkersHandler:
@@ -13,74 +39,408 @@ class WorkersHandler:
         detail="Worker not found",
     )
 
-    def __init__(self, db: Session):
+    # (store_id, user_id) -> (rol_id, active), shared by every request in the process
+    rol_cache = TTLCache(
+        maxsize=get_settings().rol_cache_maxsize,
+        ttl=get_settings().rol_cache_ttl,
+    )
+
+    # (store_id, user_id) -> worker dicts without the store name, which is read from
+    # the store cache so a renamed store doesn't leave its workers stale
+    cache = entity_cache("worker")
+    cache_fields = ("user_id", "store_id", "rol_id", "rol_name", "active")
+
+    # Rows per multi-row INSERT, keeps the bound parameters under the drivers' limits
+    bulk_chunk_size = 1000
+
+    export_columns = (
+        Worker.user_id,
+        Worker.store_id,
+        Worker.rol_id,
+        Worker.active,
+        Worker.updated_at,
+    )
+    # Rows per fetch from the server side cursor used by the exports
+    export_batch_size = 1000
+
+    def __init__(self, db: AsyncSession):
         self.db = db
 
     async def create_worker(self, worker: schemas.WorkerCreate):
         try:
-            new_worker = Worker(
+            query = insert(Worker.__table__).values(
                 user_id=worker.user_id,
                 store_id=worker.store_id,
                 rol_id=worker.rol_id,
             )
-            self.db.add(new_worker)
-            self.db.commit()
-            self.db.refresh(new_worker)
-            return new_worker
-        except (IntegrityError, UniqueViolation):
+            return await self._write_worker(query, worker.store_id, worker.user_id)
+        except IntegrityError:
             raise HTTPException(
                 status_code=400,
                 detail="The worker already exists or rol is not valid",
             )
 
-    async def get_workers(self, page: int, per_page: int, store_id: int):
-        workers = (
-            self.db.query(Worker)
+    async def create_workers(
+        self, store_id: int, workers: List[schemas.WorkerBulkItem]
+    ) -> List[str]:
+        result = await self.db.execute(
+            select(Rol.id).filter(Rol.id.in_({worker.rol_id for worker in workers}))
+        )
+        valid_rol_ids = set(result.scalars().all())
+
+        statuses = []
+        rows = {}
+        for worker in workers:
+            if worker.rol_id not in valid_rol_ids:
+                statuses.append("invalid_rol")
+            elif worker.user_id in rows:
+                statuses.append("duplicated")
+            else:
+                rows[worker.user_id] = {
+                    "user_id": worker.user_id,
+                    "store_id": store_id,
+                    "rol_id": worker.rol_id,
+                }
+                statuses.append(None)
+
+        try:
+            unit_of_work = get_unit_of_work(self.db)
+            async with unit_of_work.transaction():
+                created_ids = await self._insert_workers(store_id, list(rows.values()))
+                await unit_of_work.after_commit(
+                    lambda: single_flight.forget("workers", store_id)
+                )
+        except IntegrityError:
+            raise HTTPException(
+                status_code=400,
+                detail="The workers could not be created",
+            )
+
+        return [
+            status or ("created" if worker.user_id in created_ids else "exists")
+            for worker, status in zip(workers, statuses)
+        ]
+
+    async def _insert_workers(self, store_id: int, rows: List[dict]) -> set:
+        insert = get_insert(self.db)
+        returning = supports_returning(self.db)
+        created_ids = set()
+
+        for start in range(0, len(rows), self.bulk_chunk_size):
+            chunk = rows[start : start + self.bulk_chunk_size]
+            query = (
+                insert(Worker)
+                .values(chunk)
+                .on_conflict_do_nothing(index_elements=["user_id", "store_id"])
+            )
+            if returning:
+                result = await self.db.execute(query.returning(Worker.user_id))
+                created_ids.update(result.scalars().all())
+                continue
+
+            # Without RETURNING the rows that already exist are looked up first
+            user_ids = [row["user_id"] for row in chunk]
+            result = await self.db.execute(
+                select(Worker.user_id).filter(
+                    Worker.store_id == store_id, Worker.user_id.in_(user_ids)
+                )
+            )
+            existing_ids = set(result.scalars().all())
+            await self.db.execute(query)
+            created_ids.update(set(user_ids) - existing_ids)
+
+        return created_ids
+
+    # Worker columns plus the store and rol fields used by the responses, so
+    # they come in the same query instead of lazy loading the relationships
+    @staticmethod
+    def _worker_data(workers=Worker.__table__):
+        return (
+            select(
+                workers.c.user_id,
+                workers.c.store_id,
+                workers.c.rol_id,
+                workers.c.active,
+                Store.name.label("store_name"),
+                Store.active.label("store_active"),
+                Rol.name.label("rol_name"),
+            )
+            .join_from(workers, Store, Store.id == workers.c.store_id)
+            .join(Rol, Rol.id == workers.c.rol_id)
+        )
+
+    async def _write_worker(self, query, store_id: int, user_id: int):
+        unit_of_work = get_unit_of_work(self.db)
+        async with unit_of_work.transaction():
+            if supports_returning(self.db):
+                # The written row is joined to its store and rol in one round trip
+                written = query.returning(*Worker.__table__.columns).cte(
+                    "written_worker"
+                )
+                result = await self.db.execute(self._worker_data(written))
+                worker = result.first()
+            else:
+                result = await self.db.execute(query)
+                worker = None
+                if result.rowcount:
+                    result = await self.db.execute(
+                        self._worker_data().filter(
+                            Worker.store_id == store_id, Worker.user_id == user_id
+                        )
+                    )
+                    worker = result.first()
+
+            if worker is None:
+                raise self.not_found_exception
+            await unit_of_work.after_commit(self._invalidate(store_id, user_id))
+        return worker
+
+    def _invalidate(self, store_id: int, user_id: int):
+        async def invalidate():
+            self.rol_cache.invalidate((store_id, user_id))
+            single_flight.forget("worker_rol", store_id, user_id)
+            single_flight.forget("workers", store_id)
+            await self.cache.invalidate((store_id, user_id))
+
+        return invalidate
+
+    async def get_workers(
+        self, page: int, per_page: int, store_id: int, after_user_id: int = None
+    ):
+        return await coalesce(
+            self.db,
+            ("workers", store_id, page, per_page, after_user_id),
+            lambda: self._load_workers(page, per_page, store_id, after_user_id),
+        )
+
+    async def _load_workers(
+        self, page: int, per_page: int, store_id: int, after_user_id: int = None
+    ):
+        # One extra row tells the caller if there is a next page
+        query = (
+            self._worker_data()
             .filter(Worker.store_id == store_id)
-            .offset(per_page * (page - 1))
-            .limit(per_page)
-            .all()
+            .order_by(Worker.user_id)
+            .limit(per_page + 1)
+        )
+        if after_user_id is not None:
+            query = query.filter(Worker.user_id > after_user_id)
+        else:
+            query = query.offset(per_page * (page - 1))
+        result = await self.db.execute(query)
+        return result.all()
+
+    # The workers written and the ones deleted, each walked on its own index, in one
+    # feed. A deleted worker has no row left, so it comes with only its keys. One
+    # extra change tells the caller if there are more
+    async def get_worker_changes(self, limit: int, after: tuple = None):
+        settled = settled_before(self.db)
+        feeds = []
+        for columns, position in (
+            (
+                self.export_columns + (false().label("deleted"),),
+                (Worker.updated_at, Worker.store_id, Worker.user_id),
+            ),
+            (
+                (
+                    WorkerDeletion.user_id,
+                    WorkerDeletion.store_id,
+                    cast(null(), Worker.rol_id.type).label("rol_id"),
+                    cast(null(), Worker.active.type).label("active"),
+                    WorkerDeletion.deleted_at.label("updated_at"),
+                    true().label("deleted"),
+                ),
+                (
+                    WorkerDeletion.deleted_at,
+                    WorkerDeletion.store_id,
+                    WorkerDeletion.user_id,
+                ),
+            ),
+        ):
+            query = select(*columns).order_by(*position).limit(limit + 1)
+            if after is not None:
+                query = query.filter(
+                    tuple_(*position)
+                    > tuple_(*after, types=[column.type for column in position])
+                )
+            if settled is not None:
+                query = query.filter(position[0] < settled)
+            feeds.append(select(query.subquery()))
+        changes = union_all(*feeds).subquery()
+        result = await self.db.execute(
+            select(changes)
+            .order_by(changes.c.updated_at, changes.c.store_id, changes.c.user_id)
+            .limit(limit + 1)
+        )
+        return result.all()
+
+    async def stream_workers(
+        self,
+        store_id: int = None,
+        country_id: int = None,
+        active: bool = None,
+        since: datetime = None,
+    ):
+        query = select(*self.export_columns).order_by(Worker.store_id, Worker.user_id)
+        if store_id is not None:
+            query = query.filter(Worker.store_id == store_id)
+        if country_id is not None:
+            query = query.join(Store, Store.id == Worker.store_id).filter(
+                Store.country_id == country_id
+            )
+        if active is not None:
+            query = query.filter(Worker.active.is_(active))
+        if since is not None:
+            query = query.filter(Worker.updated_at >= since)
+        result = await self.db.stream(
+            query.execution_options(yield_per=self.export_batch_size)
+        )
+        return result.partitions()
+
+    async def get_worker(self, store_id: int, user_id: int) -> dict:
+        store_names = []
+
+        async def load_worker():
+            result = await self.db.execute(
+                self._worker_data().filter(
+                    Worker.store_id == store_id, Worker.user_id == user_id
+                )
+            )
+            worker = result.first()
+            if not worker:
+                raise self.not_found_exception
+            store_names.append(worker.store_name)
+            return {field: getattr(worker, field) for field in self.cache_fields}
+
+        worker = await self.cache.get(
+            (store_id, user_id), load_worker, replica=self.db.info.get("replica", False)
+        )
+        # A miss already joined the store, hits take its name from the store cache
+        if store_names:
+            store_name = store_names[0]
+        else:
+            store_name = (await StoresHandler(self.db).get_store(store_id))["name"]
+        return {**worker, "store_name": store_name}
+
+    # Store status, caller rol and target worker in one round trip, for the routes
+    # that check all of them before writing
+    async def get_access_context(
+        self, store_id: int, current_user_id: int, user_id: int = None
+    ):
+        caller = Worker.__table__.alias("caller")
+        target = Worker.__table__.alias("target")
+        query = (
+            select(
+                Store.active.label("store_active"),
+                caller.c.rol_id.label("caller_rol_id"),
+                caller.c.active.label("caller_active"),
+                target.c.user_id.label("target_user_id"),
+            )
+            .outerjoin(
+                caller,
+                and_(
+                    caller.c.store_id == Store.id, caller.c.user_id == current_user_id
+                ),
+            )
+            .outerjoin(
+                target, and_(target.c.store_id == Store.id, target.c.user_id == user_id)
+            )
+            .filter(Store.id == store_id)
         )
-        return workers
+        result = await self.db.execute(query)
+        context = result.first()
+        if context is None:
+            raise StoresHandler.not_found_exception
+        return context
+
+    async def get_worker_rol(self, store_id: int, user_id: int):
+        key = (store_id, user_id)
+        rol = self.rol_cache.get(key)
+        if rol is TTLCache.missing:
+            rol = await coalesce(
+                self.db,
+                ("worker_rol", store_id, user_id),
+                lambda: self._load_worker_rol(store_id, user_id),
+            )
+        return rol
 
-    async def get_worker(self, store_id: int, user_id: int):
-        worker = (
-            self.db.query(Worker)
-            .filter(Worker.store_id == store_id, Worker.user_id == user_id)
-            .first()
+    async def _load_worker_rol(self, store_id: int, user_id: int) -> tuple:
+        result = await self.db.execute(
+            select(Worker.rol_id, Worker.active).filter(
+                Worker.store_id == store_id, Worker.user_id == user_id
+            )
         )
-        if not worker:
+        rol = result.first()
+        if not rol:
             raise self.not_found_exception
-        return worker
+        rol = tuple(rol)
+        self.cache_rol((store_id, user_id), rol)
+        return rol
+
+    # Like the entity caches, roles read on a replica may be older than the last
+    # invalidation, so only the ones read on the primary are kept
+    def cache_rol(self, key: tuple, rol: tuple) -> None:
+        if not self.db.info.get("replica", False):
+            self.rol_cache.set(key, rol)
+
+    # (rol_id, active) of user_id by store, for the stores it works in
+    async def get_worker_roles(self, store_ids: List[int], user_id: int) -> dict:
+        result = await self.db.execute(
+            select(Worker.store_id, Worker.rol_id, Worker.active).filter(
+                Worker.user_id == user_id, in_ids(self.db, Worker.store_id, store_ids)
+            )
+        )
+        roles = {}
+        for store_id, rol_id, active in result.all():
+            roles[store_id] = (rol_id, active)
+            self.cache_rol((store_id, user_id), (rol_id, active))
+        return roles
+
+    # Workers by (store_id, user_id), joined like get_worker
+    async def lookup_workers(self, keys: List[Tuple[int, int]]) -> dict:
+        if not keys:
+            return {}
+        result = await self.db.execute(
+            self._worker_data().filter(
+                tuple_(Worker.store_id, Worker.user_id).in_(keys)
+            )
+        )
+        return {(worker.store_id, worker.user_id): worker for worker in result.all()}
+
+    def _update_worker(self, store_id: int, user_id: int):
+        return update(Worker.__table__).where(
+            Worker.store_id == store_id, Worker.user_id == user_id
+        )
 
     async def update_worker(
         self, store_id: int, user_id: int, worker: schemas.WorkerUpdate
     ):
         try:
-            worker_to_update = await self.get_worker(store_id, user_id)
-            worker_to_update.rol_id = worker.rol_id
-            self.db.commit()
-            return worker_to_update
-        except (IntegrityError, UniqueViolation):
+            query = self._update_worker(store_id, user_id).values(rol_id=worker.rol_id)
+            return await self._write_worker(query, store_id, user_id)
+        except IntegrityError:
             raise HTTPException(
                 status_code=400,
                 detail="The worker already exists or rol is not valid",
             )
 
     async def deactivate_worker(self, store_id: int, user_id: int):
-        worker_to_update = await self.get_worker(store_id, user_id)
-        worker_to_update.active = False
-        self.db.commit()
-        return worker_to_update
+        query = self._update_worker(store_id, user_id).values(active=False)
+        return await self._write_worker(query, store_id, user_id)
 
     async def activate_worker(self, store_id: int, user_id: int):
-        worker_to_update = await self.get_worker(store_id, user_id)
-        worker_to_update.active = True
-        self.db.commit()
-        return worker_to_update
+        query = self._update_worker(store_id, user_id).values(active=True)
+        return await self._write_worker(query, store_id, user_id)
 
     async def delete_worker(self, store_id: int, user_id: int):
-        worker_to_delete = await self.get_worker(store_id, user_id)
-        self.db.delete(worker_to_delete)
-        self.db.commit()
+        unit_of_work = get_unit_of_work(self.db)
+        async with unit_of_work.transaction():
+            result = await self.db.execute(
+                delete(Worker.__table__).where(
+                    Worker.store_id == store_id, Worker.user_id == user_id
+                )
+            )
+            if not result.rowcount:
+                raise self.not_found_exception
+            await unit_of_work.after_commit(self._invalidate(store_id, user_id))
         return None
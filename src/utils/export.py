@@ -0,0 +1,61 @@
+import csv
+import io
+import zlib
+from typing import AsyncIterator, Sequence
+
+import orjson
+from fastapi.responses import StreamingResponse
+
+media_types = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+async def ndjson_chunks(
+    partitions: AsyncIterator[Sequence], fields: Sequence[str]
+) -> AsyncIterator[bytes]:
+    async for rows in partitions:
+        yield b"".join(orjson.dumps(dict(zip(fields, row))) + b"\n" for row in rows)
+
+
+async def csv_chunks(
+    partitions: AsyncIterator[Sequence], fields: Sequence[str]
+) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    async for rows in partitions:
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+async def gzip_chunks(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+# Rows are encoded one partition at a time, so memory doesn't grow with the export
+def export_response(
+    partitions: AsyncIterator[Sequence],
+    fields: Sequence[str],
+    export_format: str,
+    compress: bool,
+    filename: str,
+) -> StreamingResponse:
+    encode = ndjson_chunks if export_format == "ndjson" else csv_chunks
+    chunks = encode(partitions, fields)
+    headers = {
+        "Content-Disposition": f'attachment; filename="{filename}.{export_format}"'
+    }
+    if compress:
+        chunks = gzip_chunks(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        chunks, media_type=media_types[export_format], headers=headers
+    )
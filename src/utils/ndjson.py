@@ -0,0 +1,28 @@
+from typing import AsyncIterator, Optional, Tuple
+
+
+# Splits a streamed body into numbered lines without buffering more than a line.
+# A line longer than max_line_size is dropped as it arrives and comes as None
+async def iter_ndjson(
+    stream: AsyncIterator[bytes], max_line_size: int
+) -> AsyncIterator[Tuple[int, Optional[bytes]]]:
+    number = 0
+    buffer = b""
+    oversized = False
+    async for chunk in stream:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            number += 1
+            if oversized or len(line) > max_line_size:
+                oversized = False
+                yield number, None
+            elif line.strip():
+                yield number, line
+        if len(buffer) > max_line_size:
+            oversized = True
+            buffer = b""
+    if oversized or len(buffer) > max_line_size:
+        yield number + 1, None
+    elif buffer.strip():
+        yield number + 1, buffer
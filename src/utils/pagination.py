@@ -0,0 +1,64 @@
+import base64
+import json
+from datetime import datetime
+
+from fastapi import HTTPException, status
+
+from config import get_settings
+from src.utils.validation import naive_utc
+
+
+def clamp_per_page(per_page: int) -> int:
+    return max(1, min(per_page, get_settings().max_per_page))
+
+
+def encode_cursor(*values) -> str:
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+# JSON values each cursor type accepts. bool is an int to isinstance, and floats
+# with no fraction may be written as ints
+cursor_types = {int: (int,), float: (int, float), str: (str,)}
+
+
+def is_cursor_value(value, kind: type) -> bool:
+    return isinstance(value, cursor_types[kind]) and not isinstance(value, bool)
+
+
+# Values of a cursor, each checked against its type so that a tampered cursor is
+# rejected here instead of failing in the query
+def decode_cursor(cursor: str, *types: type) -> tuple:
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(cursor + padding))
+    except ValueError:
+        values = None
+
+    if (
+        not isinstance(values, list)
+        or len(values) != len(types)
+        or not all(map(is_cursor_value, values, types))
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="The cursor is not valid",
+        )
+    return tuple(kind(value) for value, kind in zip(values, types))
+
+
+# Change feed tokens are the (updated_at, *primary key) of the last row sent
+def encode_change_token(updated_at: datetime, *keys) -> str:
+    return encode_cursor(updated_at.isoformat(), *keys)
+
+
+def decode_change_token(token: str, *key_types: type) -> tuple:
+    updated_at, *keys = decode_cursor(token, str, *key_types)
+    try:
+        updated_at = datetime.fromisoformat(updated_at)
+    except (TypeError, ValueError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="The cursor is not valid",
+        )
+    return (naive_utc(updated_at), *keys)
@@ -0,0 +1,143 @@
+from typing import Iterable, List, Optional, Tuple
+
+from fastapi.responses import ORJSONResponse
+
+from src.domain import schemas
+
+# Rows come from our own database, so they are serialized as they are instead of
+# building and validating a pydantic model for each one
+store_fields = tuple(schemas.StoreData.__fields__)
+worker_fields = tuple(schemas.WorkerData.__fields__)
+worker_change_fields = tuple(schemas.WorkerChange.__fields__)
+
+
+# Stores are rows, or dicts when they come from the store cache
+def store_data(store) -> dict:
+    if isinstance(store, dict):
+        return {field: store[field] for field in store_fields}
+    return {field: getattr(store, field) for field in store_fields}
+
+
+def store_response(store) -> ORJSONResponse:
+    return ORJSONResponse(store_data(store))
+
+
+def stores_response(stores: Iterable, next_cursor: Optional[str]) -> ORJSONResponse:
+    return ORJSONResponse(
+        {"stores": [store_data(store) for store in stores], "next_cursor": next_cursor}
+    )
+
+
+# Items in request order, the ones in details go without their store
+def stores_lookup_response(
+    store_ids: List[int], stores: dict, details: dict
+) -> ORJSONResponse:
+    return ORJSONResponse(
+        {
+            "stores": [
+                {
+                    "id": store_id,
+                    "store": (
+                        None if store_id in details else store_data(stores[store_id])
+                    ),
+                    "detail": details.get(store_id),
+                }
+                for store_id in store_ids
+            ]
+        }
+    )
+
+
+def rol_counts(counts: Iterable) -> list:
+    return [
+        {
+            "rol_id": count.rol_id,
+            "workers": count.workers,
+            "active_workers": count.active_workers,
+        }
+        for count in counts
+    ]
+
+
+# The store totals add up its counts by rol
+def store_stats_response(store_id: int, counts: list) -> ORJSONResponse:
+    return ORJSONResponse(
+        {
+            "store_id": store_id,
+            "workers": sum(count.workers for count in counts),
+            "active_workers": sum(count.active_workers for count in counts),
+            "roles": rol_counts(counts),
+        }
+    )
+
+
+def stores_stats_response(countries: Iterable, roles: Iterable) -> ORJSONResponse:
+    return ORJSONResponse(
+        {
+            "countries": [
+                {
+                    "country_id": count.country_id,
+                    "stores": count.stores,
+                    "active_stores": count.active_stores,
+                }
+                for count in countries
+            ],
+            "roles": rol_counts(roles),
+        }
+    )
+
+
+def store_changes_response(
+    stores: Iterable, next_token: Optional[str], has_more: bool
+) -> ORJSONResponse:
+    return ORJSONResponse(
+        {
+            "stores": [
+                {**store_data(store), "updated_at": store.updated_at}
+                for store in stores
+            ],
+            "next_token": next_token,
+            "has_more": has_more,
+        }
+    )
+
+
+def worker_changes_response(
+    workers: Iterable, next_token: Optional[str], has_more: bool
+) -> ORJSONResponse:
+    return ORJSONResponse(
+        {
+            "workers": [
+                {field: getattr(worker, field) for field in worker_change_fields}
+                for worker in workers
+            ],
+            "next_token": next_token,
+            "has_more": has_more,
+        }
+    )
+
+
+# Items in request order, the ones in details go without their worker
+def workers_lookup_response(
+    keys: List[Tuple[int, int]], workers: dict, details: dict
+) -> ORJSONResponse:
+    return ORJSONResponse(
+        {
+            "workers": [
+                {
+                    "store_id": store_id,
+                    "user_id": user_id,
+                    "worker": (
+                        None
+                        if (store_id, user_id) in details
+                        else {
+                            field: getattr(workers[store_id, user_id], field)
+                            for field in worker_fields
+                        }
+                    ),
+                    "detail": details.get((store_id, user_id)),
+                }
+                for store_id, user_id in keys
+            ]
+        }
+    )
@@ -0,0 +1,55 @@
+import asyncio
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+# Concurrent calls with the same key share the result, or the error, of the first
+# one instead of each running it. Nothing is kept once that call is over.
+# Keys are tuples whose first item names the call in the stats
+class SingleFlight:
+    retry = object()
+
+    def __init__(self) -> None:
+        self.flights: Dict[Hashable, asyncio.Future] = {}
+        self.calls = defaultdict(int)
+        self.coalesced = defaultdict(int)
+
+    async def do(self, key: tuple, call: Callable[[], Awaitable[Any]]) -> Any:
+        waiting = self.flights.get(key)
+        if waiting is not None:
+            self.coalesced[key[0]] += 1
+            # Shielded, a waiter that is cancelled must not cancel the others
+            value = await asyncio.shield(waiting)
+            return await self.do(key, call) if value is self.retry else value
+
+        self.calls[key[0]] += 1
+        future = self.flights[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await call()
+        except asyncio.CancelledError:
+            # The waiters don't share the cancellation, one of them calls again
+            future.set_result(self.retry)
+            raise
+        except Exception as error:
+            future.set_exception(error)
+            # Retrieved here too, so a future nobody waits for doesn't log it
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            if self.flights.get(key) is future:
+                del self.flights[key]
+
+    # Calls from now on don't join the ones in flight with keys starting with
+    # prefix, like reads that started before a write was committed
+    def forget(self, *prefix: Hashable) -> None:
+        for key in [key for key in self.flights if key[: len(prefix)] == prefix]:
+            del self.flights[key]
+
+    def stats(self) -> dict:
+        return {
+            name: {"calls": calls, "coalesced": self.coalesced[name]}
+            for name, calls in sorted(self.calls.items())
+        }
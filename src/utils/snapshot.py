@@ -0,0 +1,50 @@
+import hashlib
+import time
+from typing import Callable, Optional
+
+from fastapi import Response, status
+
+
+# Serialized response body kept in memory together with its strong ETag
+class Snapshot:
+    def __init__(
+        self, max_age: float, timer: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.max_age = max_age
+        self.timer = timer
+        self.body = None
+        self.etag = None
+        self.loaded_at = None
+
+    def is_stale(self) -> bool:
+        return self.body is None or self.timer() - self.loaded_at >= self.max_age
+
+    def update(self, body: bytes) -> None:
+        self.etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        self.body = body
+        self.loaded_at = self.timer()
+
+    def clear(self) -> None:
+        self.body = None
+        self.etag = None
+        self.loaded_at = None
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        if not if_none_match:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or self.etag in tags or f"W/{self.etag}" in tags
+
+
+def snapshot_response(
+    snapshot: Snapshot, if_none_match: Optional[str], max_age: int
+) -> Response:
+    headers = {
+        "ETag": snapshot.etag,
+        "Cache-Control": f"public, max-age={max_age}",
+    }
+    if snapshot.matches(if_none_match):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(
+        content=snapshot.body, media_type="application/json", headers=headers
+    )
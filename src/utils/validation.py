@@ -1,5 +1,9 @@
+from datetime import datetime, timezone
+from typing import List, Optional
+
 from fastapi import HTTPException, status
 
+from config import get_settings
 from src.handlers.workers import WorkersHandler
 
 
@@ -15,12 +19,88 @@ async def validate_rol(
             detail="The user is not valid",
         )
 
-    worker = await worker_handler.get_worker(store_id, user_id)
+    rol_id, active = await worker_handler.get_worker_rol(store_id, user_id)
 
-    if worker and worker.rol_id in accepted_roles_list and worker.active:
+    if rol_id in accepted_roles_list and active:
         return True
 
     raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="The user is not authorized",
     )
+
+
+# Same checks and errors, in the same order, as get_store + validate_rol followed
+# by the write, from a single query
+async def validate_worker_access(
+    worker_handler: WorkersHandler,
+    store_id: int,
+    current_user_id: int,
+    superuser: bool,
+    accepted_roles_list: list,
+    user_id: int = None,
+):
+    context = await worker_handler.get_access_context(
+        store_id, current_user_id, user_id
+    )
+
+    if not context.store_active:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="The store is not active",
+        )
+
+    if not superuser:
+        if not isinstance(current_user_id, int):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="The user is not valid",
+            )
+        if context.caller_rol_id is None:
+            raise worker_handler.not_found_exception
+        if not (context.caller_rol_id in accepted_roles_list and context.caller_active):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="The user is not authorized",
+            )
+
+    if user_id is not None and context.target_user_id is None:
+        raise worker_handler.not_found_exception
+
+    return True
+
+
+# Comma separated ids of the batch reads
+def parse_ids(ids: str) -> List[int]:
+    try:
+        parsed = [int(id) for id in ids.split(",")]
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="The ids are not valid",
+        )
+    if len(parsed) > get_settings().max_lookup_size:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Too many ids in one request",
+        )
+    return parsed
+
+
+# validate_rol for one of the stores of a batch read, with the detail of the
+# error it would raise or None when the caller can read the store
+def rol_error(rol: Optional[tuple], accepted_roles_list: list) -> Optional[str]:
+    if rol is None:
+        return WorkersHandler.not_found_exception.detail
+    rol_id, active = rol
+    if rol_id in accepted_roles_list and active:
+        return None
+    return "The user is not authorized"
+
+
+# The timestamp columns hold naive UTC times, and asyncpg rejects aware values for
+# them, so the ones with an offset are converted
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
@@ -1,7 +1,7 @@
 import os
 
 import pytest
-from config import get_settings, get_db_url
+from config import get_settings, get_async_db_url, get_db_url
 
 
 @pytest.mark.usefixtures("load_env_variables")
@@ -20,3 +20,9 @@ def test_config_values():
 def test_db_url():
     expected = f"{os.getenv('DB_DIALECT')}://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
     assert get_db_url() == expected
+
+
+@pytest.mark.usefixtures("load_env_variables")
+def test_async_db_url():
+    expected = f"{os.getenv('DB_DIALECT')}+asyncpg://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
+    assert get_async_db_url() == expected
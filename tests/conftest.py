@@ -1,29 +1,178 @@
+import os
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
 import pytest
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 from fastapi.testclient import TestClient
+from starlette.routing import Match
 
 from src.entrypoints.main import app
-from src.adapters.orm import Base, get_db
-
+from src.adapters.orm import Base, get_db, get_read_db, use_sqlite_transactions
+from src.domain.models import Country, Rol
+from src.handlers.countries import CountriesHandler
+from src.handlers.roles import RolesHandler
+from src.handlers.stores import StoresHandler
+from src.handlers.workers import WorkersHandler
 
 SQLALCHEMY_TEST_DATABASE_URL = "sqlite:///./test.db"
+SQLALCHEMY_ASYNC_TEST_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
 engine = create_engine(
     SQLALCHEMY_TEST_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# TestClient runs every request in a new event loop, so connections can't be pooled
+async_engine = create_async_engine(
+    SQLALCHEMY_ASYNC_TEST_DATABASE_URL, poolclass=NullPool
+)
+use_sqlite_transactions(async_engine)
+AsyncTestingSessionLocal = sessionmaker(
+    async_engine,
+    class_=AsyncSession,
+    autocommit=False,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
 
-def override_get_db():
-    try:
-        db = TestingSessionLocal()
+async def override_get_db():
+    async with AsyncTestingSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
+
+# Row locks and concurrent transactions are tested on PostgreSQL, SQLite runs one
+# write at a time. The tables at this URL are dropped
+POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+requires_postgres = pytest.mark.skipif(
+    not POSTGRES_URL, reason="TEST_POSTGRES_URL is not set"
+)
+
+
+async def create_postgres_schema(engine) -> None:
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.drop_all)
+        await connection.run_sync(Base.metadata.create_all)
+        await connection.execute(insert(Country), [{"name": "Chile"}])
+        await connection.execute(insert(Rol), [{"name": "Admin"}])
+
+
+class QueryCounter:
+    def __init__(self) -> None:
+        self.statements = []
+        self.parameters = []
+        self.enabled = False
+
+    def __enter__(self):
+        self.statements = []
+        self.parameters = []
+        self.enabled = True
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.enabled = False
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        if self.enabled:
+            self.statements.append(statement)
+            self.parameters.append(parameters)
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+
+# Most statements one request to each route may run, with cold caches. SQLite has
+# no RETURNING, so its writes take one statement more than on PostgreSQL.
+QUERY_BUDGETS = {
+    "POST /stores": 4,
+    "POST /stores/bulk": 7,
+    "GET /stores": 1,
+    "GET /stores/changes": 1,
+    "GET /stores/export": 1,
+    "GET /stores/search": 1,
+    "GET /stores/stats": 2,
+    "GET /stores/{store_id}": 2,
+    "PUT /stores/{store_id}": 3,
+    "DELETE /stores/{store_id}": 3,
+    "POST /stores/{store_id}/activate": 2,
+    "GET /stores/{store_id}/stats": 2,
+    "POST /workers": 3,
+    "POST /workers/bulk": 4,
+    "POST /workers/lookup": 2,
+    "GET /workers": 2,
+    "GET /workers/changes": 1,
+    "GET /workers/export": 1,
+    "GET /workers/{store_id}/{user_id}": 2,
+    "PUT /workers/{store_id}/{user_id}": 3,
+    "DELETE /workers/{store_id}/{user_id}": 3,
+    "POST /workers/{store_id}/{user_id}/activate": 3,
+    "DELETE /workers/{store_id}/{user_id}/delete": 2,
+}
+
+
+def route_name(method: str, url: str) -> str:
+    scope = {"type": "http", "method": method.upper(), "path": urlsplit(url).path}
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return f"{method.upper()} {route.path}"
+    return None
+
+
+# Fails the test when a request runs more statements than its route's budget
+class BudgetedClient(TestClient):
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.query_counter = QueryCounter()
+        self.budget = None
+        event.listen(
+            async_engine.sync_engine, "before_cursor_execute", self.query_counter
+        )
+
+    # For requests that do more work than the budgets assume, like bulk chunks
+    @contextmanager
+    def query_budget(self, budget: int):
+        self.budget = budget
+        try:
+            yield
+        finally:
+            self.budget = None
+
+    def request(self, method, url, *args, **kwargs):
+        with self.query_counter:
+            response = super().request(method, url, *args, **kwargs)
+
+        route = route_name(method, url)
+        budget = self.budget if self.budget is not None else QUERY_BUDGETS.get(route)
+        if budget is not None and self.query_counter.count > budget:
+            statements = "\n".join(self.query_counter.statements)
+            pytest.fail(
+                f"{route} ran {self.query_counter.count} queries, its budget is "
+                f"{budget}:\n{statements}"
+            )
+        return response
+
+
+# Clock for the caches that the tests move forward by hand
+class FakeTimer:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def timer():
+    return FakeTimer()
 
 
 @pytest.fixture(scope="session")
@@ -34,10 +183,36 @@ def load_env_variables():
 @pytest.fixture(scope="session")
 def create_db():
     Base.metadata.create_all(bind=engine)
+    # Same reference data the migrations insert
+    with TestingSessionLocal() as db:
+        db.add_all(
+            [Country(name=name) for name in ["Chile", "Mexico", "Colombia", "Peru"]]
+        )
+        db.add_all(
+            [Rol(name=name) for name in ["Admin", "Manager", "Accountant", "Seller"]]
+        )
+        db.commit()
     yield
     Base.metadata.drop_all(bind=engine)
 
 
 @pytest.fixture(scope="session")
 def client(create_db):
-    return TestClient(app)
+    return BudgetedClient(app)
+
+
+@pytest.fixture
+def query_counter():
+    counter = QueryCounter()
+    event.listen(async_engine.sync_engine, "before_cursor_execute", counter)
+    yield counter
+    event.remove(async_engine.sync_engine, "before_cursor_execute", counter)
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    WorkersHandler.rol_cache.clear()
+    StoresHandler.cache.clear()
+    WorkersHandler.cache.clear()
+    CountriesHandler.snapshot.clear()
+    RolesHandler.snapshot.clear()
@@ -0,0 +1,122 @@
+import time
+
+import pytest
+
+SUPERUSER = {"superuser": "true"}
+
+
+def crawl(client, path, key, since=None):
+    seen = []
+    params = {"limit": 2}
+    if since:
+        params["since"] = since
+    while True:
+        response = client.get(path, params=params, headers=SUPERUSER)
+        assert response.status_code == 200
+        data = response.json()
+        seen.extend(data[key])
+        params["since"] = data["next_token"]
+        if not data["has_more"]:
+            return seen, data["next_token"]
+
+
+def next_second():
+    # SQLite timestamps have second resolution, a later change needs a later second
+    time.sleep(1.05 - time.time() % 1)
+
+
+@pytest.fixture(scope="module")
+def store_ids(client):
+    ids = []
+    for number in range(5):
+        new_store = {
+            "country_id": 1,
+            "tax_id": f"76.400.00{number}-1",
+            "name": f"Changed store {number}",
+            "legal_name": f"Changed store {number} SpA",
+            "address": "Av. Siempre Viva 742",
+            "zip_code": "8320000",
+            "email": "changes@store.cl",
+        }
+        response = client.post(
+            "/stores", json=new_store, headers={"current-user-id": "600"}
+        )
+        ids.append(response.json()["id"])
+    return ids
+
+
+def test_store_changes_resume_from_the_token(client, store_ids):
+    stores, token = crawl(client, "/stores/changes", "stores")
+
+    positions = [(store["updated_at"], store["id"]) for store in stores]
+    assert positions == sorted(positions)
+    assert set(store_ids) <= {store["id"] for store in stores}
+
+    stores, same_token = crawl(client, "/stores/changes", "stores", token)
+    assert stores == []
+    assert same_token == token
+
+    next_second()
+    client.delete(f"/stores/{store_ids[2]}", headers=SUPERUSER)
+    stores, _ = crawl(client, "/stores/changes", "stores", token)
+    assert [(store["id"], store["active"]) for store in stores] == [
+        (store_ids[2], False)
+    ]
+
+
+def test_worker_changes_resume_from_the_token(client, store_ids):
+    _, token = crawl(client, "/workers/changes", "workers")
+
+    client.post(f"/stores/{store_ids[0]}/activate", headers=SUPERUSER)
+    next_second()
+    client.put(f"/workers/{store_ids[0]}/600", json={"rol_id": 2}, headers=SUPERUSER)
+    workers, _ = crawl(client, "/workers/changes", "workers", token)
+
+    assert [(worker["user_id"], worker["rol_id"]) for worker in workers] == [(600, 2)]
+    assert workers[0]["store_id"] == store_ids[0]
+
+
+def test_changes_reject_invalid_tokens(client):
+    for path in ("/stores/changes", "/workers/changes"):
+        response = client.get(path, params={"since": "nope"}, headers=SUPERUSER)
+        assert response.status_code == 400
+        assert response.json()["detail"] == "The cursor is not valid"
+
+
+def test_changes_require_superuser(client):
+    for path in ("/stores/changes", "/workers/changes"):
+        assert client.get(path).status_code == 401
+
+
+def test_worker_changes_report_deleted_workers(client, store_ids):
+    worker = f"/workers/{store_ids[1]}/601"
+    new_worker = {"user_id": 601, "store_id": store_ids[1], "rol_id": 4}
+    client.post(f"/stores/{store_ids[1]}/activate", headers=SUPERUSER)
+    client.post("/workers", json=new_worker, headers=SUPERUSER)
+    _, token = crawl(client, "/workers/changes", "workers")
+
+    next_second()
+    assert client.delete(f"{worker}/delete", headers=SUPERUSER).status_code == 200
+    workers, deleted_token = crawl(client, "/workers/changes", "workers", token)
+
+    assert len(workers) == 1
+    assert workers[0].pop("updated_at")
+    assert workers[0] == {
+        "user_id": 601,
+        "store_id": store_ids[1],
+        "rol_id": None,
+        "active": None,
+        "deleted": True,
+    }
+
+    # Created again, the worker replaces its deletion
+    next_second()
+    client.post("/workers", json=new_worker, headers=SUPERUSER)
+    workers, _ = crawl(client, "/workers/changes", "workers", deleted_token)
+    assert [(worker["user_id"], worker["deleted"]) for worker in workers] == [
+        (601, False)
+    ]
+    workers, _ = crawl(client, "/workers/changes", "workers")
+    assert [worker["deleted"] for worker in workers if worker["user_id"] == 601] == [
+        False
+    ]
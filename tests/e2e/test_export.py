@@ -0,0 +1,73 @@
+import csv
+import io
+import json
+
+import pytest
+
+SUPERUSER = {"superuser": "true"}
+
+
+@pytest.fixture(scope="module")
+def store_id(client):
+    new_store = {
+        "country_id": 3,
+        "tax_id": "76.300.000-1",
+        "name": "Exported store",
+        "legal_name": "Exported store SpA",
+        "address": "Av. Siempre Viva 742",
+        "zip_code": "8320000",
+        "email": "export@store.cl",
+    }
+    store = client.post(
+        "/stores", json=new_store, headers={"current-user-id": "500"}
+    ).json()
+    client.post(f"/stores/{store['id']}/activate", headers=SUPERUSER)
+    bulk = {
+        "store_id": store["id"],
+        "workers": [{"user_id": user_id, "rol_id": 4} for user_id in range(501, 511)],
+    }
+    client.post("/workers/bulk", json=bulk, headers=SUPERUSER)
+    return store["id"]
+
+
+def test_export_stores_as_ndjson(client, store_id):
+    response = client.get("/stores/export", params={"country_id": 3}, headers=SUPERUSER)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    stores = [json.loads(line) for line in response.text.splitlines()]
+    assert store_id in [store["id"] for store in stores]
+    assert {store["country_id"] for store in stores} == {3}
+    assert "updated_at" in stores[0]
+
+
+def test_export_stores_filters_active_and_since(client, store_id):
+    response = client.get(
+        "/stores/export",
+        params={"active": False, "since": "2000-01-01T00:00:00"},
+        headers=SUPERUSER,
+    )
+
+    stores = [json.loads(line) for line in response.text.splitlines()]
+    assert store_id not in [store["id"] for store in stores]
+    assert all(store["active"] is False for store in stores)
+
+
+def test_export_workers_as_gzipped_csv(client, store_id):
+    response = client.get(
+        "/workers/export",
+        params={"format": "csv", "gzip": True, "store_id": store_id},
+        headers=SUPERUSER,
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    # requests already decompressed the body
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [int(row["user_id"]) for row in rows] == [500, *range(501, 511)]
+    assert rows[0]["rol_id"] == "1"
+
+
+def test_export_requires_superuser(client):
+    assert client.get("/stores/export").status_code == 401
+    assert client.get("/workers/export").status_code == 401
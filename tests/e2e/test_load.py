@@ -0,0 +1,39 @@
+import asyncio
+
+from benchmarks.load import Seed, compare, routes, run, scenarios
+from src.adapters.orm import get_db
+from src.entrypoints.main import app
+
+
+def test_every_route_has_a_load_scenario():
+    assert set(routes()) <= set(scenarios(Seed(2, 2, 4)))
+
+
+def test_load_suite_runs_every_route_without_errors(tmp_path):
+    override = app.dependency_overrides[get_db]
+    url = f"sqlite+aiosqlite:///{tmp_path / 'load.db'}"
+
+    results = asyncio.run(run(url, Seed(4, 3, 4), requests=4, concurrency=2))
+
+    assert app.dependency_overrides[get_db] is override
+    assert set(results["routes"]) == set(routes())
+    for name, result in results["routes"].items():
+        assert result["errors"] == 0, name
+        assert result["p50_ms"] <= result["p95_ms"] <= result["p99_ms"]
+    assert results["routes"]["GET /stores/{store_id}"]["queries_per_request"] == 2
+    assert compare(results, results, tolerance=0) == []
+
+
+def test_compare_flags_more_queries_and_slower_routes():
+    route = {"queries_per_request": 1.0, "p95_ms": 10.0, "errors": 0}
+    baseline = {"routes": {"GET /stores": route}}
+    results = {
+        "routes": {"GET /stores": {**route, "queries_per_request": 2.0, "p95_ms": 20.0}}
+    }
+
+    regressions = compare(results, baseline, tolerance=0.5)
+
+    assert regressions == [
+        "GET /stores: 1.00 -> 2.00 queries per request",
+        "GET /stores: p95 10.00 -> 20.00 ms",
+    ]
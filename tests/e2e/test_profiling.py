@@ -0,0 +1,112 @@
+import logging
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.adapters.orm import QueryProfiler, get_db, get_read_db
+from src.entrypoints.profiling import install_metrics, install_profiling
+from src.entrypoints.routes import stores
+from tests.conftest import async_engine, override_get_db
+
+SUPERUSER = {"superuser": "true"}
+
+
+@pytest.fixture
+def profiler():
+    profiler = QueryProfiler()
+    profiler.listen(async_engine.sync_engine)
+    yield profiler
+    profiler.remove(async_engine.sync_engine)
+
+
+@pytest.fixture
+def profiled_client(create_db, profiler):
+    profiled_app = FastAPI()
+    profiled_app.include_router(stores.router)
+    profiled_app.dependency_overrides[get_db] = override_get_db
+    profiled_app.dependency_overrides[get_read_db] = override_get_db
+    install_profiling(profiled_app, install_metrics(profiled_app, profiler))
+    return TestClient(profiled_app)
+
+
+@pytest.fixture(scope="module")
+def store_id(client):
+    new_store = {
+        "country_id": 4,
+        "tax_id": "76.700.000-1",
+        "name": "Profiled store",
+        "legal_name": "Profiled store SpA",
+        "address": "Av. Siempre Viva 742",
+        "zip_code": "8320000",
+        "email": "profiled@store.cl",
+    }
+    store = client.post(
+        "/stores", json=new_store, headers={"current-user-id": "700"}
+    ).json()
+    return store["id"]
+
+
+def test_server_timing_reports_the_request_queries(
+    profiled_client, store_id, query_counter
+):
+    with query_counter:
+        response = profiled_client.get(f"/stores/{store_id}", headers=SUPERUSER)
+
+    assert response.status_code == 200
+    db, pool, app = response.headers["server-timing"].split(", ")
+    assert db.startswith("db;dur=")
+    assert db.endswith(f'desc="{query_counter.count} queries"')
+    assert pool.startswith("pool;dur=")
+    assert app.startswith("app;dur=")
+
+
+def test_metrics_aggregate_by_route_template(profiled_client, store_id):
+    for _ in range(2):
+        profiled_client.get(f"/stores/{store_id}", headers=SUPERUSER)
+    profiled_client.get("/stores/0", headers=SUPERUSER)
+
+    response = profiled_client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    lines = response.text.splitlines()
+    labels = 'method="GET",route="/stores/{store_id}"'
+    assert f'http_requests_total{{{labels},status="200"}} 2' in lines
+    assert f'http_requests_total{{{labels},status="404"}} 1' in lines
+    # The second read of the store is served by the store cache
+    assert f"db_queries_total{{{labels}}} 2" in lines
+    assert "# TYPE db_pool_checked_out gauge" in lines
+    counters = dict(line.rsplit(" ", 1) for line in lines if line[0] != "#")
+    assert int(counters['cache_hits_total{cache="store"}']) >= 1
+    assert int(counters['cache_misses_total{cache="store"}']) >= 1
+    assert 'cache_shared_errors_total{cache="worker"}' in counters
+    assert 'cache_evictions_total{cache="rol"}' in counters
+    assert 'cache_shared_hits_total{cache="rol"}' not in counters
+
+
+def test_metrics_are_served_without_profiling(client, store_id):
+    client.get(f"/stores/{store_id}", headers=SUPERUSER)
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert "server-timing" not in response.headers
+    lines = response.text.splitlines()
+    assert not any(line.startswith("http_requests_total{") for line in lines)
+    counters = dict(line.rsplit(" ", 1) for line in lines if line[0] != "#")
+    assert int(counters['cache_misses_total{cache="store"}']) >= 1
+    assert "db_pool_checkouts_total" in counters
+
+
+def test_slow_queries_are_logged_with_a_fingerprint(
+    profiled_client, profiler, store_id, caplog
+):
+    profiler.slow_query_ms = 1e-6
+
+    with caplog.at_level(logging.WARNING, logger="src.adapters.orm"):
+        profiled_client.get(f"/stores/{store_id}", headers=SUPERUSER)
+
+    assert profiler.slow_queries == 1
+    assert caplog.records[0].getMessage().startswith("Slow query ")
+    assert "FROM stores" in caplog.records[0].getMessage()
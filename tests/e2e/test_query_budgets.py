@@ -0,0 +1,146 @@
+import json
+
+import pytest
+
+from src.entrypoints.routes import stores, workers
+from src.handlers.workers import WorkersHandler
+from tests.conftest import QUERY_BUDGETS
+
+ADMIN_ID = 800
+SUPERUSER = {"superuser": "true"}
+ADMIN = {"current-user-id": str(ADMIN_ID)}
+
+
+def new_store(tax_id: str) -> dict:
+    return {
+        "country_id": 2,
+        "tax_id": tax_id,
+        "name": "Budget store",
+        "legal_name": "Budget store SpA",
+        "address": "Av. Siempre Viva 742",
+        "zip_code": "8320000",
+        "email": "budget@store.cl",
+    }
+
+
+@pytest.fixture(scope="module")
+def store_id(client):
+    store = client.post("/stores", json=new_store("76.800.000-1"), headers=ADMIN)
+    store_id = store.json()["id"]
+    client.post(f"/stores/{store_id}/activate", headers=SUPERUSER)
+    for user_id in range(ADMIN_ID + 1, ADMIN_ID + 6):
+        new_worker = {"user_id": user_id, "store_id": store_id, "rol_id": 4}
+        client.post("/workers", json=new_worker, headers=ADMIN)
+    return store_id
+
+
+def route_calls(store_id: int) -> dict:
+    worker = f"/workers/{store_id}/{ADMIN_ID + 1}"
+    bulk_stores = "\n".join(
+        json.dumps(new_store(f"76.800.10{number}-1")) for number in range(3)
+    )
+    bulk_workers = {
+        "store_id": store_id,
+        "workers": [{"user_id": ADMIN_ID + 10 + n, "rol_id": 4} for n in range(3)],
+    }
+    return {
+        "POST /stores": ("POST", "/stores", {"json": new_store("76.800.001-1")}, ADMIN),
+        "POST /stores/bulk": (
+            "POST",
+            "/stores/bulk",
+            {"data": bulk_stores},
+            {**SUPERUSER, **ADMIN},
+        ),
+        "GET /stores": ("GET", "/stores", {}, SUPERUSER),
+        "GET /stores/changes": ("GET", "/stores/changes", {}, SUPERUSER),
+        "GET /stores/export": ("GET", "/stores/export", {}, SUPERUSER),
+        "GET /stores/search": (
+            "GET",
+            "/stores/search",
+            {"params": {"q": "budget"}},
+            SUPERUSER,
+        ),
+        "GET /stores/stats": ("GET", "/stores/stats", {}, SUPERUSER),
+        "GET /stores/{store_id}": ("GET", f"/stores/{store_id}", {}, ADMIN),
+        "GET /stores/{store_id}/stats": ("GET", f"/stores/{store_id}/stats", {}, ADMIN),
+        "PUT /stores/{store_id}": (
+            "PUT",
+            f"/stores/{store_id}",
+            {"json": new_store("76.800.000-1")},
+            ADMIN,
+        ),
+        "DELETE /stores/{store_id}": ("DELETE", f"/stores/{store_id}", {}, ADMIN),
+        "POST /stores/{store_id}/activate": (
+            "POST",
+            f"/stores/{store_id}/activate",
+            {},
+            SUPERUSER,
+        ),
+        "POST /workers": (
+            "POST",
+            "/workers",
+            {"json": {"user_id": ADMIN_ID + 9, "store_id": store_id, "rol_id": 4}},
+            ADMIN,
+        ),
+        "POST /workers/bulk": ("POST", "/workers/bulk", {"json": bulk_workers}, ADMIN),
+        "POST /workers/lookup": (
+            "POST",
+            "/workers/lookup",
+            {"json": {"workers": [{"store_id": store_id, "user_id": ADMIN_ID + 1}]}},
+            ADMIN,
+        ),
+        "GET /workers": ("GET", "/workers", {"params": {"store_id": store_id}}, ADMIN),
+        "GET /workers/changes": ("GET", "/workers/changes", {}, SUPERUSER),
+        "GET /workers/export": ("GET", "/workers/export", {}, SUPERUSER),
+        "GET /workers/{store_id}/{user_id}": ("GET", worker, {}, ADMIN),
+        "PUT /workers/{store_id}/{user_id}": (
+            "PUT",
+            worker,
+            {"json": {"rol_id": 3}},
+            ADMIN,
+        ),
+        "DELETE /workers/{store_id}/{user_id}": ("DELETE", worker, {}, ADMIN),
+        "POST /workers/{store_id}/{user_id}/activate": (
+            "POST",
+            f"{worker}/activate",
+            {},
+            ADMIN,
+        ),
+        "DELETE /workers/{store_id}/{user_id}/delete": (
+            "DELETE",
+            f"/workers/{store_id}/{ADMIN_ID + 9}/delete",
+            {},
+            ADMIN,
+        ),
+    }
+
+
+def test_every_route_has_a_query_budget():
+    names = {
+        f"{method} {route.path}"
+        for router in (stores.router, workers.router)
+        for route in router.routes
+        for method in route.methods
+    }
+    assert names == set(QUERY_BUDGETS)
+
+
+def test_routes_stay_within_their_query_budgets(client, store_id):
+    # The client fails the test when a request runs over its route's budget
+    for name, (method, url, kwargs, headers) in route_calls(store_id).items():
+        WorkersHandler.rol_cache.clear()
+        response = client.request(method, url, headers=headers, **kwargs)
+        assert response.status_code == 200, name
+
+
+def test_client_fails_requests_over_budget(client, store_id, monkeypatch):
+    monkeypatch.setitem(QUERY_BUDGETS, "GET /stores/{store_id}", 1)
+
+    with pytest.raises(pytest.fail.Exception, match="ran 2 queries, its budget is 1"):
+        client.get(f"/stores/{store_id}", headers=ADMIN)
+
+
+def test_client_enforces_an_overridden_budget_of_zero(client, store_id):
+    with pytest.raises(pytest.fail.Exception, match="its budget is 0"):
+        with client.query_budget(0):
+            client.get(f"/stores/{store_id}", headers=ADMIN)
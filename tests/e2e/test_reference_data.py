@@ -0,0 +1,45 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from src.entrypoints.main import app
+
+
+@pytest.mark.parametrize("path", ["/countries", "/roles"])
+def test_reference_data_is_served_from_snapshot(client, query_counter, path):
+    first = client.get(path)
+
+    with query_counter:
+        second = client.get(path)
+
+    assert second.status_code == 200
+    assert second.content == first.content
+    assert second.headers["etag"] == first.headers["etag"]
+    assert second.headers["cache-control"].startswith("public, max-age=")
+    assert query_counter.count == 0
+
+
+@pytest.mark.parametrize("path", ["/countries", "/roles"])
+def test_reference_data_not_modified(client, path):
+    etag = client.get(path).headers["etag"]
+
+    response = client.get(path, headers={"if-none-match": etag})
+
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+
+
+def test_countries_body_is_unchanged(client):
+    response = client.get("/countries")
+
+    assert response.json()["countries"][0] == {"id": 1, "name": "Chile"}
+    assert len(response.json()["countries"]) == 4
+
+
+def test_snapshots_are_loaded_at_startup(create_db, query_counter):
+    with TestClient(app) as client:
+        with query_counter:
+            assert client.get("/roles").status_code == 200
+            assert client.get("/countries").status_code == 200
+
+    assert query_counter.count == 0
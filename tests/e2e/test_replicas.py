@@ -0,0 +1,122 @@
+import shutil
+
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from src.adapters import orm
+from src.adapters.orm import (
+    READ_PRIMARY_COOKIE,
+    Replica,
+    ReplicaSet,
+    get_db,
+    get_read_db,
+)
+from src.entrypoints.replicas import install_read_your_writes
+from src.entrypoints.routes import stores
+from tests.conftest import AsyncTestingSessionLocal, override_get_db
+
+SUPERUSER = {"superuser": "true"}
+
+
+@pytest.fixture
+def replica(tmp_path, monkeypatch):
+    replica = Replica(
+        create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'replica.db'}")
+    )
+    replica.healthy = True
+    monkeypatch.setattr(orm, "replica_set", ReplicaSet([replica], 5))
+    return replica
+
+
+@pytest.fixture
+def replicated_client():
+    replicated_app = FastAPI()
+
+    @replicated_app.get("/database")
+    async def get_database(db: AsyncSession = Depends(get_read_db)):
+        return {"replica": db.bind is not orm.async_engine}
+
+    @replicated_app.post("/writes", status_code=201)
+    async def write():
+        return None
+
+    @replicated_app.post("/failed-writes", status_code=400)
+    async def fail_write():
+        return None
+
+    install_read_your_writes(replicated_app, 5)
+    return TestClient(replicated_app)
+
+
+def test_reads_go_to_replicas_in_sync(replica, replicated_client):
+    assert replicated_client.get("/database").json() == {"replica": True}
+
+    replica.lag = 6
+    assert replicated_client.get("/database").json() == {"replica": False}
+
+
+def test_clients_read_their_writes_from_the_primary(replica, replicated_client):
+    failed = replicated_client.post("/failed-writes")
+    assert READ_PRIMARY_COOKIE not in failed.cookies
+    assert replicated_client.get("/database").json() == {"replica": True}
+
+    written = replicated_client.post("/writes")
+
+    assert READ_PRIMARY_COOKIE in written.cookies
+    assert replicated_client.get("/database").json() == {"replica": False}
+    # Once the window is over the cookie no longer holds the reads
+    replicated_client.cookies.clear()
+    expired = replicated_client.get("/database", cookies={READ_PRIMARY_COOKIE: "0"})
+    assert expired.json() == {"replica": True}
+
+
+@pytest.fixture
+def lagging_client(client, tmp_path, monkeypatch):
+    new_store = {
+        "country_id": 1,
+        "tax_id": "76.950.000-1",
+        "name": "Replicated store",
+        "legal_name": "Replicated store SpA",
+        "address": "Av. Siempre Viva 742",
+        "zip_code": "8320000",
+        "email": "replicated@store.cl",
+    }
+    store = client.post("/stores", json=new_store, headers={"current-user-id": "950"})
+    # A copy of the database as it is now stands for a replica that falls behind
+    shutil.copy("test.db", tmp_path / "replica.db")
+    replica = Replica(
+        create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'replica.db'}")
+    )
+    replica.healthy = True
+    monkeypatch.setattr(orm, "replica_set", ReplicaSet([replica], 5))
+    monkeypatch.setattr(orm, "AsyncSessionLocal", AsyncTestingSessionLocal)
+
+    replicated_app = FastAPI()
+    replicated_app.include_router(stores.router)
+    replicated_app.dependency_overrides[get_db] = override_get_db
+    install_read_your_writes(replicated_app, 5)
+    return TestClient(replicated_app), store.json()["id"]
+
+
+def test_replica_reads_dont_cache_rows_older_than_a_write(lagging_client):
+    client, store_id = lagging_client
+    writer = TestClient(client.app)
+    renamed = {
+        "name": "Renamed store",
+        "legal_name": "Replicated store SpA",
+        "address": "Av. Siempre Viva 742",
+        "zip_code": "8320000",
+        "email": "replicated@store.cl",
+    }
+    writer.put(f"/stores/{store_id}", json=renamed, headers=SUPERUSER)
+
+    # Another client reads the old row from the replica, right after the write
+    other = client.get(f"/stores/{store_id}", headers=SUPERUSER)
+    # The writer reads from the primary and must not get that row from the cache
+    own = writer.get(f"/stores/{store_id}", headers=SUPERUSER)
+
+    assert other.json()["name"] == "Replicated store"
+    assert READ_PRIMARY_COOKIE in writer.cookies
+    assert own.json()["name"] == "Renamed store"
@@ -0,0 +1,591 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.exc import DBAPIError, IntegrityError
+
+from src.domain.models import CountryStoreCount, RolWorkerCount
+from src.entrypoints.main import fold_counters
+from src.handlers.stores import StoresHandler
+from src.handlers.workers import WorkersHandler
+from src.utils.pagination import encode_cursor
+from tests.conftest import TestingSessionLocal
+
+SUPERUSER = {"superuser": "true"}
+
+
+@pytest.fixture(scope="module")
+def store_ids(client):
+    ids = []
+    for number in range(7):
+        new_store = {
+            "country_id": 2,
+            "tax_id": f"76.100.00{number}-1",
+            "name": f"Store {number}",
+            "legal_name": f"Store {number} SpA",
+            "address": "Av. Siempre Viva 742",
+            "zip_code": "8320000",
+            "email": "stores@store.cl",
+        }
+        response = client.post(
+            "/stores", json=new_store, headers={"current-user-id": "200"}
+        )
+        ids.append(response.json()["id"])
+    return ids
+
+
+def test_get_stores_cursor_crawls_every_store(client, store_ids):
+    seen = []
+    params = {"per_page": 3}
+    while True:
+        response = client.get("/stores", params=params, headers=SUPERUSER)
+        assert response.status_code == 200
+        data = response.json()
+        seen.extend(store["id"] for store in data["stores"])
+        if data["next_cursor"] is None:
+            break
+        params["cursor"] = data["next_cursor"]
+
+    assert seen == sorted(seen)
+    assert set(store_ids) <= set(seen)
+
+
+def test_get_stores_page_still_works(client, store_ids):
+    first = client.get("/stores", params={"per_page": 2}, headers=SUPERUSER).json()
+    second = client.get(
+        "/stores", params={"per_page": 2, "page": 2}, headers=SUPERUSER
+    ).json()
+    by_cursor = client.get(
+        "/stores",
+        params={"per_page": 2, "cursor": first["next_cursor"]},
+        headers=SUPERUSER,
+    ).json()
+
+    assert second["stores"] == by_cursor["stores"]
+
+
+def test_get_stores_caps_per_page(client, store_ids):
+    response = client.get("/stores", params={"per_page": 100000}, headers=SUPERUSER)
+
+    assert response.status_code == 200
+    assert len(response.json()["stores"]) <= 100
+
+
+def crawl_stores(client, params):
+    seen = []
+    params = {"per_page": 3, **params}
+    while True:
+        response = client.get("/stores", params=params, headers=SUPERUSER)
+        assert response.status_code == 200
+        data = response.json()
+        seen.extend(data["stores"])
+        if data["next_cursor"] is None:
+            return seen
+        params["cursor"] = data["next_cursor"]
+
+
+def test_get_stores_sorted_by_a_date_descending(client, store_ids):
+    stores = crawl_stores(client, {"sort": "-created_at", "country_id": 2})
+    seen = [store["id"] for store in stores]
+
+    # Created one after the other, so newest first is the highest id first
+    assert [store_id for store_id in seen if store_id in store_ids] == store_ids[::-1]
+    assert len(seen) == len(set(seen))
+    assert all(store["country_id"] == 2 for store in stores)
+
+
+def test_get_stores_filters(client, store_ids):
+    client.post(f"/stores/{store_ids[2]}/activate", headers=SUPERUSER)
+
+    active = crawl_stores(client, {"country_id": 2, "active": "true"})
+    created = crawl_stores(
+        client,
+        {"sort": "created_at", "created_from": "2000-01-01T00:00:00", "country_id": 2},
+    )
+    updated = crawl_stores(client, {"updated_to": "2000-01-01T00:00:00"})
+
+    assert store_ids[2] in [store["id"] for store in active]
+    assert all(store["active"] and store["country_id"] == 2 for store in active)
+    assert set(store_ids) <= {store["id"] for store in created}
+    assert updated == []
+
+
+def test_get_stores_date_filters_take_utc_offsets(client, store_ids):
+    # Midnight UTC, written with an offset
+    cutoff = "2000-01-01T03:00:00+03:00"
+
+    after = crawl_stores(client, {"country_id": 2, "created_from": cutoff})
+    before = crawl_stores(client, {"updated_to": cutoff})
+    exports = [
+        client.get(path, params={"since": "2000-01-01T00:00:00Z"}, headers=SUPERUSER)
+        for path in ("/stores/export", "/workers/export")
+    ]
+
+    assert set(store_ids) <= {store["id"] for store in after}
+    assert before == []
+    assert [export.status_code for export in exports] == [200, 200]
+
+
+def test_get_stores_rejects_unknown_sort(client):
+    response = client.get("/stores", params={"sort": "name"}, headers=SUPERUSER)
+
+    assert response.status_code == 422
+
+
+def test_get_stores_rejects_invalid_cursor(client):
+    response = client.get(
+        "/stores", params={"cursor": "not-a-cursor"}, headers=SUPERUSER
+    )
+
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize(
+    "path, params",
+    [
+        ("/stores", {"cursor": encode_cursor("x")}),
+        ("/stores", {"cursor": encode_cursor(True)}),
+        ("/stores", {"sort": "created_at", "cursor": encode_cursor("nope", 1)}),
+        ("/stores", {"sort": "created_at", "cursor": encode_cursor(1, 1)}),
+        ("/stores/search", {"q": "store", "cursor": encode_cursor("x", 1)}),
+        ("/stores/search", {"q": "store", "cursor": encode_cursor(1.5, 1.5)}),
+        ("/stores/changes", {"since": encode_cursor("2026-01-01", "1")}),
+    ],
+)
+def test_cursors_with_values_of_the_wrong_type_are_rejected(client, path, params):
+    response = client.get(path, params=params, headers=SUPERUSER)
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "The cursor is not valid"
+
+
+def test_upsert_stores_from_ndjson(client, query_counter):
+    def store_line(number, name):
+        return (
+            '{"country_id": 4, "tax_id": "77.%03d.000-1", "name": "%s", '
+            '"legal_name": "Franchise SpA", "address": "Av. Siempre Viva 742", '
+            '"zip_code": "8320000", "email": "franchise@store.cl"}' % (number, name)
+        )
+
+    lines = [store_line(number, "Franchise") for number in range(300)]
+    lines.append(store_line(0, "Renamed franchise"))
+    lines.append('{"country_id": 99, "tax_id": "77.999.000-1"}')
+    lines.append("not json")
+    body = "\n".join(lines).encode()
+    headers = {**SUPERUSER, "current-user-id": "400"}
+
+    # The repeated tax_id splits the upload in two chunks
+    with query_counter, client.query_budget(13):
+        response = client.post(
+            "/stores/bulk",
+            data=(body[start : start + 1000] for start in range(0, len(body), 1000)),
+            headers={**headers, "content-type": "application/x-ndjson"},
+        )
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["created"] == 300
+    assert data["updated"] == 1
+    assert [error["line"] for error in data["errors"]] == [302, 303]
+    # countries, then a savepoint around existing tax_ids, upsert, ids and admin
+    # workers per chunk. The second chunk only updates, so it adds no admins
+    assert query_counter.count == 12
+
+    stores = client.get("/stores", params={"per_page": 100}, headers=SUPERUSER).json()[
+        "stores"
+    ]
+    store = next(store for store in stores if store["tax_id"] == "77.000.000-1")
+    assert store["name"] == "Renamed franchise"
+    admin = client.get(
+        f"/workers/{store['id']}/400", headers={"current-user-id": "400"}
+    )
+    assert admin.json()["rol_name"] == "Admin"
+
+
+def test_upsert_stores_reimport_only_updates(client):
+    line = (
+        '{"country_id": 4, "tax_id": "77.600.000-1", "name": "%s", '
+        '"legal_name": "Reimported SpA", "address": "Av. Siempre Viva 742", '
+        '"zip_code": "8320000", "email": "reimported@store.cl"}'
+    )
+    client.post(
+        "/stores/bulk",
+        data=line % "Reimported",
+        headers={**SUPERUSER, "current-user-id": "410"},
+    )
+    response = client.post(
+        "/stores/bulk",
+        data=line % "Reimported again",
+        headers={**SUPERUSER, "current-user-id": "411"},
+    )
+
+    assert response.json()["updated"] == 1
+    # The newest store, created by the first upload
+    store = client.get(
+        "/stores", params={"sort": "-id", "per_page": 1}, headers=SUPERUSER
+    ).json()["stores"][0]
+    assert store["tax_id"] == "77.600.000-1"
+    assert store["name"] == "Reimported again"
+    stats = client.get(f"/stores/{store['id']}/stats", headers=SUPERUSER).json()
+    assert stats["roles"] == [{"rol_id": 1, "workers": 1, "active_workers": 1}]
+    reimporter = client.get(f"/workers/{store['id']}/411", headers=SUPERUSER)
+    assert reimporter.status_code == 404
+
+
+def test_upsert_stores_requires_superuser(client):
+    response = client.post("/stores/bulk", data=b"", headers={"current-user-id": "400"})
+
+    assert response.status_code == 401
+
+
+def test_store_writes_return_the_written_row(client, store_ids, query_counter):
+    store_id = store_ids[0]
+    update = {
+        "name": "Updated store",
+        "legal_name": "Updated store SpA",
+        "address": "Av. Siempre Viva 742",
+        "zip_code": "8320000",
+        "email": "updated@store.cl",
+    }
+
+    activated = client.post(f"/stores/{store_id}/activate", headers=SUPERUSER)
+    with query_counter:
+        updated = client.put(f"/stores/{store_id}", json=update, headers=SUPERUSER)
+    deactivated = client.delete(f"/stores/{store_id}", headers=SUPERUSER)
+
+    assert activated.json()["active"] is True
+    assert updated.json()["name"] == "Updated store"
+    assert updated.json()["active"] is True
+    assert deactivated.json()["active"] is False
+    # UPDATE, plus the SELECT SQLite needs for the lack of RETURNING
+    assert query_counter.count == 2
+
+
+def test_store_writes_on_missing_store(client):
+    response = client.post("/stores/999999/activate", headers=SUPERUSER)
+
+    assert response.status_code == 404
+
+
+def test_create_store_is_rolled_back_when_its_admin_fails(client, monkeypatch):
+    async def failing_create_worker(self, worker):
+        raise HTTPException(status_code=400, detail="The worker could not be saved")
+
+    monkeypatch.setattr(WorkersHandler, "create_worker", failing_create_worker)
+    new_store = {
+        "country_id": 2,
+        "tax_id": "76.900.000-1",
+        "name": "Orphan store",
+        "legal_name": "Orphan store SpA",
+        "address": "Av. Siempre Viva 742",
+        "zip_code": "8320000",
+        "email": "orphan@store.cl",
+    }
+
+    response = client.post(
+        "/stores", json=new_store, headers={"current-user-id": "200"}
+    )
+
+    assert response.status_code == 400
+    monkeypatch.undo()
+    retried = client.post("/stores", json=new_store, headers={"current-user-id": "200"})
+    assert retried.status_code == 200
+
+
+# asyncpg raises most errors of the data, like a NUL byte in a text, as a bare
+# DBAPIError
+@pytest.mark.parametrize(
+    "prefix, error",
+    [
+        ("78", IntegrityError("INSERT INTO stores", {}, Exception("constraint"))),
+        ("79", DBAPIError("INSERT INTO stores", {}, Exception("invalid byte"))),
+    ],
+)
+def test_upsert_stores_leaves_out_only_the_failing_stores(
+    client, monkeypatch, prefix, error
+):
+    upsert_chunk = StoresHandler._upsert_chunk
+
+    async def failing_upsert_chunk(self, rows, owner_id):
+        written = await upsert_chunk(self, rows, owner_id)
+        if any(row["tax_id"] == f"{prefix}.001.000-1" for row in rows):
+            raise error
+        return written
+
+    monkeypatch.setattr(StoresHandler, "_upsert_chunk", failing_upsert_chunk)
+    lines = [
+        '{"country_id": 4, "tax_id": "%s.%03d.000-1", "name": "Partial", '
+        '"legal_name": "Partial SpA", "address": "Av. Siempre Viva 742", '
+        '"zip_code": "8320000", "email": "partial@store.cl"}' % (prefix, number)
+        for number in range(3)
+    ]
+    headers = {**SUPERUSER, "current-user-id": "401"}
+
+    # The failing chunk is retried store by store
+    with client.query_budget(25):
+        response = client.post("/stores/bulk", data="\n".join(lines), headers=headers)
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["created"] == 2
+    assert data["errors"] == [
+        {
+            "line": 2,
+            "tax_id": f"{prefix}.001.000-1",
+            "detail": "The store could not be saved",
+        }
+    ]
+    exported = client.get("/stores/export", headers=SUPERUSER).text.splitlines()
+    tax_ids = {json.loads(line)["tax_id"] for line in exported}
+    assert {f"{prefix}.000.000-1", f"{prefix}.002.000-1"} <= tax_ids
+    assert f"{prefix}.001.000-1" not in tax_ids
+
+
+def test_upsert_stores_fails_when_the_connection_is_lost(client, monkeypatch):
+    async def disconnected_upsert_chunk(self, rows, owner_id):
+        raise DBAPIError(
+            "INSERT INTO stores", {}, Exception("closed"), connection_invalidated=True
+        )
+
+    monkeypatch.setattr(StoresHandler, "_upsert_chunk", disconnected_upsert_chunk)
+    line = (
+        '{"country_id": 4, "tax_id": "78.900.000-1", "name": "Lost", '
+        '"legal_name": "Lost SpA", "address": "Av. Siempre Viva 742", '
+        '"zip_code": "8320000", "email": "lost@store.cl"}'
+    )
+
+    with pytest.raises(DBAPIError):
+        client.post(
+            "/stores/bulk", data=line, headers={**SUPERUSER, "current-user-id": "401"}
+        )
+
+
+def test_upsert_stores_reports_lines_over_the_size_limit(client):
+    line = (
+        '{"country_id": 4, "tax_id": "78.950.000-1", "name": "Sized", '
+        '"legal_name": "Sized SpA", "address": "Av. Siempre Viva 742", '
+        '"zip_code": "8320000", "email": "sized@store.cl"}'
+    )
+    body = f'{line}\n{{"name": "{"x" * 70000}"}}\n'.encode()
+
+    response = client.post(
+        "/stores/bulk",
+        data=(body[start : start + 4096] for start in range(0, len(body), 4096)),
+        headers={**SUPERUSER, "current-user-id": "402"},
+    )
+
+    assert response.status_code == 200
+    assert response.json()["created"] == 1
+    assert response.json()["errors"] == [
+        {"line": 2, "tax_id": None, "detail": "The line is longer than 65536 bytes"}
+    ]
+
+
+def test_store_reads_are_cached_until_a_write(client, store_ids, query_counter):
+    store_id = store_ids[1]
+    admin = {"current-user-id": "200"}
+    client.get(f"/stores/{store_id}", headers=SUPERUSER)
+    client.get(f"/workers/{store_id}/200", headers=admin)
+
+    with query_counter:
+        store = client.get(f"/stores/{store_id}", headers=SUPERUSER).json()
+        worker = client.get(f"/workers/{store_id}/200", headers=admin).json()
+    assert query_counter.count == 0
+    assert worker["store_name"] == store["name"] == "Store 1"
+
+    update = {
+        "name": "Renamed store",
+        "legal_name": "Store 1 SpA",
+        "address": "Av. Siempre Viva 742",
+        "zip_code": "8320000",
+        "email": "stores@store.cl",
+    }
+    client.put(f"/stores/{store_id}", json=update, headers=SUPERUSER)
+
+    store = client.get(f"/stores/{store_id}", headers=SUPERUSER).json()
+    worker = client.get(f"/workers/{store_id}/200", headers=admin).json()
+    assert worker["store_name"] == store["name"] == "Renamed store"
+
+
+def test_lookup_stores_in_request_order(client, store_ids, query_counter):
+    admin = {"current-user-id": "200"}
+    seller = {"current-user-id": "201"}
+    client.post(f"/stores/{store_ids[1]}/activate", headers=SUPERUSER)
+    new_worker = {"user_id": 201, "store_id": store_ids[1], "rol_id": 4}
+    client.post("/workers", json=new_worker, headers=admin)
+    ids = [store_ids[2], 999999, store_ids[1], store_ids[2]]
+    params = {"ids": ",".join(map(str, ids))}
+
+    with query_counter:
+        response = client.get("/stores", params=params, headers=admin)
+
+    assert response.status_code == 200
+    stores = response.json()["stores"]
+    assert [store["id"] for store in stores] == ids
+    assert stores[0]["store"]["name"] == "Store 2"
+    assert stores[0] == stores[3]
+    # Like GET /stores/{store_id}, a missing store looks like any other foreign one
+    assert stores[1] == {"id": 999999, "store": None, "detail": "Worker not found"}
+    assert stores[2]["detail"] is None
+    assert query_counter.count == 1
+
+    sellers = client.get("/stores", params=params, headers=seller).json()["stores"]
+    assert [store["detail"] for store in sellers] == [
+        "Worker not found",
+        "Worker not found",
+        "The user is not authorized",
+        "Worker not found",
+    ]
+    superusers = client.get("/stores", params=params, headers=SUPERUSER).json()
+    assert [store["detail"] for store in superusers["stores"]] == [
+        None,
+        "Store not found",
+        None,
+        None,
+    ]
+
+
+def test_lookup_stores_rejects_invalid_ids(client):
+    for ids in ("", "1,a", ",".join(["1"] * 501)):
+        response = client.get("/stores", params={"ids": ids}, headers=SUPERUSER)
+        assert response.status_code == 400
+    response = client.get("/stores", params={"ids": "1"})
+    assert response.json()["detail"] == "The user is not valid"
+
+
+def test_search_stores_crawls_every_match(client, store_ids, query_counter):
+    seen = []
+    params = {"q": "76.100.00", "per_page": 3}
+    with query_counter:
+        while True:
+            response = client.get("/stores/search", params=params, headers=SUPERUSER)
+            assert response.status_code == 200
+            data = response.json()
+            seen += [store["id"] for store in data["stores"]]
+            if not data["next_cursor"]:
+                break
+            params["cursor"] = data["next_cursor"]
+
+    assert sorted(seen) == store_ids
+    assert query_counter.count == 3
+
+
+def test_search_stores_ranks_name_matches_first(client, store_ids):
+    response = client.get(
+        "/stores/search", params={"q": " Store 3 "}, headers=SUPERUSER
+    )
+
+    stores = response.json()["stores"]
+    assert stores[0]["id"] == store_ids[3]
+    assert all("store" in store["name"].lower() for store in stores)
+
+
+def test_search_stores_validation(client):
+    response = client.get("/stores/search", params={"q": "store"})
+    assert response.status_code == 401
+    response = client.get("/stores/search", params={"q": " a "}, headers=SUPERUSER)
+    assert response.status_code == 400
+    response = client.get("/stores/search", params={"q": "100%_"}, headers=SUPERUSER)
+    assert response.json()["stores"] == []
+
+
+def test_store_stats_follow_the_worker_writes(client):
+    admin = {"current-user-id": "300"}
+    new_store = {
+        "country_id": 3,
+        "tax_id": "76.500.000-1",
+        "name": "Stats store",
+        "legal_name": "Stats store SpA",
+        "address": "Av. Siempre Viva 742",
+        "zip_code": "8320000",
+        "email": "stats@store.cl",
+    }
+    store_id = client.post("/stores", json=new_store, headers=admin).json()["id"]
+    client.post(f"/stores/{store_id}/activate", headers=SUPERUSER)
+    bulk = {
+        "store_id": store_id,
+        "workers": [{"user_id": user_id, "rol_id": 4} for user_id in range(301, 305)],
+    }
+    client.post("/workers/bulk", json=bulk, headers=admin)
+    client.put(f"/workers/{store_id}/301", json={"rol_id": 3}, headers=admin)
+    client.delete(f"/workers/{store_id}/302", headers=admin)
+    client.delete(f"/workers/{store_id}/303/delete", headers=admin)
+
+    response = client.get(f"/stores/{store_id}/stats", headers=admin)
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "store_id": store_id,
+        "workers": 4,
+        "active_workers": 3,
+        "roles": [
+            {"rol_id": 1, "workers": 1, "active_workers": 1},
+            {"rol_id": 3, "workers": 1, "active_workers": 1},
+            {"rol_id": 4, "workers": 2, "active_workers": 1},
+        ],
+    }
+    seller = client.get(f"/stores/{store_id}/stats", headers={"current-user-id": "304"})
+    assert seller.status_code == 401
+    missing = client.get("/stores/999999/stats", headers=SUPERUSER)
+    assert missing.status_code == 404
+
+
+def test_stores_stats_follow_the_store_writes(client):
+    def counts():
+        stats = client.get("/stores/stats", headers=SUPERUSER).json()
+        countries = {count.pop("country_id"): count for count in stats["countries"]}
+        roles = {count.pop("rol_id"): count for count in stats["roles"]}
+        return countries, roles
+
+    countries, roles = counts()
+    new_store = {
+        "country_id": 4,
+        "tax_id": "76.500.001-1",
+        "name": "Stats store",
+        "legal_name": "Stats store SpA",
+        "address": "Av. Siempre Viva 742",
+        "zip_code": "8320000",
+        "email": "stats@store.cl",
+    }
+    store = client.post("/stores", json=new_store, headers={"current-user-id": "310"})
+    client.post(f"/stores/{store.json()['id']}/activate", headers=SUPERUSER)
+    after_countries, after_roles = counts()
+
+    before = countries.get(4, {"stores": 0, "active_stores": 0})
+    assert after_countries[4] == {
+        "stores": before["stores"] + 1,
+        "active_stores": before["active_stores"] + 1,
+    }
+    assert after_roles[1]["workers"] == roles[1]["workers"] + 1
+    assert client.get("/stores/stats").status_code == 401
+
+
+def test_folding_the_counters_keeps_the_stats(client):
+    def keys():
+        with TestingSessionLocal() as db:
+            countries = db.scalars(select(CountryStoreCount.country_id)).all()
+            roles = db.scalars(select(RolWorkerCount.rol_id)).all()
+        return countries, roles
+
+    new_store = {
+        "country_id": 4,
+        "tax_id": "76.500.002-1",
+        "name": "Folded store",
+        "legal_name": "Folded store SpA",
+        "address": "Av. Siempre Viva 742",
+        "zip_code": "8320000",
+        "email": "stats@store.cl",
+    }
+    client.post("/stores", json=new_store, headers={"current-user-id": "311"})
+    stats = client.get("/stores/stats", headers=SUPERUSER).json()
+    countries, roles = keys()
+    assert len(roles) > len(set(roles))
+
+    asyncio.run(fold_counters())
+
+    assert client.get("/stores/stats", headers=SUPERUSER).json() == stats
+    countries, roles = keys()
+    assert sorted(countries) == [count["country_id"] for count in stats["countries"]]
+    assert sorted(roles) == [count["rol_id"] for count in stats["roles"]]
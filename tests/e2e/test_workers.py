@@ -0,0 +1,257 @@
+import pytest
+
+ADMIN_ID = 100
+SUPERUSER = {"superuser": "true"}
+ADMIN = {"current-user-id": str(ADMIN_ID)}
+
+
+@pytest.fixture(scope="module")
+def store_id(client):
+    new_store = {
+        "country_id": 1,
+        "tax_id": "76.000.001-1",
+        "name": "Workers store",
+        "legal_name": "Workers store SpA",
+        "address": "Av. Siempre Viva 742",
+        "zip_code": "8320000",
+        "email": "workers@store.cl",
+    }
+    store = client.post("/stores", json=new_store, headers=ADMIN).json()
+    client.post(f"/stores/{store['id']}/activate", headers=SUPERUSER)
+    for user_id in range(ADMIN_ID + 1, ADMIN_ID + 21):
+        new_worker = {"user_id": user_id, "store_id": store["id"], "rol_id": 4}
+        client.post("/workers", json=new_worker, headers=ADMIN)
+    return store["id"]
+
+
+def test_get_workers_loads_store_and_rol_in_one_query(client, store_id, query_counter):
+    with query_counter:
+        response = client.get(
+            "/workers", params={"store_id": store_id, "per_page": 50}, headers=ADMIN
+        )
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["store_name"] == "Workers store"
+    assert len(data["workers"]) == 21
+    assert {worker["rol_name"] for worker in data["workers"]} == {"Admin", "Seller"}
+    # validate_rol lookup + workers page, independent of the page size
+    assert query_counter.count == 2
+
+
+def test_get_worker_loads_store_and_rol_in_one_query(client, store_id, query_counter):
+    with query_counter:
+        response = client.get(f"/workers/{store_id}/{ADMIN_ID + 1}", headers=ADMIN)
+
+    assert response.status_code == 200
+    assert response.json()["store_name"] == "Workers store"
+    assert response.json()["rol_name"] == "Seller"
+    assert query_counter.count == 2
+
+
+def test_validate_rol_is_served_from_cache(client, store_id, query_counter):
+    client.get(f"/workers/{store_id}/{ADMIN_ID}", headers=ADMIN)
+
+    with query_counter:
+        response = client.get(f"/workers/{store_id}/{ADMIN_ID + 1}", headers=ADMIN)
+
+    assert response.status_code == 200
+    assert query_counter.count == 1
+
+
+def test_worker_writes_invalidate_rol_cache(client, store_id):
+    manager = {"current-user-id": str(ADMIN_ID + 3)}
+    client.put(f"/workers/{store_id}/{ADMIN_ID + 3}", json={"rol_id": 2}, headers=ADMIN)
+    assert (
+        client.get(f"/workers/{store_id}/{ADMIN_ID}", headers=manager).status_code
+        == 200
+    )
+
+    client.delete(f"/workers/{store_id}/{ADMIN_ID + 3}", headers=ADMIN)
+
+    response = client.get(f"/workers/{store_id}/{ADMIN_ID}", headers=manager)
+    assert response.status_code == 401
+
+
+def test_update_worker_returns_new_rol(client, store_id):
+    response = client.put(
+        f"/workers/{store_id}/{ADMIN_ID + 2}", json={"rol_id": 2}, headers=ADMIN
+    )
+
+    assert response.status_code == 200
+    assert response.json()["rol_id"] == 2
+    assert response.json()["rol_name"] == "Manager"
+
+
+def test_worker_reads_see_the_worker_writes(client, store_id):
+    url = f"/workers/{store_id}/{ADMIN_ID + 7}"
+    assert client.get(url, headers=ADMIN).json()["rol_name"] == "Seller"
+
+    client.put(url, json={"rol_id": 3}, headers=ADMIN)
+    assert client.get(url, headers=ADMIN).json()["rol_name"] == "Accountant"
+
+    client.delete(url, headers=ADMIN)
+    assert client.get(url, headers=ADMIN).json()["active"] is False
+    client.post(f"{url}/activate", headers=ADMIN)
+    assert client.get(url, headers=ADMIN).json()["active"] is True
+
+
+def test_get_workers_cursor_crawls_every_worker(client, store_id):
+    seen = []
+    params = {"store_id": store_id, "per_page": 6}
+    while True:
+        response = client.get("/workers", params=params, headers=ADMIN)
+        assert response.status_code == 200
+        data = response.json()
+        seen.extend(worker["user_id"] for worker in data["workers"])
+        if data["next_cursor"] is None:
+            break
+        params["cursor"] = data["next_cursor"]
+
+    assert seen == list(range(ADMIN_ID, ADMIN_ID + 21))
+
+
+def test_get_workers_rejects_cursor_from_other_store(client, store_id):
+    first = client.get(
+        "/workers", params={"store_id": store_id, "per_page": 2}, headers=ADMIN
+    ).json()
+    response = client.get(
+        "/workers",
+        params={"store_id": store_id + 1, "cursor": first["next_cursor"]},
+        headers=SUPERUSER,
+    )
+
+    assert response.status_code == 400
+
+
+def test_create_workers_in_bulk(client, store_id, query_counter):
+    bulk = {
+        "store_id": store_id,
+        "workers": [
+            {"user_id": user_id, "rol_id": 4} for user_id in range(1000, 1500)
+        ]
+        + [
+            {"user_id": 1000, "rol_id": 4},
+            {"user_id": 1500, "rol_id": 99},
+            {"user_id": ADMIN_ID + 1, "rol_id": 4},
+        ],
+    }
+
+    with query_counter:
+        response = client.post("/workers/bulk", json=bulk, headers=ADMIN)
+
+    assert response.status_code == 200
+    data = response.json()
+    assert data["created"] == 500
+    assert [row["status"] for row in data["results"][-4:]] == [
+        "created",
+        "duplicated",
+        "invalid_rol",
+        "exists",
+    ]
+    # store and caller rol, roles, existing workers and a single insert
+    assert query_counter.count == 4
+
+    response = client.get(f"/workers/{store_id}/1499", headers=ADMIN)
+    assert response.json()["rol_name"] == "Seller"
+
+
+def test_create_workers_in_bulk_requires_admin(client, store_id):
+    bulk = {"store_id": store_id, "workers": [{"user_id": 2000, "rol_id": 4}]}
+
+    response = client.post(
+        "/workers/bulk", json=bulk, headers={"current-user-id": str(ADMIN_ID + 1)}
+    )
+
+    assert response.status_code == 401
+
+
+def test_worker_writes_check_access_in_one_query(client, store_id, query_counter):
+    with query_counter:
+        response = client.put(
+            f"/workers/{store_id}/{ADMIN_ID + 4}", json={"rol_id": 3}, headers=ADMIN
+        )
+
+    assert response.status_code == 200
+    # store, caller and target in one query, then the write and its row
+    assert query_counter.count == 3
+
+
+def test_worker_writes_keep_the_access_errors_order(client, store_id, query_counter):
+    new_store = {
+        "country_id": 1,
+        "tax_id": "76.000.002-1",
+        "name": "Inactive store",
+        "legal_name": "Inactive store SpA",
+        "address": "Av. Siempre Viva 742",
+        "zip_code": "8320000",
+        "email": "inactive@store.cl",
+    }
+    inactive_id = client.post("/stores", json=new_store, headers=ADMIN).json()["id"]
+    seller = {"current-user-id": str(ADMIN_ID + 5)}
+    cases = [
+        (f"/workers/0/{ADMIN_ID + 5}", SUPERUSER, 404, "Store not found"),
+        (f"/workers/{inactive_id}/{ADMIN_ID}", ADMIN, 401, "The store is not active"),
+        (f"/workers/{store_id}/{ADMIN_ID + 5}", {}, 400, "The user is not valid"),
+        (
+            f"/workers/{store_id}/{ADMIN_ID + 5}",
+            {"current-user-id": "99999"},
+            404,
+            "Worker not found",
+        ),
+        (
+            f"/workers/{store_id}/{ADMIN_ID + 6}",
+            seller,
+            401,
+            "The user is not authorized",
+        ),
+        (f"/workers/{store_id}/99999", ADMIN, 404, "Worker not found"),
+    ]
+
+    for url, headers, status_code, detail in cases:
+        with query_counter:
+            response = client.delete(url, headers=headers)
+        assert (response.status_code, response.json()["detail"]) == (
+            status_code,
+            detail,
+        ), url
+        # Rejected before any write
+        assert query_counter.count == 1
+
+
+def test_lookup_workers_in_request_order(client, store_id, query_counter):
+    keys = [
+        {"store_id": store_id, "user_id": ADMIN_ID + 9},
+        {"store_id": store_id, "user_id": 999999},
+        {"store_id": 999999, "user_id": ADMIN_ID + 9},
+        {"store_id": store_id, "user_id": ADMIN_ID + 9},
+    ]
+
+    with query_counter:
+        response = client.post("/workers/lookup", json={"workers": keys}, headers=ADMIN)
+
+    assert response.status_code == 200
+    workers = response.json()["workers"]
+    assert [{k: w[k] for k in ("store_id", "user_id")} for w in workers] == keys
+    assert workers[0]["worker"]["store_name"] == "Workers store"
+    assert workers[0]["worker"]["rol_name"] == "Seller"
+    assert workers[0] == workers[3]
+    assert [worker["detail"] for worker in workers] == [
+        None,
+        "Worker not found",
+        "Worker not found",
+        None,
+    ]
+    # Caller roles in every store + the workers
+    assert query_counter.count == 2
+
+    seller = {"current-user-id": str(ADMIN_ID + 8)}
+    response = client.post("/workers/lookup", json={"workers": keys}, headers=seller)
+    assert [worker["detail"] for worker in response.json()["workers"]] == [
+        "The user is not authorized",
+        "The user is not authorized",
+        "Worker not found",
+        "The user is not authorized",
+    ]
+    # It only reads, so it doesn't keep the client on the primary
+    assert "read_primary_until" not in response.cookies
@@ -0,0 +1,99 @@
+import asyncio
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from src.adapters.orm import Base
+from src.adapters.unit_of_work import get_unit_of_work
+from src.domain import schemas
+from src.domain.models import WorkerDeletion
+from src.handlers.stores import StoresHandler
+from src.handlers.workers import WorkersHandler
+from tests.conftest import POSTGRES_URL, create_postgres_schema, requires_postgres
+
+pytestmark = requires_postgres
+
+
+def new_store(tax_id: str) -> schemas.StoreCreate:
+    return schemas.StoreCreate(
+        country_id=1,
+        tax_id=tax_id,
+        name="Fed store",
+        legal_name="Fed store SpA",
+        address="Av. Siempre Viva 742",
+        zip_code="8320000",
+        email="feeds@store.cl",
+    )
+
+
+def run(test):
+    async def main():
+        engine = create_async_engine(POSTGRES_URL)
+        await create_postgres_schema(engine)
+        try:
+            return await test(engine)
+        finally:
+            async with engine.begin() as connection:
+                await connection.run_sync(Base.metadata.drop_all)
+            await engine.dispose()
+
+    return asyncio.run(main())
+
+
+async def create_store(engine, tax_id: str) -> int:
+    async with AsyncSession(engine) as db:
+        async with get_unit_of_work(db).transaction():
+            store = await StoresHandler(db).create_store(new_store(tax_id))
+    return store.id
+
+
+def test_store_changes_wait_for_the_transactions_still_open():
+    async def test(engine):
+        # A session per read, like a request
+        async def changes(after):
+            async with AsyncSession(engine) as db:
+                return await StoresHandler(db).get_store_changes(100, after)
+
+        async with AsyncSession(engine) as importer:
+            async with get_unit_of_work(importer).transaction():
+                # Stamped when the import began, committed after a later write
+                await StoresHandler(importer).create_store(new_store("76.930.001-1"))
+                await create_store(engine, "76.930.002-1")
+                seen = await changes(None)
+        after = (seen[-1].updated_at, seen[-1].id) if seen else None
+        seen += await changes(after)
+        return [store.tax_id for store in seen]
+
+    assert run(test) == ["76.930.001-1", "76.930.002-1"]
+
+
+def test_worker_changes_report_deleted_workers():
+    async def test(engine):
+        store_id = await create_store(engine, "76.930.003-1")
+        worker = schemas.WorkerCreate(user_id=2, store_id=store_id, rol_id=1)
+
+        async def write(action, *args):
+            async with AsyncSession(engine) as db:
+                async with get_unit_of_work(db).transaction():
+                    await getattr(WorkersHandler(db), action)(*args)
+
+        async def changes(after=None):
+            async with AsyncSession(engine) as db:
+                workers = await WorkersHandler(db).get_worker_changes(100, after)
+            return [(row.user_id, row.deleted) for row in workers], workers
+
+        await write("create_worker", worker)
+        _, workers = await changes()
+        after = (workers[-1].updated_at, workers[-1].store_id, workers[-1].user_id)
+
+        await write("delete_worker", store_id, 2)
+        deleted, _ = await changes(after)
+        await write("create_worker", worker)
+        created, _ = await changes(after)
+        async with AsyncSession(engine) as db:
+            deletions = await db.scalar(
+                select(func.count()).select_from(WorkerDeletion)
+            )
+        return deleted, created, deletions
+
+    assert run(test) == ([(2, True)], [(2, False)], 0)
@@ -0,0 +1,95 @@
+import asyncio
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from src.adapters.orm import Base
+from src.adapters.unit_of_work import get_unit_of_work
+from src.domain import schemas
+from src.domain.models import CountryStoreCount, RolWorkerCount
+from src.handlers.stores import StoresHandler
+from src.handlers.workers import WorkersHandler
+from tests.conftest import POSTGRES_URL, create_postgres_schema, requires_postgres
+
+pytestmark = requires_postgres
+
+
+def new_store(tax_id: str) -> schemas.StoreCreate:
+    return schemas.StoreCreate(
+        country_id=1,
+        tax_id=tax_id,
+        name="Counted store",
+        legal_name="Counted store SpA",
+        address="Av. Siempre Viva 742",
+        zip_code="8320000",
+        email="counters@store.cl",
+    )
+
+
+# Same as POST /stores
+async def create_store(db: AsyncSession, tax_id: str, user_id: int):
+    async with get_unit_of_work(db).transaction():
+        store = await StoresHandler(db).create_store(new_store(tax_id))
+        await WorkersHandler(db).create_worker(
+            schemas.WorkerCreate(user_id=user_id, store_id=store.id, rol_id=1)
+        )
+
+
+def test_store_writes_dont_wait_for_a_bulk_import(monkeypatch):
+    # The first two stores are written, with their admins, before the import stops
+    monkeypatch.setattr(StoresHandler, "bulk_chunk_size", 2)
+
+    async def main():
+        engine = create_async_engine(POSTGRES_URL)
+        await create_postgres_schema(engine)
+
+        paused, resume = asyncio.Event(), asyncio.Event()
+
+        async def stores():
+            for line in range(1, 4):
+                yield line, new_store(f"76.900.00{line}-1")
+            paused.set()
+            await resume.wait()
+
+        async def bulk_import():
+            async with AsyncSession(engine) as db:
+                return await StoresHandler(db).upsert_stores(stores(), owner_id=1)
+
+        importing = asyncio.create_task(bulk_import())
+        await paused.wait()
+        try:
+            async with AsyncSession(engine) as db:
+                for user_id in (2, 3):
+                    await asyncio.wait_for(
+                        create_store(db, f"76.910.00{user_id}-1", user_id), timeout=5
+                    )
+        finally:
+            resume.set()
+            summary = await importing
+
+        async with AsyncSession(engine) as db:
+            stats = await StoresHandler(db).get_stats()
+            async with get_unit_of_work(db).transaction():
+                await StoresHandler(db).fold_counters()
+            folded = await StoresHandler(db).get_stats()
+            rows = [
+                await db.scalar(select(func.count()).select_from(model))
+                for model in (CountryStoreCount, RolWorkerCount)
+            ]
+
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.drop_all)
+        await engine.dispose()
+        return summary, stats, folded, rows
+
+    summary, stats, folded, rows = asyncio.run(main())
+
+    assert summary["created"] == 3
+    countries, roles = stats
+    assert [tuple(count) for count in countries] == [(1, 5, 0)]
+    assert [tuple(count) for count in roles] == [(1, 5, 5)]
+    assert [[tuple(count) for count in counts] for counts in folded] == [
+        [(1, 5, 0)],
+        [(1, 5, 5)],
+    ]
+    assert rows == [1, 1]
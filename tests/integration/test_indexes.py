@@ -0,0 +1,118 @@
+import re
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.dialects import sqlite
+
+from src.domain.models import Store, Worker
+from src.utils.pagination import encode_change_token
+from tests.conftest import engine
+
+CURSOR = encode_change_token(datetime(2026, 1, 1), 1)
+
+
+def explain(statement, parameters=()) -> str:
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(
+            f"EXPLAIN QUERY PLAN {statement}", tuple(parameters)
+        ).all()
+    return "\n".join(row[-1] for row in rows)
+
+
+def explain_query(query) -> str:
+    compiled = query.compile(dialect=sqlite.dialect())
+    parameters = [compiled.params[name] for name in compiled.positiontup]
+    return explain(str(compiled), parameters)
+
+
+@pytest.fixture(scope="module")
+def store_id(client):
+    new_store = {
+        "country_id": 3,
+        "tax_id": "76.200.000-1",
+        "name": "Indexed store",
+        "legal_name": "Indexed store SpA",
+        "address": "Av. Siempre Viva 742",
+        "zip_code": "8320000",
+        "email": "indexes@store.cl",
+    }
+    store = client.post(
+        "/stores", json=new_store, headers={"current-user-id": "300"}
+    ).json()
+    return store["id"]
+
+
+def test_get_workers_page_uses_store_index(client, store_id, query_counter):
+    with query_counter:
+        client.get(
+            "/workers", params={"store_id": store_id}, headers={"superuser": "true"}
+        )
+
+    plan = explain(query_counter.statements[-1], query_counter.parameters[-1])
+    assert "ix_workers_store_id_user_id" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+@pytest.mark.parametrize(
+    "params, index",
+    [
+        ({"sort": "created_at"}, "ix_stores_created_at_id"),
+        ({"sort": "-updated_at", "active": "true"}, "ix_stores_updated_at_id"),
+        ({"country_id": 3}, "ix_stores_country_id_id"),
+        (
+            {"country_id": 3, "sort": "-created_at", "active": "false"},
+            "ix_stores_country_id_created_at_id",
+        ),
+        (
+            {"country_id": 3, "sort": "updated_at", "cursor": CURSOR},
+            "ix_stores_country_id_updated_at_id",
+        ),
+    ],
+)
+def test_get_stores_walks_an_index_in_order(
+    client, store_id, query_counter, params, index
+):
+    with query_counter:
+        client.get("/stores", params=params, headers={"superuser": "true"})
+
+    plan = explain(query_counter.statements[-1], query_counter.parameters[-1])
+    assert index in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_active_workers_by_store_and_rol_use_partial_index():
+    query = select(Worker.user_id).filter(
+        Worker.store_id == 1, Worker.rol_id == 2, Worker.active.is_(True)
+    )
+
+    plan = explain_query(query)
+    assert "ix_workers_store_id_rol_id_active" in plan
+
+
+def test_workers_by_rol_use_rol_index():
+    plan = explain_query(select(Worker.user_id).filter(Worker.rol_id == 2))
+
+    assert "ix_workers_rol_id" in plan
+
+
+def test_stores_by_country_use_country_id_index():
+    plan = explain_query(select(Store.id).filter(Store.country_id == 1))
+
+    assert re.findall(r"INDEX (\w+)", plan) == ["ix_stores_country_id_id"]
+
+
+def test_active_stores_use_partial_index():
+    query = select(Store.id).filter(Store.active.is_(True)).order_by(Store.id)
+
+    plan = explain_query(query)
+    assert "ix_stores_id_active" in plan
+
+
+def test_store_stats_read_the_counters_by_key(client, store_id, query_counter):
+    with query_counter:
+        client.get(f"/stores/{store_id}/stats", headers={"superuser": "true"})
+
+    plan = explain(query_counter.statements[-1], query_counter.parameters[-1])
+    assert "SCAN" not in plan
+    assert "sqlite_autoindex_store_worker_counts" in plan
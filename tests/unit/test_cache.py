@@ -0,0 +1,52 @@
+from src.utils.cache import TTLCache
+
+
+def test_get_returns_missing_until_set():
+    cache = TTLCache(maxsize=2, ttl=10)
+
+    assert cache.get("a") is TTLCache.missing
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_entries_expire_after_ttl(timer):
+    cache = TTLCache(maxsize=2, ttl=10, timer=timer)
+    cache.set("a", 1)
+
+    timer.now += 9.9
+    assert cache.get("a") == 1
+    timer.now += 0.1
+    assert cache.get("a") is TTLCache.missing
+    assert cache.stats()["expirations"] == 1
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is TTLCache.missing
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_invalidate_removes_entry():
+    cache = TTLCache(maxsize=2, ttl=10)
+    cache.set("a", 1)
+    cache.invalidate("a")
+    cache.invalidate("missing")
+
+    assert cache.get("a") is TTLCache.missing
+
+
+def test_zero_ttl_disables_cache():
+    cache = TTLCache(maxsize=2, ttl=0)
+    cache.set("a", 1)
+
+    assert cache.get("a") is TTLCache.missing
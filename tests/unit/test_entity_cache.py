@@ -0,0 +1,186 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from src.adapters.cache import EntityCache, InMemorySharedCache
+from src.utils.cache import TTLCache
+
+
+class Loader:
+    def __init__(self, value=None, delay: float = 0) -> None:
+        self.value = value
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.value is None:
+            raise HTTPException(status_code=404, detail="Store not found")
+        return self.value
+
+
+def process_cache(shared, timer, local_ttl=1):
+    return EntityCache(
+        "store",
+        TTLCache(maxsize=10, ttl=local_ttl, timer=timer),
+        shared,
+        ttl=60,
+        timer=timer,
+    )
+
+
+def test_reads_through_and_reloads_after_invalidation():
+    cache = EntityCache("store", TTLCache(maxsize=10, ttl=60))
+    load = Loader({"id": 1, "name": "Store"})
+
+    async def main():
+        assert await cache.get(1, load) == {"id": 1, "name": "Store"}
+        await cache.get(1, load)
+        await cache.invalidate(1)
+        await cache.get(1, load)
+
+    asyncio.run(main())
+
+    assert load.calls == 2
+
+
+def test_processes_share_rows_and_invalidations(timer):
+    shared = InMemorySharedCache(timer=timer)
+    first, second = process_cache(shared, timer), process_cache(shared, timer)
+    load = Loader({"id": 1, "name": "Store"})
+
+    async def main():
+        await first.get(1, load)
+        await second.get(1, load)
+        assert load.calls == 1
+        assert second.shared_hits == 1
+
+        await first.invalidate(1)
+        load.value = {"id": 1, "name": "Renamed"}
+        # The other process keeps its own copy until the local ttl
+        assert (await second.get(1, load))["name"] == "Store"
+        timer.now += 1
+        assert (await second.get(1, load))["name"] == "Renamed"
+
+    asyncio.run(main())
+
+
+def test_concurrent_misses_load_once():
+    cache = EntityCache("store", TTLCache(maxsize=10, ttl=60))
+    load = Loader({"id": 1}, delay=0.01)
+    missing = Loader(delay=0.01)
+
+    async def main():
+        values = await asyncio.gather(*(cache.get(1, load) for _ in range(20)))
+        assert values == [{"id": 1}] * 20
+        results = await asyncio.gather(
+            *(cache.get(2, missing) for _ in range(5)), return_exceptions=True
+        )
+        assert all(isinstance(result, HTTPException) for result in results)
+
+    asyncio.run(main())
+
+    assert load.calls == 1
+    assert missing.calls == 1
+
+
+def test_expired_rows_are_reloaded_by_one_process_only(timer):
+    shared = InMemorySharedCache(timer=timer)
+    first, second = process_cache(shared, timer), process_cache(shared, timer)
+    load = Loader({"id": 1, "name": "Store"})
+
+    async def main():
+        await first.get(1, load)
+        timer.now += 61
+        # Another process is reloading the row, this one serves the stale copy
+        await shared.add("store:1:lock", b"1", 5)
+        load.value = {"id": 1, "name": "Renamed"}
+        assert (await second.get(1, load))["name"] == "Store"
+        assert second.stale_hits == 1
+
+        await shared.delete("store:1:lock")
+        timer.now += 1
+        assert (await second.get(1, load))["name"] == "Renamed"
+
+    asyncio.run(main())
+
+    assert load.calls == 2
+
+
+def test_replica_reads_use_the_cache_but_never_fill_it(timer):
+    shared = InMemorySharedCache(timer=timer)
+    first, second = process_cache(shared, timer), process_cache(shared, timer)
+    replica = Loader({"id": 1, "name": "Store"})
+    primary = Loader({"id": 1, "name": "Renamed"})
+
+    async def main():
+        # The replica is behind the write that just invalidated the row
+        assert (await first.get(1, replica, replica=True))["name"] == "Store"
+        assert (await first.get(1, primary))["name"] == "Renamed"
+        # Rows read on the primary are served to replica reads, from both tiers
+        assert (await first.get(1, replica, replica=True))["name"] == "Renamed"
+        assert (await second.get(1, replica, replica=True))["name"] == "Renamed"
+
+    asyncio.run(main())
+
+    assert (replica.calls, primary.calls) == (1, 1)
+    assert second.shared_hits == 1
+
+
+def test_primary_reads_dont_join_replica_reads_in_flight():
+    cache = EntityCache("store", TTLCache(maxsize=10, ttl=60))
+    replica = Loader({"id": 1, "name": "Store"}, delay=0.01)
+    primary = Loader({"id": 1, "name": "Renamed"}, delay=0.01)
+
+    async def main():
+        return await asyncio.gather(
+            cache.get(1, replica, replica=True),
+            cache.get(1, primary),
+            cache.get(1, primary),
+        )
+
+    from_replica, *from_primary = asyncio.run(main())
+
+    assert from_replica["name"] == "Store"
+    assert [store["name"] for store in from_primary] == ["Renamed", "Renamed"]
+    assert (replica.calls, primary.calls) == (1, 1)
+
+
+class BrokenSharedCache(InMemorySharedCache):
+    async def get(self, key):
+        raise ConnectionError
+
+    async def delete(self, *keys):
+        raise ConnectionError
+
+
+def test_shared_tier_failures_fall_back_to_the_database(timer):
+    cache = process_cache(BrokenSharedCache(), timer)
+    load = Loader({"id": 1})
+
+    async def main():
+        assert await cache.get(1, load) == {"id": 1}
+        await cache.invalidate(1)
+        assert await cache.get(1, load) == {"id": 1}
+
+    asyncio.run(main())
+
+    assert load.calls == 2
+    assert cache.shared_errors == 3
+
+
+def test_disabled_cache_always_loads():
+    cache = EntityCache("store", TTLCache(maxsize=10, ttl=60), ttl=0)
+    load = Loader({"id": 1})
+
+    async def main():
+        for _ in range(2):
+            await cache.get(1, load)
+
+    asyncio.run(main())
+
+    assert load.calls == 2
+    with pytest.raises(HTTPException):
+        asyncio.run(cache.get(2, Loader()))
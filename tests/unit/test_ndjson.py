@@ -0,0 +1,31 @@
+import asyncio
+
+from src.utils.ndjson import iter_ndjson
+
+
+def lines(chunks, max_line_size=8):
+    async def stream():
+        for chunk in chunks:
+            yield chunk
+
+    async def main():
+        return [line async for line in iter_ndjson(stream(), max_line_size)]
+
+    return asyncio.run(main())
+
+
+def test_lines_are_numbered_across_chunks():
+    assert lines([b'{"a"', b": 1}\n\n{", b'"b": 2}']) == [
+        (1, b'{"a": 1}'),
+        (3, b'{"b": 2}'),
+    ]
+
+
+def test_long_lines_are_dropped_as_they_arrive():
+    chunks = [b"{}\n", b"x" * 6, b"x" * 6, b"x" * 6, b"\n{}\n", b"y" * 9]
+
+    assert lines(chunks) == [(1, b"{}"), (2, None), (3, b"{}"), (4, None)]
+
+
+def test_a_long_line_in_one_chunk_is_dropped():
+    assert lines([b"x" * 9 + b"\n{}"]) == [(1, None), (2, b"{}")]
@@ -0,0 +1,65 @@
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
+
+from config import Settings
+from src.adapters.orm import PoolStats, fingerprint, get_engine_options
+
+
+def test_engine_options_queue_pool():
+    settings = Settings(
+        db_pool_size=20,
+        db_max_overflow=5,
+        db_pool_timeout=2,
+        db_pool_recycle=1800,
+        db_pool_pre_ping=True,
+    )
+    options = get_engine_options(settings)
+    assert options == {
+        "pool_pre_ping": True,
+        "pool_size": 20,
+        "max_overflow": 5,
+        "pool_timeout": 2,
+        "pool_recycle": 1800,
+    }
+
+
+def test_engine_options_null_pool_with_statement_timeout():
+    settings = Settings(db_null_pool=True, db_statement_timeout=5000)
+    options = get_engine_options(settings)
+    assert options["poolclass"] is NullPool
+    assert "pool_size" not in options
+    assert options["connect_args"]["statement_cache_size"] == 0
+    assert options["connect_args"]["server_settings"] == {"statement_timeout": "5000"}
+
+
+def test_engine_options_profiling_times_the_pool():
+    options = get_engine_options(Settings(db_profiling=True))
+    assert issubclass(options["poolclass"], AsyncAdaptedQueuePool)
+
+    options = get_engine_options(Settings(db_profiling=True, db_null_pool=True))
+    assert issubclass(options["poolclass"], NullPool)
+
+
+def test_fingerprint_ignores_row_and_in_list_sizes():
+    one_row = "INSERT INTO workers (user_id, store_id) VALUES ($1, $2)"
+    many_rows = "INSERT INTO workers (user_id, store_id) VALUES ($1, $2), ($3, $4)"
+    assert fingerprint(one_row) == fingerprint(many_rows)
+
+    small_in = "SELECT roles.id FROM roles WHERE roles.id IN (?)"
+    large_in = "SELECT roles.id \nFROM roles WHERE roles.id IN (?, ?, ?)"
+    assert fingerprint(small_in) == fingerprint(large_in)
+    assert fingerprint(small_in) != fingerprint(one_row)
+
+
+def test_pool_stats_counters():
+    stats = PoolStats()
+    stats._on_connect()
+    stats._on_checkout()
+    stats._on_checkout()
+    stats._on_checkin()
+    assert stats.as_dict() == {
+        "connects": 1,
+        "checkouts": 2,
+        "checkins": 1,
+        "checked_out": 1,
+        "invalidations": 0,
+    }
@@ -0,0 +1,51 @@
+import asyncio
+
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.adapters.orm import Replica, ReplicaSet
+
+
+def replica(healthy=True, lag=0.0):
+    replica = Replica(create_async_engine("sqlite+aiosqlite://"))
+    replica.healthy = healthy
+    replica.lag = lag
+    return replica
+
+
+def test_pick_balances_over_the_replicas_in_sync():
+    first, second = replica(), replica()
+    replicas = ReplicaSet([first, replica(healthy=False), second, replica(lag=9)], 5)
+
+    picks = [replicas.pick() for _ in range(4)]
+
+    assert picks == [second, first, second, first]
+
+
+def test_pick_falls_back_to_the_primary():
+    replicas = ReplicaSet([replica(healthy=False), replica(lag=5.1)], 5)
+
+    assert replicas.pick() is None
+    assert ReplicaSet([], 5).pick() is None
+
+
+def test_replicas_not_streaming_are_left_out():
+    # The lag query reports a replica cut off from the primary as infinitely behind
+    disconnected = replica(lag=float("inf"))
+
+    assert ReplicaSet([disconnected], 5).pick() is None
+
+
+def test_check_marks_unreachable_replicas_unhealthy(tmp_path):
+    reachable = Replica(
+        create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'replica.db'}")
+    )
+    unreachable = replica()
+    unreachable.engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'missing' / 'replica.db'}"
+    )
+
+    asyncio.run(ReplicaSet([reachable, unreachable], 5).check(timeout=1))
+
+    assert reachable.healthy is True
+    assert reachable.lag == 0
+    assert unreachable.healthy is False
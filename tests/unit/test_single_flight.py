@@ -0,0 +1,117 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from src.adapters import cache
+from src.adapters.unit_of_work import get_unit_of_work
+from src.utils.single_flight import SingleFlight
+
+
+class Query:
+    def __init__(self, value=None, delay: float = 0.01) -> None:
+        self.value = value
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.value is None:
+            raise LookupError
+        return self.value
+
+
+def test_concurrent_identical_calls_run_once():
+    flights = SingleFlight()
+    query = Query(["store"])
+    failing = Query()
+
+    async def main():
+        values = await asyncio.gather(
+            *(flights.do(("get_store", 1), query) for _ in range(10)),
+            flights.do(("get_store", 2), query),
+        )
+        assert values == [["store"]] * 11
+        results = await asyncio.gather(
+            *(flights.do(("get_store", 3), failing) for _ in range(3)),
+            return_exceptions=True,
+        )
+        assert all(isinstance(result, LookupError) for result in results)
+        # Nothing is kept once the call is over
+        await flights.do(("get_store", 1), query)
+
+    asyncio.run(main())
+
+    assert query.calls == 3
+    assert failing.calls == 1
+    assert flights.stats() == {"get_store": {"calls": 4, "coalesced": 11}}
+
+
+def test_cancelled_calls_leave_the_others_running():
+    flights = SingleFlight()
+    query = Query(["store"])
+
+    async def main():
+        first = asyncio.ensure_future(flights.do(("get_store", 1), query))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(flights.do(("get_store", 1), query))
+        third = asyncio.ensure_future(flights.do(("get_store", 1), query))
+        await asyncio.sleep(0)
+        # The one running the query goes, one of the waiters runs it again
+        first.cancel()
+        assert await asyncio.gather(second, third) == [["store"]] * 2
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+        waiter = asyncio.ensure_future(flights.do(("get_store", 1), query))
+        await asyncio.sleep(0)
+        other = asyncio.ensure_future(flights.do(("get_store", 1), query))
+        await asyncio.sleep(0)
+        other.cancel()
+        assert await waiter == ["store"]
+
+    asyncio.run(main())
+
+    assert query.calls == 3
+
+
+def test_calls_after_forget_run_again():
+    flights = SingleFlight()
+    query = Query(["workers"])
+
+    async def main():
+        before = asyncio.ensure_future(flights.do(("workers", 1, 1, 10), query))
+        await asyncio.sleep(0)
+        flights.forget("workers", 2)
+        joined = asyncio.ensure_future(flights.do(("workers", 1, 1, 10), query))
+        await asyncio.sleep(0)
+        flights.forget("workers", 1)
+        after = asyncio.ensure_future(flights.do(("workers", 1, 1, 10), query))
+        await asyncio.gather(before, joined, after)
+        assert not flights.flights
+
+    asyncio.run(main())
+
+    assert query.calls == 2
+
+
+def test_coalesce_keeps_primary_replica_and_transaction_reads_apart(monkeypatch):
+    monkeypatch.setattr(cache, "single_flight", SingleFlight())
+    query = Query(["workers"])
+    primary = SimpleNamespace(info={})
+    replica = SimpleNamespace(info={"replica": True})
+    writing = SimpleNamespace(info={})
+    get_unit_of_work(writing).depth = 1
+
+    async def main():
+        await asyncio.gather(
+            *(
+                cache.coalesce(db, ("workers", 1), query)
+                for db in (primary, primary, replica, replica, writing, writing)
+            )
+        )
+
+    asyncio.run(main())
+
+    assert query.calls == 4
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+
+import pytest
+from sqlalchemy import Column, Integer, MetaData, Table, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from src.adapters.orm import use_sqlite_transactions
+from src.adapters.unit_of_work import get_unit_of_work
+
+metadata = MetaData()
+items = Table("items", metadata, Column("id", Integer, primary_key=True))
+
+
+def run_with_session(tmp_path, work):
+    async def main():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'uow.db'}")
+        use_sqlite_transactions(engine)
+        async with engine.begin() as connection:
+            await connection.run_sync(metadata.create_all)
+        async with AsyncSession(engine) as db:
+            await work(db)
+        async with AsyncSession(engine) as db:
+            count = await db.scalar(select(func.count()).select_from(items))
+        await engine.dispose()
+        return count
+
+    return asyncio.run(main())
+
+
+def test_nested_transactions_commit_once_and_run_callbacks_after(tmp_path):
+    events = []
+
+    async def work(db):
+        unit_of_work = get_unit_of_work(db)
+        async with unit_of_work.transaction():
+            async with unit_of_work.transaction():
+                await db.execute(insert(items).values(id=1))
+                await unit_of_work.after_commit(lambda: events.append("invalidated"))
+            assert events == []
+            assert db.in_transaction()
+            async with unit_of_work.transaction():
+                await db.execute(insert(items).values(id=2))
+        assert events == ["invalidated"]
+        assert not unit_of_work.active
+
+    assert run_with_session(tmp_path, work) == 2
+
+
+def test_failed_transaction_rolls_back_and_drops_callbacks(tmp_path):
+    events = []
+
+    async def work(db):
+        unit_of_work = get_unit_of_work(db)
+        with pytest.raises(ValueError):
+            async with unit_of_work.transaction():
+                await db.execute(insert(items).values(id=1))
+                await unit_of_work.after_commit(lambda: events.append("invalidated"))
+                async with unit_of_work.transaction():
+                    raise ValueError
+        await unit_of_work.after_commit(lambda: events.append("right away"))
+        assert events == ["right away"]
+
+    assert run_with_session(tmp_path, work) == 0
+
+
+def test_failing_callback_keeps_the_commit_and_the_other_callbacks(tmp_path, caplog):
+    events = []
+
+    async def fail():
+        raise RuntimeError("cache down")
+
+    async def work(db):
+        unit_of_work = get_unit_of_work(db)
+        async with unit_of_work.transaction():
+            await db.execute(insert(items).values(id=1))
+            await unit_of_work.after_commit(fail)
+            await unit_of_work.after_commit(lambda: events.append("invalidated"))
+        assert events == ["invalidated"]
+        assert not unit_of_work.active
+
+    with caplog.at_level(logging.ERROR, logger="src.adapters.unit_of_work"):
+        assert run_with_session(tmp_path, work) == 1
+    assert caplog.records[0].getMessage() == "An after commit callback failed"
+
+
+def test_savepoint_only_rolls_back_its_own_writes(tmp_path):
+    async def work(db):
+        unit_of_work = get_unit_of_work(db)
+        async with unit_of_work.transaction():
+            await db.execute(insert(items).values(id=1))
+            with pytest.raises(ValueError):
+                async with unit_of_work.savepoint():
+                    await db.execute(insert(items).values(id=2))
+                    raise ValueError
+            async with unit_of_work.savepoint():
+                await db.execute(insert(items).values(id=3))
+
+    assert run_with_session(tmp_path, work) == 2